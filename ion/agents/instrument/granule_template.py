@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.granule_template
+@file ion/agents.instrument/granule_template.py
+@brief Per-stream template for building the granules an agent publishes
+"""
+
+__license__ = 'Apache 2.0'
+
+import numpy
+
+from ion.services.dm.utility.granule.record_dictionary import RecordDictionaryTool
+
+
+class GranuleTemplate(object):
+    """
+    Everything about a stream's granules that doesn't change from sample to
+    sample, resolved once when the stream is configured: the parameter
+    dictionary, the field order and the dtype and fill value of each field.
+
+        template = GranuleTemplate(param_dict, stream_definition_id)
+        rdt = template.build([{'time': 1, 'temp': 19.06}, {'time': 2, 'temp': 19.07}])
+    """
+    def __init__(self, param_dictionary, stream_definition_id=''):
+        self.param_dictionary     = param_dictionary
+        self.stream_definition_id = stream_definition_id
+        self.fields               = list(param_dictionary.keys())
+        self.dtypes               = {} # Numeric fields only, others are inferred from the values
+        self.fill_values          = {}
+
+        for name in self.fields:
+            context = param_dictionary.get_context(name)
+            self.fill_values[name] = getattr(context, 'fill_value', None)
+            try:
+                encoding = context.param_type.value_encoding
+                if encoding is None:
+                    continue
+                dtype = numpy.dtype(encoding)
+            except (AttributeError, TypeError):
+                continue
+            if dtype.kind in 'biuf':
+                self.dtypes[name] = dtype
+
+        self._field_set = frozenset(self.fields)
+
+    def __contains__(self, name):
+        return name in self._field_set
+
+    def new_rdt(self):
+        """
+        An empty RDT on the stream, sharing the resolved parameter dictionary
+        """
+        return RecordDictionaryTool(param_dictionary=self.param_dictionary,
+                                    stream_definition_id=self.stream_definition_id)
+
+    def build(self, samples):
+        """
+        An RDT with a row per sample (dict of field to value). Values of fields
+        that aren't in the stream are ignored, a field missing from some
+        samples gets its fill value.
+        """
+        rdt = self.new_rdt()
+        present = set()
+        for values in samples:
+            present.update(values.iterkeys())
+
+        for name in self.fields:
+            if name not in present:
+                continue
+            fill_value = self.fill_values[name]
+            column = [values.get(name, fill_value) for values in samples]
+            rdt[name] = self.to_array(name, column)
+
+        return rdt
+
+    def to_array(self, name, column):
+        dtype = self.dtypes.get(name)
+        if dtype is not None:
+            try:
+                return numpy.array(column, dtype=dtype)
+            except (TypeError, ValueError):
+                pass
+        return numpy.array(column) # There might be an issue here, if a value is a list...
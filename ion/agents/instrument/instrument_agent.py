@@ -34,7 +34,7 @@ import json
 import base64
 
 # Packages
-import numpy
+import gevent
 
 # MI exceptions
 from mi.core.exceptions import InstrumentTimeoutException
@@ -52,7 +52,8 @@ from ion.agents.instrument.instrument_fsm import FSMCommandUnknownError
 from ion.agents.instrument.direct_access.direct_access_server import DirectAccessTypes
 from ion.agents.instrument.direct_access.direct_access_server import DirectAccessServer
 from ion.agents.instrument.direct_access.direct_access_server import SessionCloseReasons
-from ion.services.dm.utility.granule.record_dictionary import RecordDictionaryTool
+from ion.agents.instrument.sample_batch import SampleBatch
+from ion.agents.instrument.granule_template import GranuleTemplate
 from coverage_model.parameter import ParameterDictionary
 
 # MI imports
@@ -151,10 +152,19 @@ class InstrumentAgent(ResourceAgent):
         self._param_dicts = {}
         self._stream_defs = {}
 
+        # Prebuilt granule templates by stream name, constructed with
+        # the publishers so nothing is resolved per sample.
+        self._granule_templates = {}
+
         # Dictionary of data stream publishers. Constructed by
         # stream_config agent config member during process on_init.
         self._data_publishers = {}
 
+        # Samples waiting to be published, by stream name. Configured by
+        # the sample_batching agent config member, overridden per stream by
+        # the batching member of the stream's config.
+        self._sample_batches = {}
+
         # Factories for stream packets. Constructed by driver
         # configuration information on transition to inactive.
         self._packet_factories = {}
@@ -175,6 +185,12 @@ class InstrumentAgent(ResourceAgent):
         # Construct stream publishers.
         self._construct_data_publishers()
 
+    def on_quit(self):
+        """
+        Publish the samples still waiting in batches.
+        """
+        self._flush_sample_batches()
+        super(InstrumentAgent, self).on_quit()
 
     ##############################################################
     # Capabilities interface and event handlers.
@@ -799,38 +815,87 @@ class InstrumentAgent(ResourceAgent):
 
         try:
             stream_name = val['stream_name']
-            publisher = self._data_publishers[stream_name]
-            #param_dict = self._param_dicts[stream_name]
-            stream_def = self._stream_defs[stream_name]
-            rdt = RecordDictionaryTool(stream_definition_id=stream_def)
-            log.info("Stream definition has the followinf fields: %s" % rdt.fields)
+            if stream_name not in self._data_publishers:
+                raise KeyError(stream_name)
 
+            # Only the fields of the stream are batched
+            template = self._granule_templates[stream_name]
+            values = {}
             for (k, v) in val.iteritems():
                 if k == 'values':
                     for x in v:
-                        value_id = x['value_id']
-                        if value_id in rdt:
+                        if x['value_id'] in template:
                             value = x['value']
                             if x.get('binary', None):
                                 value = base64.b64decode(value)
-                            rdt[value_id] = numpy.array([value]) # There might be an issue here, if value is a list...
-                    
-                elif k in rdt:
+                            values[x['value_id']] = value
+
+                elif k in template:
                     if k == 'driver_timestamp':
-                        rdt['time'] = numpy.array([v])
-                    rdt[k] = numpy.array([v]) # There might be an issue here if value is a list
+                        values['time'] = v
+                    values[k] = v
+
+            batch = self._sample_batches.get(stream_name)
+            if batch is None:
+                batch = self._sample_batches[stream_name] = SampleBatch()
+
+            if batch.add(values):
+                self._flush_sample_batch(stream_name)
+
+            elif batch.max_latency and batch.timer is None:
+                batch.timer = gevent.spawn_later(batch.max_latency,
+                    self._flush_sample_batch, stream_name, True)
+
+        except:
+            log.error('Instrument agent %s could not publish data.',
+                      self._proc_name)
+
+    def _flush_sample_batch(self, stream_name, timed_out=False):
+        """
+        Publish the samples waiting for a stream as one granule.
+        """
+        batch = self._sample_batches.get(stream_name)
+        if batch is None:
+            return
+
+        if batch.timer is not None:
+            if not timed_out:
+                batch.timer.kill(block=False)
+            batch.timer = None
+
+        samples = batch.take()
+        if not samples:
+            return
+
+        try:
+            self._publish_samples(stream_name, samples)
 
-            log.info('Outgoing granule: %s' % ['%s: %s'%(k,v) for k,v in rdt.iteritems()])
-            g = rdt.to_granule(data_producer_id=self.resource_id)
-            publisher.publish(g)        
-            
-            log.info('Instrument agent %s published data granule on stream %s.',
-                     self._proc_name, stream_name)
-            
         except:
             log.error('Instrument agent %s could not publish data.',
                       self._proc_name)
 
+    def _flush_sample_batches(self):
+        """
+        Publish the samples waiting for every stream.
+        """
+        for stream_name in self._sample_batches.keys():
+            self._flush_sample_batch(stream_name)
+
+    def _publish_samples(self, stream_name, samples):
+        """
+        Publish samples (dicts of field to value) as one granule with a row
+        per sample. A field missing from some samples gets its fill value.
+        """
+        publisher = self._data_publishers[stream_name]
+        rdt = self._granule_templates[stream_name].build(samples)
+
+        log.debug('Outgoing granule: %s', rdt)
+        g = rdt.to_granule(data_producer_id=self.resource_id)
+        publisher.publish(g)
+
+        log.debug('Instrument agent %s published data granule of %d samples on stream %s.',
+                  self._proc_name, len(samples), stream_name)
+
     def _async_driver_event_error(self, val, ts):
         """
         """
@@ -1039,6 +1104,9 @@ class InstrumentAgent(ResourceAgent):
         self._dvr_proc.stop()
         log.info('Instrument agent %s stopped its driver.', self._proc_name)
 
+        # Nothing more will be added to the batches.
+        self._flush_sample_batches()
+
             
     def _validate_driver_config(self):
         """
@@ -1116,15 +1184,20 @@ class InstrumentAgent(ResourceAgent):
         
         else:
             log.info("stream_info = %s" % stream_info)
+            batch_config = self.CFG.get('sample_batching', None)
  
             for (stream_name, stream_config) in stream_info.iteritems():
                 try:
+                    self._sample_batches[stream_name] = SampleBatch.from_config(
+                        batch_config, stream_config.get('batching', None))
                     stream_id = stream_config['stream_id']
                     exchange_point = stream_config['exchange_point']
                     routing_key = stream_config['routing_key']
                     param_dict_flat = stream_config['parameter_dictionary']
                     self._param_dicts[stream_name] = ParameterDictionary.load(param_dict_flat)
                     self._stream_defs[stream_name] = stream_config['stream_definition_ref']
+                    self._granule_templates[stream_name] = GranuleTemplate(
+                        self._param_dicts[stream_name], self._stream_defs[stream_name])
                     self.route = StreamRoute(exchange_point=exchange_point, routing_key=routing_key)
                     publisher = StreamPublisher(process=self, stream_id=stream_id, stream_route=self.route)
 
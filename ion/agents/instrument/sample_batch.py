@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.sample_batch
+@file ion/agents.instrument/sample_batch.py
+@brief Accumulates driver samples of a stream into multi-row granules
+"""
+
+__license__ = 'Apache 2.0'
+
+import numpy
+
+
+class SampleBatch(object):
+    """
+    The samples of one stream waiting to be published together.
+
+    A batch is full once it holds max_samples samples or max_bytes bytes
+    of values (0 means no byte limit). max_latency is the longest a sample
+    may wait before the batch is published anyway (0 disables the timer).
+    With the defaults every sample is published on its own.
+    """
+    MAX_SAMPLES = 1
+    MAX_BYTES   = 0
+    MAX_LATENCY = 1.0
+
+    def __init__(self, max_samples=MAX_SAMPLES, max_bytes=MAX_BYTES, max_latency=MAX_LATENCY):
+        self.max_samples = max(int(max_samples), 1)
+        self.max_bytes   = max_bytes
+        self.max_latency = max_latency
+        self.samples     = []
+        self.nbytes      = 0
+        self.timer       = None
+
+    @classmethod
+    def from_config(cls, *configs):
+        """
+        A batch configured by the max_samples, max_bytes and max_latency of
+        the given configs, later configs override earlier ones.
+        """
+        kwargs = {}
+        for config in configs:
+            for key in ('max_samples', 'max_bytes', 'max_latency'):
+                if config and config.get(key) is not None:
+                    kwargs[key] = config[key]
+        return cls(**kwargs)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, values):
+        """
+        Adds a sample (dict of field to value), returns True if the batch is now full.
+        """
+        self.samples.append(values)
+        self.nbytes += sum(self.value_size(v) for v in values.itervalues())
+        return self.full()
+
+    def full(self):
+        if len(self.samples) >= self.max_samples:
+            return True
+        return bool(self.max_bytes) and self.nbytes >= self.max_bytes
+
+    def take(self):
+        """
+        Empties the batch and returns its samples
+        """
+        samples = self.samples
+        self.samples = []
+        self.nbytes  = 0
+        return samples
+
+    @staticmethod
+    def value_size(value):
+        if isinstance(value, numpy.ndarray):
+            return value.nbytes
+        if isinstance(value, basestring):
+            return len(value)
+        if isinstance(value, (list, tuple)):
+            return 8 * len(value)
+        return 8
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.test.test_granule_template
+@file ion/agents.instrument/test_granule_template.py
+@brief Test cases for the per-stream granule templates
+"""
+
+__license__ = 'Apache 2.0'
+
+from pyon.util.unit_test import PyonTestCase
+from nose.plugins.attrib import attr
+from mock import Mock, patch
+
+from ion.agents.instrument.granule_template import GranuleTemplate
+
+import numpy
+
+
+@attr('UNIT', group='mi')
+class TestGranuleTemplate(PyonTestCase):
+
+    def setUp(self):
+        encodings = {'time': 'int64', 'temp': 'float32', 'raw': None}
+        contexts = {}
+        for name, encoding in encodings.iteritems():
+            context = Mock()
+            context.param_type.value_encoding = encoding
+            context.fill_value = -9999
+            contexts[name] = context
+        self.pdict = Mock()
+        self.pdict.keys.return_value = ['time', 'temp', 'raw']
+        self.pdict.get_context.side_effect = contexts.get
+
+        patcher = patch('ion.agents.instrument.granule_template.RecordDictionaryTool')
+        self.rdt_cls = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rdt = {}
+        self.rdt_cls.return_value.__setitem__ = Mock(side_effect=self.rdt.__setitem__)
+
+        self.template = GranuleTemplate(self.pdict, 'stream_def_id')
+
+    def test_resolved_once(self):
+        self.assertEquals(self.template.fields, ['time', 'temp', 'raw'])
+        self.assertEquals(self.template.dtypes, {'time': numpy.dtype('int64'), 'temp': numpy.dtype('float32')})
+        self.assertIn('temp', self.template)
+        self.assertNotIn('stream_name', self.template)
+
+        self.template.build([{'time': 1}])
+        self.template.build([{'time': 2}])
+        self.assertEquals(self.pdict.get_context.call_count, 3)
+        self.rdt_cls.assert_called_with(param_dictionary=self.pdict, stream_definition_id='stream_def_id')
+
+    def test_build(self):
+        self.template.build([
+            {'time': 1, 'temp': 19.06, 'raw': 'abc', 'stream_name': 'parsed'},
+            {'time': 2, 'raw': 'def'},
+        ])
+
+        self.assertEquals(sorted(self.rdt.keys()), ['raw', 'temp', 'time'])
+        self.assertEquals(self.rdt['time'].dtype, numpy.dtype('int64'))
+        numpy.testing.assert_array_equal(self.rdt['time'], [1, 2])
+        numpy.testing.assert_array_almost_equal(self.rdt['temp'], [19.06, -9999], decimal=4)
+        numpy.testing.assert_array_equal(self.rdt['raw'], ['abc', 'def'])
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.test.test_sample_batch
+@file ion/agents.instrument/test_sample_batch.py
+@brief Test cases for batching driver samples into multi-row granules
+"""
+
+__license__ = 'Apache 2.0'
+
+from pyon.util.unit_test import PyonTestCase
+from nose.plugins.attrib import attr
+from mock import Mock
+
+from ion.agents.instrument.sample_batch import SampleBatch
+from ion.agents.instrument.granule_template import GranuleTemplate
+from ion.agents.instrument.instrument_agent import InstrumentAgent
+
+import gevent
+import json
+
+
+@attr('UNIT', group='mi')
+class TestSampleBatch(PyonTestCase):
+
+    def test_defaults_publish_each_sample(self):
+        batch = SampleBatch()
+        self.assertTrue(batch.add({'temp': 1.0}))
+
+    def test_full_by_count(self):
+        batch = SampleBatch(max_samples=3)
+        self.assertFalse(batch.add({'temp': 1.0}))
+        self.assertFalse(batch.add({'temp': 2.0}))
+        self.assertTrue(batch.add({'temp': 3.0}))
+        self.assertEquals(len(batch.take()), 3)
+        self.assertEquals(len(batch), 0)
+        self.assertEquals(batch.nbytes, 0)
+
+    def test_full_by_bytes(self):
+        batch = SampleBatch(max_samples=1000, max_bytes=100)
+        self.assertFalse(batch.add({'raw': 'x' * 60}))
+        self.assertTrue(batch.add({'raw': 'x' * 60}))
+
+    def test_from_config(self):
+        batch = SampleBatch.from_config({'max_samples': 10, 'max_latency': 5}, {'max_latency': 0.5}, None)
+        self.assertEquals(batch.max_samples, 10)
+        self.assertEquals(batch.max_latency, 0.5)
+        self.assertEquals(batch.max_bytes, SampleBatch.MAX_BYTES)
+
+
+@attr('UNIT', group='mi')
+class TestInstrumentAgentSampleBatching(PyonTestCase):
+
+    def setUp(self):
+        self.agent = InstrumentAgent()
+        self.agent._proc_name = 'instrument_agent'
+        self.agent._data_publishers['parsed'] = Mock()
+        self.agent._publish_samples = Mock()
+
+        pdict = Mock()
+        pdict.keys.return_value = ['time', 'driver_timestamp', 'preferred_timestamp', 'quality_flag', 'temp']
+        pdict.get_context.return_value.param_type.value_encoding = None
+        self.agent._granule_templates['parsed'] = GranuleTemplate(pdict)
+
+    def sample(self, temp, ts):
+        return json.dumps({
+            'stream_name': 'parsed',
+            'driver_timestamp': ts,
+            'preferred_timestamp': 'driver_timestamp',
+            'quality_flag': 'ok',
+            'pkt_format_id': 'JSON_Data',
+            'values': [{'value_id': 'temp', 'value': temp}, {'value_id': 'salinity', 'value': 35.1}],
+        })
+
+    def test_unbatched(self):
+        self.agent._sample_batches['parsed'] = SampleBatch()
+        self.agent._async_driver_event_sample(self.sample(19.06, 100), None)
+
+        self.assertEquals(self.agent._publish_samples.call_count, 1)
+        stream_name, samples = self.agent._publish_samples.call_args[0]
+        self.assertEquals(stream_name, 'parsed')
+        self.assertEquals(samples, [{'driver_timestamp': 100, 'time': 100, 'preferred_timestamp': 'driver_timestamp',
+                                     'quality_flag': 'ok', 'temp': 19.06}])
+
+    def test_batched_by_count(self):
+        self.agent._sample_batches['parsed'] = SampleBatch(max_samples=3, max_latency=0)
+        for i in xrange(7):
+            self.agent._async_driver_event_sample(self.sample(float(i), i), None)
+
+        self.assertEquals(self.agent._publish_samples.call_count, 2)
+        samples = self.agent._publish_samples.call_args[0][1]
+        self.assertEquals([s['temp'] for s in samples], [3.0, 4.0, 5.0])
+
+        self.agent._flush_sample_batches()
+        samples = self.agent._publish_samples.call_args[0][1]
+        self.assertEquals([s['time'] for s in samples], [6])
+
+    def test_batched_stream_fields(self):
+        # Top-level fields of the stream survive batching, the rest of the event doesn't
+        self.agent._sample_batches['parsed'] = SampleBatch(max_samples=2, max_latency=0)
+        self.agent._async_driver_event_sample(self.sample(1.0, 1), None)
+        self.agent._async_driver_event_sample(self.sample(2.0, 2), None)
+
+        samples = self.agent._publish_samples.call_args[0][1]
+        self.assertEquals([s['preferred_timestamp'] for s in samples], ['driver_timestamp'] * 2)
+        self.assertEquals([s['quality_flag'] for s in samples], ['ok'] * 2)
+        self.assertTrue(all('pkt_format_id' not in s and 'salinity' not in s for s in samples))
+
+    def test_batched_by_latency(self):
+        self.agent._sample_batches['parsed'] = SampleBatch(max_samples=100, max_latency=0.01)
+        self.agent._async_driver_event_sample(self.sample(1.0, 1), None)
+        self.agent._async_driver_event_sample(self.sample(2.0, 2), None)
+        self.assertFalse(self.agent._publish_samples.called)
+
+        gevent.sleep(0.05)
+        self.assertEquals(self.agent._publish_samples.call_count, 1)
+        self.assertEquals(len(self.agent._publish_samples.call_args[0][1]), 2)
+        self.assertIsNone(self.agent._sample_batches['parsed'].timer)
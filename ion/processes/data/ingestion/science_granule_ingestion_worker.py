@@ -15,13 +15,31 @@ from ion.services.dm.inventory.dataset_management_service import DatasetManageme
 from interface.objects import Granule
 from couchdb import ResourceNotFound
 from ion.core.process.transform import TransformStreamListener
+from pyon.util.async import spawn
+from gevent.event import Event
+from gevent.coros import RLock
 import collections
 import numpy
+import time
 
 
 
 class ScienceGranuleIngestionWorker(TransformStreamListener):
+    '''
+    Ingestion worker, appends incoming granules to the dataset's coverage.
+
+    Parameters:
+      process.datastore_name          Name of the datastore for the granule metadata
+      process.batching.enabled        Accumulate consecutive granules per stream and
+                                      append them to the coverage in one write, granule
+                                      metadata is written with one bulk datastore call
+      process.batching.max_granules   Maximum number of granules held per stream
+      process.batching.max_latency    Maximum time (seconds) a granule is held before
+                                      it is written
+    '''
     CACHE_LIMIT=100
+    BATCH_MAX_GRANULES=50
+    BATCH_MAX_LATENCY=1.0
 
     def __init__(self, *args,**kwargs):
         super(ScienceGranuleIngestionWorker, self).__init__(*args, **kwargs)
@@ -32,14 +50,44 @@ class ScienceGranuleIngestionWorker(TransformStreamListener):
         #--------------------------------------------------------------------------------
         self._datasets  = collections.OrderedDict()
         self._coverages = collections.OrderedDict()
+
+        #--------------------------------------------------------------------------------
+        # Write-behind batching
+        # - Pending RDTs per stream
+        # - Arrival time of the oldest pending RDT per stream
+        # - Pending granule metadata documents
+        #--------------------------------------------------------------------------------
+        self.batching      = False
+        self.max_granules  = self.BATCH_MAX_GRANULES
+        self.max_latency   = self.BATCH_MAX_LATENCY
+        self._batches      = {}
+        self._batch_times  = {}
+        self._meta_docs    = []
+        self._meta_time    = None
+        self._batch_lock   = RLock()
+        self._flush_greenlet  = None
+        self._terminate_flush = Event()
+
     def on_start(self): #pragma no cover
         super(ScienceGranuleIngestionWorker,self).on_start()
         self.datastore_name = self.CFG.get_safe('process.datastore_name', 'datasets')
         self.db = self.container.datastore_manager.get_datastore(self.datastore_name, DataStore.DS_PROFILE.SCIDATA)
         log.debug('Created datastore %s', self.datastore_name)
 
+        self.batching     = self.CFG.get_safe('process.batching.enabled', False)
+        self.max_granules = self.CFG.get_safe('process.batching.max_granules', self.BATCH_MAX_GRANULES)
+        self.max_latency  = self.CFG.get_safe('process.batching.max_latency', self.BATCH_MAX_LATENCY)
+        if self.batching:
+            self._flush_greenlet = spawn(self._flush_loop, self.max_latency)
+            log.debug('Ingestion batching enabled (max_granules=%s, max_latency=%s)', self.max_granules, self.max_latency)
+
 
     def on_quit(self): #pragma no cover
+        if self._flush_greenlet is not None:
+            self._terminate_flush.set()
+            self._flush_greenlet.join(timeout=10)
+        self.flush_batches()
+
         for stream, coverage in self._coverages.iteritems():
             coverage.close(timeout=5)
 
@@ -103,18 +151,17 @@ class ScienceGranuleIngestionWorker(TransformStreamListener):
             log.error('Ingestion received a message that is not a granule. %s' % msg)
             return
         log.trace('Received incoming granule from route: %s and stream_id: %s', stream_route, stream_id)
-        granule = msg
-        self.add_granule(stream_id, granule)
-        self.persist_meta(stream_id, granule)
+        rdt = RecordDictionaryTool.load_from_granule(msg)
+        self.add_granule(stream_id, rdt)
+        self.persist_meta(stream_id, rdt)
         
 
-    def persist_meta(self, stream_id, granule):
+    def persist_meta(self, stream_id, rdt):
         #--------------------------------------------------------------------------------
         # Metadata persistence
         #--------------------------------------------------------------------------------
         # Determine the `time` in the granule
         dataset_id = self.get_dataset(stream_id)
-        rdt = RecordDictionaryTool.load_from_granule(granule)
         time = get_safe(rdt,'time')
         if time is not None and len(time) and isinstance(time,numpy.ndarray):
             time = time[0]
@@ -130,13 +177,16 @@ class ScienceGranuleIngestionWorker(TransformStreamListener):
         }
         if time is not None:
             dataset_granule['ts_create'] = '%s' % time
-        self.persist(dataset_granule)
+        if self.batching:
+            self.add_meta_to_batch(dataset_granule)
+        else:
+            self.persist(dataset_granule)
         #--------------------------------------------------------------------------------
 
 
-    def add_granule(self,stream_id, granule):
+    def add_granule(self,stream_id, rdt):
         '''
-        Appends the granule's data to the coverage and persists it.
+        Appends the granule's data (decoded as an RDT) to the coverage and persists it.
         '''
         #--------------------------------------------------------------------------------
         # Coverage determiniation and appending
@@ -152,23 +202,133 @@ class ScienceGranuleIngestionWorker(TransformStreamListener):
         #--------------------------------------------------------------------------------
         # Actual persistence
         #-------------------------------------------------------------------------------- 
-        rdt = RecordDictionaryTool.load_from_granule(granule)
-        elements = len(rdt)
+        if not len(rdt):
+            return
+        if self.batching:
+            self.add_to_batch(stream_id, rdt)
+        else:
+            self.write_rdts(coverage, [rdt])
+
+    def add_to_batch(self, stream_id, rdt):
+        '''
+        Holds the RDT until the stream's batch is full or the latency timer expires
+        '''
+        with self._batch_lock:
+            batch = self._batches.setdefault(stream_id, [])
+            if not batch:
+                self._batch_times[stream_id] = time.time()
+            batch.append(rdt)
+            if len(batch) >= self.max_granules:
+                self.flush_batch(stream_id)
+
+    def flush_batch(self, stream_id):
+        '''
+        Writes all the pending RDTs for a stream to its coverage
+        '''
+        with self._batch_lock:
+            rdts = self._batches.pop(stream_id, [])
+            self._batch_times.pop(stream_id, None)
+            if not rdts:
+                return
+            coverage = self.get_coverage(stream_id)
+            if not coverage:
+                log.error('Could not persist batch for stream %s, coverage is None', stream_id)
+                return
+            self.write_rdts(coverage, rdts)
+
+    def add_meta_to_batch(self, dataset_granule):
+        '''
+        Holds the granule metadata document until the next bulk write
+        '''
+        with self._batch_lock:
+            if not self._meta_docs:
+                self._meta_time = time.time()
+            self._meta_docs.append(dataset_granule)
+            if len(self._meta_docs) >= self.max_granules:
+                self.flush_meta()
+
+    def flush_meta(self):
+        '''
+        Writes the pending granule metadata documents in one bulk call
+        '''
+        with self._batch_lock:
+            docs, self._meta_docs = self._meta_docs, []
+            self._meta_time = None
+            if docs:
+                self.persist_mult(docs)
+
+    def flush_batches(self, max_age=None):
+        '''
+        Flushes every pending batch, or only the batches older than max_age seconds
+        '''
+        with self._batch_lock:
+            now = time.time()
+            for stream_id, started in self._batch_times.items():
+                if max_age is None or now - started >= max_age:
+                    self.flush_batch(stream_id)
+            if self._meta_time is not None and (max_age is None or now - self._meta_time >= max_age):
+                self.flush_meta()
+
+    def _flush_loop(self, max_latency):
+        # Event.wait returns False on timeout (and True when set in on_quit)
+        interval = max_latency / 2.
+        while not self._terminate_flush.wait(timeout=interval):
+            try:
+                self.flush_batches(max_age=max_latency)
+            except Exception:
+                log.exception('Failed to flush ingestion batches')
+
+    def write_rdts(self, coverage, rdts):
+        '''
+        Appends the records of consecutive RDTs to the coverage as one contiguous
+        block and flushes the coverage once.
+        '''
+        elements = sum(len(rdt) for rdt in rdts)
         if not elements:
             return
         coverage.insert_timesteps(elements)
         start_index = coverage.num_timesteps - elements
 
-        for k,v in rdt.iteritems():
-            if k == 'image_obj':
-                log.trace( '%s:', k)
-            else:
-                log.trace( '%s: %s', k, v)
-
-            slice_ = slice(start_index, None)
-            coverage.set_parameter_values(param_name=k, tdoa=slice_, value=v)
+        if len(rdts) == 1:
+            for k,v in rdts[0].iteritems():
+                self._trace_value(k, v)
+                coverage.set_parameter_values(param_name=k, tdoa=slice(start_index, None), value=v)
             coverage.flush()
+            return
+
+        fields = set()
+        for rdt in rdts:
+            fields.update(rdt.iterkeys())
+
+        for k in fields:
+            values = [rdt[k] for rdt in rdts]
+            value = None
+            if all(v is not None for v in values):
+                try:
+                    value = numpy.concatenate(values)
+                except ValueError:
+                    pass
+            if value is not None:
+                self._trace_value(k, value)
+                coverage.set_parameter_values(param_name=k, tdoa=slice(start_index, None), value=value)
+                continue
 
+            # Fields missing from some granules (or that can't be joined) are
+            # written to each granule's own region of the block
+            offset = start_index
+            for rdt, v in zip(rdts, values):
+                if v is not None:
+                    self._trace_value(k, v)
+                    coverage.set_parameter_values(param_name=k, tdoa=slice(offset, offset + len(rdt)), value=v)
+                offset += len(rdt)
+
+        coverage.flush()
+
+    def _trace_value(self, k, v):
+        if k == 'image_obj':
+            log.trace( '%s:', k)
+        else:
+            log.trace( '%s: %s', k, v)
 
     def persist(self, dataset_granule): #pragma no cover
         '''
@@ -199,3 +359,23 @@ class ScienceGranuleIngestionWorker(TransformStreamListener):
         except ResourceNotFound as e:
             log.error(e.message) # Oh well I tried
 
+    def persist_mult(self, dataset_granules): #pragma no cover
+        '''
+        Persists the metadata for several granules with one datastore call
+        '''
+        try:
+            self.db.create_doc_mult(dataset_granules)
+            return
+        except ResourceNotFound as e:
+            log.error('The datastore was removed while ingesting (retrying)')
+            self.db = self.container.datastore_manager.get_datastore(self.datastore_name, DataStore.DS_PROFILE.SCIDATA)
+
+        # See persist, strip any ids attached by the first attempt
+        try:
+            for dataset_granule in dataset_granules:
+                dataset_granule.pop('_id', None)
+                dataset_granule.pop('_rev', None)
+            self.db.create_doc_mult(dataset_granules)
+        except ResourceNotFound as e:
+            log.error(e.message)
+
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+'''
+@file ion/processes/data/ingestion/test/test_science_granule_ingestion_worker.py
+@description Unit tests for the science granule ingestion worker
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.processes.data.ingestion.science_granule_ingestion_worker import ScienceGranuleIngestionWorker
+from ion.services.dm.utility.granule.record_dictionary import RecordDictionaryTool
+from coverage_model.parameter import ParameterDictionary, ParameterContext
+from coverage_model.parameter_types import QuantityType
+from coverage_model.basic_types import AxisTypeEnum
+from mock import Mock
+from nose.plugins.attrib import attr
+import numpy as np
+
+@attr('UNIT',group='dm')
+class ScienceGranuleIngestionWorkerUnitTest(PyonTestCase):
+    def setUp(self):
+        self.worker = ScienceGranuleIngestionWorker()
+        self.coverage = Mock()
+        self.coverage.num_timesteps = 0
+        def insert_timesteps(count):
+            self.coverage.num_timesteps += count
+        self.coverage.insert_timesteps.side_effect = insert_timesteps
+        self.worker.get_coverage = Mock(return_value=self.coverage)
+
+        self.pdict = ParameterDictionary()
+        t_ctxt = ParameterContext('time', param_type=QuantityType(value_encoding=np.dtype('int64')))
+        t_ctxt.axis = AxisTypeEnum.TIME
+        self.pdict.add_context(t_ctxt)
+        self.pdict.add_context(ParameterContext('temp', param_type=QuantityType(value_encoding=np.dtype('float32'))))
+
+    def make_rdt(self, start, count):
+        rdt = RecordDictionaryTool(param_dictionary=self.pdict)
+        rdt['time'] = np.arange(start, start + count)
+        rdt['temp'] = np.arange(start, start + count, dtype='float32')
+        return rdt
+
+    def test_write_rdts_single(self):
+        self.worker.write_rdts(self.coverage, [self.make_rdt(0, 5)])
+
+        self.coverage.insert_timesteps.assert_called_once_with(5)
+        self.assertEquals(self.coverage.set_parameter_values.call_count, 2)
+        self.assertEquals(self.coverage.flush.call_count, 1)
+
+    def test_batching_by_count(self):
+        self.worker.batching = True
+        self.worker.max_granules = 3
+
+        self.worker.add_to_batch('stream_id', self.make_rdt(0, 2))
+        self.worker.add_to_batch('stream_id', self.make_rdt(2, 2))
+        self.assertFalse(self.coverage.insert_timesteps.called)
+
+        self.worker.add_to_batch('stream_id', self.make_rdt(4, 2))
+        self.coverage.insert_timesteps.assert_called_once_with(6)
+        self.assertEquals(self.coverage.flush.call_count, 1)
+
+        for call in self.coverage.set_parameter_values.call_args_list:
+            kwargs = call[1]
+            self.assertEquals(kwargs['tdoa'], slice(0, None))
+            np.testing.assert_array_equal(kwargs['value'], np.arange(6))
+
+        self.assertEquals(self.worker._batches, {})
+
+    def test_flush_batches_by_age(self):
+        self.worker.batching = True
+        self.worker.add_to_batch('stream_id', self.make_rdt(0, 2))
+
+        self.worker.flush_batches(max_age=60)
+        self.assertFalse(self.coverage.insert_timesteps.called)
+
+        self.worker.flush_batches()
+        self.coverage.insert_timesteps.assert_called_once_with(2)
+        self.assertEquals(self.coverage.flush.call_count, 1)
+
+    def test_partial_fields(self):
+        rdt_a = self.make_rdt(0, 2)
+        rdt_b = RecordDictionaryTool(param_dictionary=self.pdict)
+        rdt_b['time'] = np.arange(2, 5)
+
+        self.worker.write_rdts(self.coverage, [rdt_a, rdt_b])
+
+        self.coverage.insert_timesteps.assert_called_once_with(5)
+        temp_calls = [c[1] for c in self.coverage.set_parameter_values.call_args_list if c[1]['param_name'] == 'temp']
+        self.assertEquals(len(temp_calls), 1)
+        self.assertEquals(temp_calls[0]['tdoa'], slice(0, 2))
+        self.assertEquals(self.coverage.flush.call_count, 1)
+
+    def test_persist_meta_batched(self):
+        self.worker.batching = True
+        self.worker.max_granules = 2
+        self.worker.get_dataset = Mock(return_value='dataset_id')
+        self.worker.persist = Mock()
+        self.worker.persist_mult = Mock()
+
+        self.worker.persist_meta('stream_id', self.make_rdt(0, 2))
+        self.assertFalse(self.worker.persist_mult.called)
+
+        self.worker.persist_meta('stream_id', self.make_rdt(2, 2))
+        self.assertEquals(self.worker.persist_mult.call_count, 1)
+        docs = self.worker.persist_mult.call_args[0][0]
+        self.assertEquals([d['ts_create'] for d in docs], ['0', '2'])
+        self.assertFalse(self.worker.persist.called)
+
+    def test_recv_packet_decodes_once(self):
+        rdt = self.make_rdt(0, 2)
+        self.worker.add_granule = Mock()
+        self.worker.persist_meta = Mock()
+
+        self.worker.recv_packet(rdt.to_granule(), 'route', 'stream_id')
+
+        decoded = self.worker.add_granule.call_args[0][1]
+        self.assertIs(self.worker.persist_meta.call_args[0][1], decoded)
+        self.assertEquals(decoded, rdt)
@@ -15,6 +15,7 @@ from pyon.util.log import log
 
 from ion.services.dm.inventory.dataset_management_service import DatasetManagementService
 from ion.services.dm.utility.granule import RecordDictionaryTool
+from ion.services.dm.utility.time_index import TimeIndex
 
 from interface.services.dm.idataset_management_service import DatasetManagementServiceProcessClient, DatasetManagementServiceClient
 from interface.services.dm.ipubsub_management_service import PubsubManagementServiceProcessClient
@@ -98,7 +99,15 @@ class ReplayProcess(BaseReplayProcess):
         self.pubsub = PubsubManagementServiceProcessClient(process=self)
 
     @classmethod
-    def _coverage_to_granule(cls, coverage, start_time=None, end_time=None, stride_time=None, parameters=None, stream_def_id=None, tdoa=None):
+    def _coverage_to_granule(cls, coverage, start_time=None, end_time=None, stride_time=None, parameters=None, stream_def_id=None, tdoa=None, dataset_id=None):
+        slice_ = cls._get_slice(coverage, start_time, end_time, stride_time, tdoa, dataset_id)
+        return cls._slice_to_rdt(coverage, slice_, parameters, stream_def_id)
+
+    @classmethod
+    def _get_slice(cls, coverage, start_time=None, end_time=None, stride_time=None, tdoa=None, dataset_id=None):
+        '''
+        Determines the coverage indices (a slice, or a list of indices for strides) for a query
+        '''
         slice_ = slice(None) # Defaults to all values
 
         if tdoa is not None and isinstance(tdoa,slice):
@@ -108,7 +117,7 @@ class ReplayProcess(BaseReplayProcess):
             validate_is_instance(end_time, Number, 'end_time must be a number for striding.')
             validate_is_instance(stride_time, Number, 'stride_time must be a number for striding.')
             ugly_range = np.arange(start_time, end_time, stride_time)
-            idx_values = [cls.get_relative_time(coverage,i) for i in ugly_range]
+            idx_values = cls.get_relative_time(coverage, ugly_range, dataset_id)
             idx_values = list(set(idx_values)) # Removing duplicates
             slice_ = [idx_values]
 
@@ -118,18 +127,24 @@ class ReplayProcess(BaseReplayProcess):
             if start_time is not None:
                 start_units = cls.ts_to_units(uom,start_time)
                 log.info('Units: %s', start_units)
-                start_idx = cls.get_relative_time(coverage,start_units)
+                start_idx = cls.get_relative_time(coverage,start_units, dataset_id)
                 log.info('Start Index: %s', start_idx)
                 start_time = start_idx
             if end_time is not None:
                 end_units   = cls.ts_to_units(uom,end_time)
                 log.info('End units: %s', end_units)
-                end_idx   = cls.get_relative_time(coverage,end_units)
+                end_idx   = cls.get_relative_time(coverage,end_units, dataset_id)
                 log.info('End index: %s',  end_idx)
                 end_time = end_idx
             slice_ = slice(start_time,end_time,stride_time)
             log.info('Slice: %s', slice_)
+        return slice_
 
+    @classmethod
+    def _slice_to_rdt(cls, coverage, slice_, parameters=None, stream_def_id=None):
+        '''
+        Reads the values at slice_ from the coverage into an RDT
+        '''
         if stream_def_id:
             rdt = RecordDictionaryTool(stream_definition_id=stream_def_id)
         else:
@@ -151,7 +166,7 @@ class ReplayProcess(BaseReplayProcess):
         '''
         try: 
             coverage = DatasetManagementService._get_coverage(self.dataset_id)
-            rdt = self._coverage_to_granule(coverage,self.start_time, self.end_time, self.stride_time, self.parameters,tdoa=self.tdoa)
+            rdt = self._coverage_to_granule(coverage,self.start_time, self.end_time, self.stride_time, self.parameters,tdoa=self.tdoa, dataset_id=self.dataset_id)
             coverage.close(timeout=5)
         except Exception as e:
             import traceback
@@ -222,7 +237,7 @@ class ReplayProcess(BaseReplayProcess):
         ts = float(doc.get('ts_create',0))
 
         coverage = DatasetManagementService._get_coverage(dataset_id)
-        rdt = cls._coverage_to_granule(coverage,start_time=ts, end_time=None)
+        rdt = cls._coverage_to_granule(coverage,start_time=ts, end_time=None, dataset_id=dataset_id)
         coverage.close(timeout=5)
         return rdt.to_granule()
 
@@ -241,33 +256,64 @@ class ReplayProcess(BaseReplayProcess):
         return rdt.to_granule()
 
     def _replay(self):
+        '''
+        Reads the query from the coverage one window of publish_limit records at
+        a time, so only one window is ever held in memory.
+        '''
         coverage = DatasetManagementService._get_coverage(self.dataset_id)
-        rdt = self._coverage_to_granule(coverage, self.start_time, self.end_time, self.stride_time, self.parameters, self.stream_def_id)
-        elements = len(rdt)
-        
-        for i in xrange(elements / self.publish_limit):
-            outgoing = RecordDictionaryTool(stream_definition_id=self.stream_def_id)
-            fields = self.parameters or outgoing.fields
-            for field in fields:
-                outgoing[field] = rdt[field][(i*self.publish_limit) : ((i+1)*self.publish_limit)]
-            yield outgoing
-        coverage.close(timeout=5)
-        return 
+        try:
+            slice_ = self._get_slice(coverage, self.start_time, self.end_time, self.stride_time, dataset_id=self.dataset_id)
+            for window in self._windows(slice_, coverage.num_timesteps, self.publish_limit):
+                yield self._slice_to_rdt(coverage, window, self.parameters, self.stream_def_id)
+        finally:
+            coverage.close(timeout=5)
+
+    @classmethod
+    def _windows(cls, slice_, num_timesteps, window_size):
+        '''
+        Splits a query's slice (or list of indices) into consecutive windows of
+        at most window_size records
+        '''
+        window_size = max(int(window_size), 1)
+        if isinstance(slice_, slice):
+            start, stop, step = slice_.indices(num_timesteps)
+            if step < 0:
+                yield slice_
+                return
+            span = window_size * step
+            for i in xrange(start, stop, span):
+                yield slice(i, min(i + span, stop), step)
+        else:
+            indices = sorted(slice_[0])
+            for i in xrange(0, len(indices), window_size):
+                yield [indices[i:i+window_size]]
 
 
     @classmethod
-    def get_relative_time(cls, coverage, time):
+    def get_relative_time(cls, coverage, time, dataset_id=None):
         '''
         Determines the relative time in the coverage model based on a given time
+        (or array of times, giving an array of indices).
         The time must match the coverage's time units
+
+        Lookups go through the dataset's persisted TimeIndex when the dataset_id
+        is known, otherwise a temporary index is built for the call.
         '''
         time_name = coverage.temporal_parameter_name
         pc = coverage.get_parameter_context(time_name)
         units = pc.uom
         if 'iso' in units:
             return None # Not sure how to implement this....  How do you compare iso strings effectively?
-        values = coverage.get_parameter_values(time_name)
-        return cls.find_nearest(values,time)
+        if dataset_id:
+            index = TimeIndex.for_dataset(dataset_id, cls.time_index_path(dataset_id))
+        else:
+            index = TimeIndex()
+        index.update(coverage)
+        return index.nearest(time)
+
+    @classmethod
+    def time_index_path(cls, dataset_id):
+        return '%s_time_index.npz' % DatasetManagementService._get_coverage_path(dataset_id)
 
     @classmethod
     def ts_to_units(cls,units, val):
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+'''
+@file ion/processes/data/replay/test/test_replay_process.py
+@description Unit tests for the replay process
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.processes.data.replay.replay_process import ReplayProcess
+from nose.plugins.attrib import attr
+
+@attr('UNIT',group='dm')
+class ReplayProcessUnitTest(PyonTestCase):
+    def test_windows_slice(self):
+        windows = list(ReplayProcess._windows(slice(None), 25, 10))
+        self.assertEquals(windows, [slice(0,10,1), slice(10,20,1), slice(20,25,1)])
+
+        windows = list(ReplayProcess._windows(slice(5,-5), 25, 10))
+        self.assertEquals(windows, [slice(5,15,1), slice(15,20,1)])
+
+        windows = list(ReplayProcess._windows(slice(0,25,2), 25, 5))
+        self.assertEquals(windows, [slice(0,10,2), slice(10,20,2), slice(20,25,2)])
+
+        self.assertEquals(list(ReplayProcess._windows(slice(0,0), 25, 10)), [])
+
+    def test_windows_indices(self):
+        windows = list(ReplayProcess._windows([[9,1,5,3,7]], 10, 2))
+        self.assertEquals(windows, [[[1,3]], [[5,7]], [[9]]])
@@ -7,13 +7,14 @@
 @brief NotificationWorker Class. An instance of this class acts as an notification worker.
 '''
 
-from pyon.public import log, RT
+from pyon.public import log, RT, PRED, CFG
 from pyon.util.async import spawn
 from pyon.core.exception import BadRequest, NotFound
 from ion.core.process.transform import TransformEventListener
 from pyon.event.event import EventSubscriber
-from ion.services.dm.utility.uns_utility_methods import send_email, calculate_reverse_user_info
-from ion.services.dm.utility.uns_utility_methods import setting_up_smtp_client, check_user_notification_interest
+from ion.services.dm.utility.uns_utility_methods import EmailDeliveryPool, calculate_reverse_user_info
+from ion.services.dm.utility.uns_utility_methods import add_to_reverse_user_info, remove_from_reverse_user_info
+from ion.services.dm.utility.uns_utility_methods import setting_up_smtp_client, SubscriptionIndex
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceClient
 
 import gevent, time
@@ -21,9 +22,17 @@ import gevent, time
 class NotificationWorker(TransformEventListener):
     """
     Instances of this class acts as a Notification Worker.
+
+    Emails are handed to an EmailDeliveryPool so the event callback never waits on SMTP.
+    The pool is configured with:
+      process.email_delivery.pool_size    Greenlets sending email (default 4)
+      process.email_delivery.max_queue    Recipients waiting for delivery before events are dropped (default 1000)
+      process.email_delivery.max_retries  Retries of a failed delivery (default 3)
+      process.email_delivery.backoff      Seconds before the first retry, doubled on every retry (default 1)
     """
     def on_init(self):
         self.user_info = {}
+        self.subscriptions = SubscriptionIndex()
         self.resource_registry = ResourceRegistryServiceClient()
         super(NotificationWorker, self).on_init()
 
@@ -38,7 +47,22 @@ class NotificationWorker(TransformEventListener):
 
         self.reverse_user_info = None
         self.user_info = None
-        self.smtp_client = setting_up_smtp_client()
+        self.subscriptions = SubscriptionIndex()
+        if CFG.get_safe('system.smtp', False):
+            # A connection per delivery greenlet, opened when it first sends
+            self.smtp_client = None
+            smtp_factory = setting_up_smtp_client
+        else:
+            # The fake client is shared so its sent mail can be inspected
+            self.smtp_client = setting_up_smtp_client()
+            smtp_factory = lambda: self.smtp_client
+
+        self.delivery = EmailDeliveryPool(smtp_factory,
+            pool_size   = self.CFG.get_safe('process.email_delivery.pool_size', EmailDeliveryPool.POOL_SIZE),
+            max_queue   = self.CFG.get_safe('process.email_delivery.max_queue', EmailDeliveryPool.MAX_QUEUE),
+            max_retries = self.CFG.get_safe('process.email_delivery.max_retries', EmailDeliveryPool.MAX_RETRIES),
+            backoff     = self.CFG.get_safe('process.email_delivery.backoff', EmailDeliveryPool.BACKOFF))
+        self.delivery.start()
 
         #------------------------------------------------------------------------------------
         # Start by loading the user info and reverse user info dictionaries
@@ -47,6 +71,7 @@ class NotificationWorker(TransformEventListener):
         try:
             self.user_info = self.load_user_info()
             self.reverse_user_info =  calculate_reverse_user_info(self.user_info)
+            self.subscriptions = SubscriptionIndex.from_user_info(self.user_info)
 
             log.debug("On start up, notification workers loaded the following user_info dictionary: %s" % self.user_info)
             log.debug("The calculated reverse user info: %s" % self.reverse_user_info )
@@ -69,12 +94,17 @@ class NotificationWorker(TransformEventListener):
             notification_id =  event_msg.notification_id
             log.debug("(Notification worker received a ReloadNotificationEvent. The relevant notification_id is %s" % notification_id)
 
-            try:
-                self.user_info = self.load_user_info()
-            except NotFound:
-                log.warning("ElasticSearch has not yet loaded the user_index.")
+            if notification_id and self.user_info is not None:
+                # Only the users subscribed to the notification changed
+                self.update_user_info(notification_id)
+            else:
+                try:
+                    self.user_info = self.load_user_info()
+                except NotFound:
+                    log.warning("ElasticSearch has not yet loaded the user_index.")
 
-            self.reverse_user_info =  calculate_reverse_user_info(self.user_info)
+                self.reverse_user_info =  calculate_reverse_user_info(self.user_info)
+                self.subscriptions = SubscriptionIndex.from_user_info(self.user_info)
             self.test_hook(self.user_info, self.reverse_user_info)
 
             log.debug("After a reload, the user_info: %s" % self.user_info)
@@ -94,33 +124,35 @@ class NotificationWorker(TransformEventListener):
         Callback method for the subscriber listening for all events
         """
         #------------------------------------------------------------------------------------
-        # From the reverse user info dict find out which users have subscribed to that event
+        # From the subscription index find out which users have subscribed to that event
         #------------------------------------------------------------------------------------
 
-        users = []
-        if self.reverse_user_info:
-            users = check_user_notification_interest(event = msg, reverse_user_info = self.reverse_user_info)
+        users = self.subscriptions.match(msg)
 
         log.debug("Type of event received by notification worker: %s" % msg.type_)
         log.debug("Notification worker deduced the following users were interested in the event: %s" % users )
 
         #------------------------------------------------------------------------------------
-        # Send email to the users
+        # Queue the emails to the users
         #------------------------------------------------------------------------------------
 
         for user_name in users:
             msg_recipient = self.user_info[user_name]['user_contact'].email
-            send_email(message = msg, msg_recipient = msg_recipient, smtp_client = self.smtp_client )
+            self.delivery.put(msg, msg_recipient)
+
+        log.debug("Email delivery: %s", self.delivery.stats())
 
     def on_stop(self):
         # close subscribers safely
         self.reload_user_info_subscriber.stop()
+        self.delivery.stop()
 
         super(NotificationWorker, self).on_stop()
 
     def on_quit(self):
         # close subscribers safely
         self.reload_user_info_subscriber.stop()
+        self.delivery.stop()
 
         super(NotificationWorker, self).on_quit()
 
@@ -139,11 +171,42 @@ class NotificationWorker(TransformEventListener):
             return {}
 
         for user in users:
-            notifications = []
-            for variable in user.variables:
-                if variable['name'] == 'notifications':
-                    notifications = variable['value']
-
-            user_info[user.name] = { 'user_contact' : user.contact, 'notifications' : notifications}
+            user_info[user.name] = self.user_info_entry(user)
 
         return user_info
+
+    def user_info_entry(self, user):
+        '''
+        The user_info dictionary entry for a UserInfo object
+        '''
+        notifications = []
+        for variable in user.variables:
+            if variable['name'] == 'notifications':
+                notifications = variable['value']
+
+        return { 'user_contact' : user.contact, 'notifications' : notifications}
+
+    def update_user_info(self, notification_id):
+        '''
+        Reloads only the users subscribed to a notification and updates their entries in the
+        user info, the reverse user info and the subscription index
+
+        @param notification_id str
+        '''
+        users, _ = self.resource_registry.find_subjects(RT.UserInfo, PRED.hasNotification, notification_id, False)
+
+        if self.reverse_user_info is None:
+            self.reverse_user_info = {}
+
+        for user in users:
+            old_entry = self.user_info.get(user.name)
+            if old_entry:
+                remove_from_reverse_user_info(self.reverse_user_info, user.name, old_entry['notifications'])
+                for notification in old_entry['notifications'] or []:
+                    self.subscriptions.remove(user.name, notification)
+
+            entry = self.user_info_entry(user)
+            self.user_info[user.name] = entry
+            add_to_reverse_user_info(self.reverse_user_info, user.name, entry['notifications'])
+            for notification in entry['notifications'] or []:
+                self.subscriptions.add(user.name, notification)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+'''
+@file ion/processes/data/transforms/test/test_notification_worker.py
+@description Unit tests for the notification worker
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.processes.data.transforms.notification_worker import NotificationWorker
+from ion.services.dm.utility.uns_utility_methods import SubscriptionIndex, calculate_reverse_user_info
+from interface.objects import NotificationRequest, TemporalBounds, UserInfo, Event
+from mock import Mock
+from nose.plugins.attrib import attr
+
+def notification(origin, event_type):
+    return NotificationRequest(origin=origin, origin_type='', event_type=event_type, event_subtype='',
+                               temporal_bounds=TemporalBounds(start_datetime='', end_datetime=''))
+
+def user(name, notifications):
+    return UserInfo(name=name, contact=Mock(), variables=[{'name' : 'notifications', 'value' : notifications}])
+
+@attr('UNIT',group='dm')
+class NotificationWorkerUnitTest(PyonTestCase):
+
+    def test_update_user_info(self):
+        worker = NotificationWorker()
+        worker.resource_registry = Mock()
+
+        users = [user('user_1', [notification('instrument_1', 'DeviceEvent')]),
+                 user('user_2', [notification('instrument_2', 'DeviceEvent')])]
+        worker.user_info = dict((u.name, worker.user_info_entry(u)) for u in users)
+        worker.reverse_user_info = calculate_reverse_user_info(worker.user_info)
+        worker.subscriptions = SubscriptionIndex.from_user_info(worker.user_info)
+
+        # user_1 subscribes to a new notification, only that user is read back
+        updated = user('user_1', users[0].variables[0]['value'] + [notification('instrument_2', 'ResourceEvent')])
+        worker.resource_registry.find_subjects.return_value = ([updated], [])
+
+        worker.update_user_info('notification_id')
+
+        self.assertFalse(worker.resource_registry.find_resources.called)
+        self.assertEquals(len(worker.user_info['user_1']['notifications']), 2)
+        self.assertEquals(worker.reverse_user_info, calculate_reverse_user_info(worker.user_info))
+        self.assertEquals(worker.reverse_user_info['event_origin']['instrument_2'], set(['user_1', 'user_2']))
+
+        event = Event(origin='instrument_2', origin_type='', type_='ResourceEvent', sub_type='')
+        self.assertEquals(worker.subscriptions.match(event), ['user_1'])
+        self.assertEquals(len(worker.subscriptions), 3)
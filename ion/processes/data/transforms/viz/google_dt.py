@@ -98,13 +98,17 @@ class VizTransformGoogleDTAlgorithm(SimpleGranuleTransformFunction):
 
         time_fill_value = 0 # should be derived from the granule's param dict.
 
+        # Read-only views, avoids copying every column for every row below
+        columns = dict((field, rdt.view(field)) for field in rdt.fields)
+        time_values = columns['time']
+
         data_description.append(('time','number','time'))
         for field in rdt.fields:
             if field == 'time':
                 continue
 
             # only consider fields which are supposed to be numbers.
-            if (rdt[field] != None) and (rdt[field].dtype not in gdt_allowed_numerical_types):
+            if (columns[field] is not None) and (columns[field].dtype not in gdt_allowed_numerical_types):
                 continue
 
             data_description.append((field, 'number', field))
@@ -113,9 +117,9 @@ class VizTransformGoogleDTAlgorithm(SimpleGranuleTransformFunction):
             varTuple = []
 
             # Put time first if its not zero. Retrieval returns 0 secs for malformed entries
-            if rdt['time'][i] == time_fill_value:
+            if time_values[i] == time_fill_value:
                 continue
-            varTuple.append(rdt['time'][i])
+            varTuple.append(time_values[i])
 
             for dd in data_description:
                 field = dd[0]
@@ -123,10 +127,11 @@ class VizTransformGoogleDTAlgorithm(SimpleGranuleTransformFunction):
                 if field == None or field == 'time':
                     continue
 
-                if rdt[field] == None or rdt[field][i] == None:
+                values = columns[field]
+                if values is None or values[i] == None:
                     varTuple.append(0.0)
                 else:
-                    varTuple.append(rdt[field][i])
+                    varTuple.append(values[i])
 
             # Append the tuples to the data table
             if len(varTuple) > 0:
@@ -5,6 +5,7 @@ import json
 from time import time
 
 import gevent
+import gevent.pool
 from couchdb.http import ResourceNotFound
 
 from pyon.agent.simple_agent import SimpleResourceAgentClient
@@ -16,6 +17,7 @@ from pyon.event.event import EventPublisher
 from pyon.core import bootstrap
 from pyon.event.event import EventSubscriber
 from gevent import event as gevent_event
+from gevent.coros import RLock
 
 try:
     from epu.processdispatcher.core import ProcessDispatcherCore
@@ -38,7 +40,75 @@ from interface.objects import ProcessStateEnum, Process, ProcessDefinition,\
     ProcessQueueingMode, ProcessRestartMode, ProcessTarget, ProcessSchedule
 
 
-class ProcessStateGate(EventSubscriber):
+class ProcessStateRouter(object):
+    """
+    Shares one ProcessLifecycleEvent subscription between everything waiting on process states.
+
+    Callbacks are registered per process id and called with (event, headers) for each lifecycle
+    event of that process. The subscriber is started when the first callback is registered and
+    stopped when the last one is removed, so any number of gates costs a single subscription.
+
+      router = ProcessStateRouter.instance()
+      router.register(process_id, callback)
+      router.unregister(process_id, callback)
+    """
+    _instance = None
+
+    def __init__(self, *args, **kwargs):
+        self._subscriber_args = args
+        self._subscriber_kwargs = kwargs
+        self._subscriber = None
+        self._watchers = {} # process_id -> list of callbacks
+        self._lock = RLock()
+
+    @classmethod
+    def instance(cls):
+        """
+        The process-wide router
+        """
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __len__(self):
+        return sum(len(callbacks) for callbacks in self._watchers.itervalues())
+
+    @property
+    def running(self):
+        return self._subscriber is not None
+
+    def register(self, process_id, callback):
+        with self._lock:
+            self._watchers.setdefault(process_id, []).append(callback)
+            if self._subscriber is None:
+                subscriber = EventSubscriber(*self._subscriber_args,
+                                             callback=self._route,
+                                             event_type="ProcessLifecycleEvent",
+                                             origin_type="DispatchedProcess",
+                                             **self._subscriber_kwargs)
+                subscriber.start()
+                self._subscriber = subscriber
+
+    def unregister(self, process_id, callback):
+        with self._lock:
+            callbacks = self._watchers.get(process_id)
+            if callbacks and callback in callbacks:
+                callbacks.remove(callback)
+                if not callbacks:
+                    del self._watchers[process_id]
+            if not self._watchers and self._subscriber is not None:
+                subscriber, self._subscriber = self._subscriber, None
+                subscriber.stop()
+
+    def _route(self, event, headers):
+        for callback in list(self._watchers.get(event.origin, ())):
+            try:
+                callback(event, headers)
+            except Exception:
+                log.exception("ProcessStateRouter callback failed for process %s", event.origin)
+
+
+class ProcessStateGate(object):
     """
     Ensure that we get a particular state, now or in the future.
 
@@ -48,21 +118,17 @@ class ProcessStateGate(EventSubscriber):
 
     This pattern returns True immediately upon reaching the desired state, or False if the timeout is reached.
     This pattern avoids a race condition between read_process and using EventGate.
+    Events are received through the shared ProcessStateRouter rather than a subscriber per gate.
     """
-    def __init__(self, read_process_fn=None, process_id='', desired_state=None, *args, **kwargs):
-
-        EventSubscriber.__init__(self, *args,
-                                 callback=self.trigger_cb,
-                                 event_type="ProcessLifecycleEvent",
-                                 origin=process_id,
-                                 origin_type="DispatchedProcess",
-                                 **kwargs)
+    def __init__(self, read_process_fn=None, process_id='', desired_state=None, router=None):
 
         self.desired_state = desired_state
         self.process_id = process_id
         self.read_process_fn = read_process_fn
+        self.router = router if router is not None else ProcessStateRouter.instance()
         self.last_chance = None
         self.first_chance = None
+        self.gate = gevent_event.Event()
 
 
         _ = ProcessStateEnum._str_map[self.desired_state] # make sure state exists
@@ -70,6 +136,12 @@ class ProcessStateGate(EventSubscriber):
                 self.process_id,
                 ProcessStateEnum._str_map[self.desired_state])
 
+    def start(self):
+        self.router.register(self.process_id, self.trigger_cb)
+
+    def stop(self):
+        self.router.unregister(self.process_id, self.trigger_cb)
+
     def trigger_cb(self, event, x):
         if event.state == self.desired_state:
             self.gate.set()
@@ -134,6 +206,96 @@ class ProcessStateGate(EventSubscriber):
     def _get_first_chance(self):
         return self.first_chance
 
+
+class ProcessStateGroupGate(object):
+    """
+    Waits on many processes at once, until all or any of them reach their desired state.
+
+    Usage:
+      gate = ProcessStateGroupGate(your_process_dispatcher_client.read_process, process_ids, ProcessStateEnum.RUNNING)
+      assert gate.await_all(timeout_in_seconds)
+
+    desired_state is either one state for every process or a dict of process id to state.
+    Like ProcessStateGate, events are listened for before the current states are read so
+    no transition is missed, and all the processes share the router's single subscription.
+    After waiting, reached holds the ids of the processes found in their desired state.
+    """
+    def __init__(self, read_process_fn=None, process_ids=None, desired_state=None, router=None):
+        process_ids = list(process_ids or [])
+        if isinstance(desired_state, dict):
+            self.desired_states = dict((pid, desired_state[pid]) for pid in process_ids)
+        else:
+            self.desired_states = dict((pid, desired_state) for pid in process_ids)
+        for state in self.desired_states.itervalues():
+            _ = ProcessStateEnum._str_map[state] # make sure state exists
+
+        self.process_ids = process_ids
+        self.read_process_fn = read_process_fn
+        self.router = router if router is not None else ProcessStateRouter.instance()
+        self.reached = set()
+        self.require_all = True
+        self.gate = gevent_event.Event()
+
+    @property
+    def pending(self):
+        return [pid for pid in self.process_ids if pid not in self.reached]
+
+    def await_all(self, timeout=0):
+        return self.await(timeout, require_all=True)
+
+    def await_any(self, timeout=0):
+        return self.await(timeout, require_all=False)
+
+    def await(self, timeout=0, require_all=True):
+        start_time = time()
+        self.require_all = require_all
+        self.reached = set()
+        self.gate = gevent_event.Event()
+        if not self.process_ids:
+            return True
+
+        for pid in self.process_ids:
+            self.router.register(pid, self.trigger_cb)
+        try:
+            self._read_states()
+            ret = self.done() or self.gate.wait(timeout)
+            if not ret:
+                # sanity check, as for ProcessStateGate
+                self._read_states()
+                ret = self.done()
+        finally:
+            for pid in self.process_ids:
+                self.router.unregister(pid, self.trigger_cb)
+
+        log.info("ProcessStateGroupGate %s after %0.2f seconds: %d of %d processes in their desired state",
+                 "succeeded" if ret else "timed out", time() - start_time,
+                 len(self.reached), len(self.process_ids))
+        return ret
+
+    def done(self):
+        if self.require_all:
+            return len(self.reached) == len(self.desired_states)
+        return bool(self.reached)
+
+    def trigger_cb(self, event, x):
+        pid = event.origin
+        if pid in self.desired_states and event.state == self.desired_states[pid]:
+            self.reached.add(pid)
+            if self.done():
+                self.gate.set()
+
+    def _read_states(self):
+        for pid in self.pending:
+            if self.done():
+                return
+            try:
+                process_obj = self.read_process_fn(pid)
+            except NotFound:
+                continue
+            if process_obj and process_obj.process_state == self.desired_states[pid]:
+                self.reached.add(pid)
+
+
 class ProcessDispatcherService(BaseProcessDispatcherService):
 
     # Implementation notes:
@@ -159,6 +321,9 @@ class ProcessDispatcherService(BaseProcessDispatcherService):
     #       requests to it.
     #
 
+    # Spawns in flight at once during schedule_processes
+    SCHEDULE_PARALLELISM = 10
+
     def on_init(self):
 
         try:
@@ -188,6 +353,7 @@ class ProcessDispatcherService(BaseProcessDispatcherService):
             self.dashi = None
 
         pd_backend_name = pd_conf.get('backend')
+        self.schedule_parallelism = pd_conf.get('schedule_parallelism', self.SCHEDULE_PARALLELISM)
 
         # note: this backend is deprecated. Keeping it around only until the system launches
         # are switched to the Pyon PD implementation.
@@ -296,6 +462,77 @@ class ProcessDispatcherService(BaseProcessDispatcherService):
             raise NotFound('No process definition was provided')
         process_definition = self.backend.read_definition(process_definition_id)
 
+        process_id, configuration, name = self._prepare_process(process_definition,
+            configuration, process_id, name)
+
+        return self._spawn_process(process_id, process_definition_id, schedule, configuration, name)
+
+    def schedule_processes(self, process_requests=None, parallelism=None):
+        """Schedules many processes at once. Every request is validated before any process is
+        launched, then the processes are spawned concurrently, at most parallelism at a time.
+
+        @param process_requests    list of dicts with the schedule_process arguments:
+                                   process_definition_id, and optionally schedule,
+                                   configuration, process_id and name
+        @param parallelism    spawns in flight at once, defaults to schedule_parallelism
+        @retval results    list of dicts (process_id, success, error), in request order
+        """
+        process_requests = process_requests or []
+        parallelism = parallelism or self.schedule_parallelism
+
+        # Validate everything first, reading each definition only once
+        definitions = {}
+        def read_definition(definition_id):
+            if definition_id not in definitions:
+                try:
+                    definitions[definition_id] = self.backend.read_definition(definition_id)
+                except NotFound, e:
+                    definitions[definition_id] = e
+            if isinstance(definitions[definition_id], Exception):
+                raise definitions[definition_id]
+            return definitions[definition_id]
+
+        results = []
+        launches = []
+        process_ids = set()
+        for request in process_requests:
+            result = {'process_id': request.get('process_id') or None, 'success': False, 'error': None}
+            results.append(result)
+            definition_id = request.get('process_definition_id')
+            try:
+                if not definition_id:
+                    raise NotFound('No process definition was provided')
+                process_id, configuration, name = self._prepare_process(read_definition(definition_id),
+                    request.get('configuration'), request.get('process_id'), request.get('name'))
+                if process_id in process_ids:
+                    raise BadRequest("Process %s is scheduled more than once" % process_id)
+            except (NotFound, BadRequest), e:
+                result['error'] = str(e)
+                continue
+            process_ids.add(process_id)
+            result['process_id'] = process_id
+            launches.append((result, (process_id, definition_id, request.get('schedule'), configuration, name)))
+
+        def launch(result, spawn_args):
+            try:
+                self._spawn_process(*spawn_args)
+                result['success'] = True
+            except Exception, e:
+                log.exception("Failed to schedule process %s", spawn_args[0])
+                result['error'] = str(e)
+
+        pool = gevent.pool.Pool(parallelism)
+        for result, spawn_args in launches:
+            pool.spawn(launch, result, spawn_args)
+        pool.join()
+
+        return results
+
+    def _prepare_process(self, process_definition, configuration=None, process_id='', name=''):
+        """Validates a process definition and configuration, and fills in the process id and name.
+
+        @retval (process_id, configuration, name)
+        """
         try:
             module = process_definition.executable['module']
             cls = process_definition.executable['class']
@@ -322,6 +559,9 @@ class ProcessDispatcherService(BaseProcessDispatcherService):
         if not name:
             name = self._get_process_name(process_definition, configuration)
 
+        return process_id, configuration, name
+
+    def _spawn_process(self, process_id, process_definition_id, schedule, configuration, name):
         try:
             process = Process(process_id=process_id, name=name)
             self.container.resource_registry.create(process, object_id=process_id)
@@ -356,12 +596,14 @@ class ProcessDispatcherService(BaseProcessDispatcherService):
 
         return self.backend.read_process(process_id)
 
-    def list_processes(self):
+    def list_processes(self, state=None, process_definition_id=None):
         """Lists managed processes
 
+        @param state    optional ProcessStateEnum value (or list of values)
+        @param process_definition_id    optional, only processes of this definition
         @retval processes    list
         """
-        return self.backend.list()
+        return self.backend.list(state=state, definition_id=process_definition_id)
 
     def _get_process_name(self, process_definition, configuration):
 
@@ -533,7 +775,13 @@ class PDLocalBackend(object):
     def __init__(self, container):
         self.container = container
         self.event_pub = EventPublisher()
-        self._processes = []
+
+        # process table keyed by process id, with indexes of process ids by
+        # state and by definition so queries don't scan every process
+        self._processes = {}
+        self._definitions = {}
+        self._by_state = {}
+        self._by_definition = {}
 
         self._spawn_greenlets = set()
 
@@ -578,10 +826,10 @@ class PDLocalBackend(object):
                 process_id, definition, schedule, configuration)
             self._spawn_greenlets.add(glet)
 
-            self._add_process(process_id, configuration, None)
+            self._add_process(process_id, configuration, None, definition_id)
 
         else:
-            self._add_process(process_id, configuration, None)
+            self._add_process(process_id, configuration, None, definition_id)
             self._inner_spawn(process_id, definition, schedule, configuration)
 
         return process_id
@@ -602,8 +850,7 @@ class PDLocalBackend(object):
         log.debug('PD: Spawned Process (%s)', pid)
 
         # update state on the existing process
-        process = self._get_process(process_id)
-        process.process_state = ProcessStateEnum.RUNNING
+        self._set_process_state(process_id, ProcessStateEnum.RUNNING)
 
         self.event_pub.publish_event(event_type="ProcessLifecycleEvent",
             origin=process_id, origin_type="DispatchedProcess",
@@ -636,24 +883,71 @@ class PDLocalBackend(object):
             raise NotFound("process %s unknown" % process_id)
         return process
 
-    def _add_process(self, pid, config, state):
+    def _add_process(self, pid, config, state, definition_id=None):
+        if pid in self._processes:
+            self._remove_process(pid)
+
         proc = Process(process_id=pid, process_state=state,
                 process_configuration=config)
 
-        self._processes.append(proc)
+        self._processes[pid] = proc
+        self._definitions[pid] = definition_id
+        self._by_state.setdefault(state, set()).add(pid)
+        self._by_definition.setdefault(definition_id, set()).add(pid)
 
     def _remove_process(self, pid):
-        self._processes = filter(lambda u: u.process_id != pid, self._processes)
+        proc = self._processes.pop(pid, None)
+        if proc is None:
+            raise ValueError("unknown process %s" % pid)
+
+        definition_id = self._definitions.pop(pid, None)
+        self._unindex(self._by_state, proc.process_state, pid)
+        self._unindex(self._by_definition, definition_id, pid)
 
     def _get_process(self, pid):
-        wanted_procs = filter(lambda u: u.process_id == pid, self._processes)
-        if len(wanted_procs) >= 1:
-            return wanted_procs[0]
-        else:
-            return None
+        return self._processes.get(pid)
 
-    def list(self):
-        return self._processes
+    def _set_process_state(self, pid, state):
+        proc = self._processes.get(pid)
+        if proc is None:
+            return
+        self._unindex(self._by_state, proc.process_state, pid)
+        proc.process_state = state
+        self._by_state.setdefault(state, set()).add(pid)
+
+    @staticmethod
+    def _unindex(index, key, pid):
+        pids = index.get(key)
+        if pids is not None:
+            pids.discard(pid)
+            if not pids:
+                del index[key]
+
+    def list(self, state=None, definition_id=None):
+        """Lists processes, optionally only those in a state (or any of a
+        list of states) and/or launched from a definition
+        """
+        if state is None and definition_id is None:
+            return self._processes.values()
+
+        pids = None
+        if state is not None:
+            states = state if isinstance(state, (list, tuple, set)) else [state]
+            pids = set()
+            for s in states:
+                pids.update(self._by_state.get(s, ()))
+        if definition_id is not None:
+            def_pids = self._by_definition.get(definition_id, set())
+            pids = def_pids if pids is None else pids & def_pids
+
+        return [self._processes[pid] for pid in pids]
+
+    def count(self, state=None):
+        """Number of processes, optionally only those in a state
+        """
+        if state is None:
+            return len(self._processes)
+        return len(self._by_state.get(state, ()))
 
 
 # map from internal PD states to external ProcessStateEnum values
@@ -984,9 +1278,11 @@ class PDNativeBackend(object):
         result = self.core.terminate_process(None, upid=process_id)
         return bool(result)
 
-    def list(self):
+    def list(self, state=None, definition_id=None):
+        if definition_id is not None:
+            raise BadRequest("listing processes by definition not supported by this backend")
         d_processes = self.core.describe_processes()
-        return [_ion_process_from_core(p) for p in d_processes]
+        return _filter_core_processes(d_processes, state)
 
     def read_process(self, process_id):
         d_process = self.core.describe_process(None, process_id)
@@ -1139,9 +1435,11 @@ class PDBridgeBackend(object):
         log.debug("Dashi Process Dispatcher terminating process: %s", proc)
         return True
 
-    def list(self):
+    def list(self, state=None, definition_id=None):
+        if definition_id is not None:
+            raise BadRequest("listing processes by definition not supported by this backend")
         d_processes = self.dashi.call(self.topic, "describe_processes")
-        return [_ion_process_from_core(p) for p in d_processes]
+        return _filter_core_processes(d_processes, state)
 
     def read_process(self, process_id):
         d_process = self.dashi.call(self.topic, "describe_process", upid=process_id)
@@ -1174,6 +1472,13 @@ def _ion_process_from_core(core_process):
 
     return process
 
+def _filter_core_processes(core_processes, state=None):
+    processes = [_ion_process_from_core(p) for p in core_processes]
+    if state is None:
+        return processes
+    states = state if isinstance(state, (list, tuple, set)) else [state]
+    return [p for p in processes if p.process_state in states]
+
 def _core_process_from_ion(ion_process):
     process = {
             'state': _PD_PYON_PROCESS_STATE_MAP.get(ion_process.process_state),
@@ -9,24 +9,64 @@ from pyon.event.event import EventPublisher
 from pyon.core.bootstrap import CFG
 from interface.services.cei.ischeduler_service import BaseSchedulerService
 from interface.objects import IntervalTimer, TimeOfDayTimer
+from ion.services.cei.timer_queue import TimerQueue
 
 from datetime import datetime, timedelta
-from math import ceil
+from math import ceil, floor
 import time
 import gevent
 
 
 class SchedulerService(BaseSchedulerService):
-    schedule_entries = {}
+    '''
+    Timers are kept in a TimerQueue (a heap driven by one dispatcher greenlet) keyed by
+    (timer_id, index), where index is the position of the time of day for a TimeOfDayTimer.
+
+    Fire times are computed in constant time from the timer's start time. When a timer fires
+    more than one period late (a stalled process, a clock jump) its catch up policy decides how
+    many events are published for the missed fire times:
+      once  one event (default)
+      all   one event per missed fire time, at most MAX_CATCH_UP
+      skip  no event, the timer waits for its next fire time
+    The policy of a timer is the catch_up argument of create_timer when it is called in process,
+    otherwise the policy of its event origin in process.scheduler.catch_up_by_origin, otherwise
+    process.scheduler.catch_up. The generated service clients can't pass catch_up (it isn't in
+    the service definition), so remote callers and timers restored on a system restart are
+    configured by origin.
+
+    Events are published with one long-lived publisher. The resources of expired timers are
+    deleted in batches, EXPIRY_BATCH_SIZE at a time or every EXPIRY_FLUSH_INTERVAL seconds;
+    cancelled timers are deleted right away.
+    '''
+    CATCH_UP_ONCE = 'once'
+    CATCH_UP_ALL  = 'all'
+    CATCH_UP_SKIP = 'skip'
+    CATCH_UP_POLICIES = (CATCH_UP_ONCE, CATCH_UP_ALL, CATCH_UP_SKIP)
+    MAX_CATCH_UP = 100
+
+    EXPIRY_BATCH_SIZE     = 100
+    EXPIRY_FLUSH_INTERVAL = 5.0 # Seconds
+    EXPIRY_FLUSH_KEY      = 'expired_cleanup' # Key of the flush in the timer queue
+
+    def on_init(self):
+        self.schedule_entries = {}
+        self.timers = TimerQueue()
+        self.event_publisher = EventPublisher(event_type="ResourceEvent")
+        self._expired = [] # Ids of expired timers waiting to be deleted from the resource registry
 
     def on_start(self):
+        self.timers.start()
         if CFG.get_safe("process.start_mode") == "RESTART":
             self.on_system_restart()
 
+    def on_quit(self):
+        self.timers.stop()
+        self._flush_expired()
+        self.event_publisher.close()
+
     def __notify(self, task, id, index):
         log.debug("SchedulerService:__notify: - " + task.event_origin + " - Time: " + str(self.__now()) + " - ID: " + id + " -Index:" + str(index))
-        pub = EventPublisher(event_type="ResourceEvent")
-        pub.publish_event(origin=task.event_origin)
+        self.event_publisher.publish_event(origin=task.event_origin)
 
     def __now(self):
         return datetime.utcnow()
@@ -34,18 +74,53 @@ class SchedulerService(BaseSchedulerService):
     def __now_posix(self, now):
         return time.mktime(now.timetuple())
 
-    def _expire_callback(self, id, index):
+    def _expire_callback(self, id, index, due=None):
+        if id not in self.schedule_entries:
+            # Cancelled while the timer was firing
+            return
         task = self.__get_entry(id)
-        self.__notify(task, id, index)
-        if not self.__reschedule(id, index):
+        for i in xrange(self.__catch_up_count(id, task, due)):
+            self.__notify(task, id, index)
+        if not self.__reschedule(id, index, due):
             self.__delete(id, index)
 
+    def __period(self, task):
+        if type(task) == TimeOfDayTimer:
+            return 86400
+        return task.interval
+
+    def __missed(self, task, due, now_posix):
+        # Fire times missed after the one that was due, bounded by an interval timer's end time
+        if due is None or now_posix <= due:
+            return 0
+        missed = int(floor((now_posix - due) / float(self.__period(task))))
+        if type(task) == IntervalTimer and task.end_time != -1:
+            missed = min(missed, int(floor((task.end_time - due) / float(task.interval))))
+        return max(missed, 0)
+
+    def __catch_up_count(self, id, task, due):
+        '''
+        Number of events to publish for a timer that was due at the posix time due
+        '''
+        missed = self.__missed(task, due, self.__now_posix(self.__now()))
+        if not missed:
+            return 1
+        policy = self.__get_entry_all(id).get("catch_up", self.CATCH_UP_ONCE)
+        log.debug("SchedulerService:__catch_up_count: " + str(id) + " missed " + str(missed) + " fire times - Policy: " + policy)
+        if policy == self.CATCH_UP_ALL:
+            return min(missed + 1, self.MAX_CATCH_UP)
+        if policy == self.CATCH_UP_SKIP:
+            return 0
+        return 1
+
+    def __catch_up_policy(self, task):
+        by_origin = CFG.get_safe("process.scheduler.catch_up_by_origin") or {}
+        return by_origin.get(task.event_origin) or CFG.get_safe("process.scheduler.catch_up", self.CATCH_UP_ONCE)
+
     def __calculate_next_interval(self, task, current_time):
         if task.start_time < current_time:
-            next_interval = task.start_time
-            while (next_interval < current_time):
-                next_interval = next_interval + task.interval
-            return (next_interval - current_time)
+            intervals = ceil((current_time - task.start_time) / float(task.interval))
+            return (task.start_time + intervals * task.interval) - current_time
         else:
             return (task.start_time - current_time) + task.interval
 
@@ -61,7 +136,7 @@ class SchedulerService(BaseSchedulerService):
             expires_in = [(self.__calculate_next_interval(task, now_posix))]
         return expires_in
 
-    def __get_reschedule_expire_time(self, task, index):
+    def __get_reschedule_expire_time(self, task, index, due=None):
         expires_in = False
         now = self.__now()
         now_posix = self.__now_posix(now)
@@ -73,11 +148,16 @@ class SchedulerService(BaseSchedulerService):
                 expires_in = (ceil((expire_time - now).total_seconds()))
             else:
                 expires_in = False
-        elif type(task) == IntervalTimer and (task.end_time == -1 or ((now_posix + task.interval) <= task.end_time)):
-            if task.start_time <= now_posix:
-                expires_in = (task.interval)
+        elif type(task) == IntervalTimer:
+            if due is None:
+                next_fire = now_posix + self.__calculate_next_interval(task, now_posix)
             else:
-                expires_in = ((task.start_time - now_posix) + task.interval)
+                # The first fire time on the timer's grid after now
+                next_fire = due + (self.__missed(task, due, now_posix) + 1) * task.interval
+                while next_fire <= now_posix:
+                    next_fire += task.interval # At most once, now_posix is truncated to the second
+            if task.end_time == -1 or next_fire <= task.end_time:
+                expires_in = next_fire - now_posix
 
         return expires_in
 
@@ -87,9 +167,8 @@ class SchedulerService(BaseSchedulerService):
                 return False
         return True
 
-    def __schedule(self, scheduler_entry, id=False):
+    def __schedule(self, scheduler_entry, id=False, catch_up=None):
         # if "id" is set, it means scheduler_entry is already in Resource Regsitry. This can occur during a sytsem restart
-        spawns = []
         task = scheduler_entry.entry
         expire_times = self.__get_expire_time(task)
         if not self.__validate_expire_times(expire_times):
@@ -98,22 +177,23 @@ class SchedulerService(BaseSchedulerService):
 
         if not id:
             id, _ = self.clients.resource_registry.create(scheduler_entry)
-        self.__create_entry(task, spawns, id)
+        self.__create_entry(task, len(expire_times), id, catch_up or self.__catch_up_policy(task))
+        now = time.time()
+        now_posix = self.__now_posix(self.__now())
         for index, expire_time in enumerate(expire_times):
             log.debug("SchedulerService:__schedule: scheduling: - " + task.event_origin + " - Now: " + str(self.__now()) +
                       " - Expire: " + str(expire_time) + " - ID: " + id + " - Index:" + str(index))
-            spawn = gevent.spawn_later(expire_time, self._expire_callback, id, index)
-            spawns.append(spawn)
+            self.timers.schedule((id, index), now + expire_time, self._expire_callback, id, index, now_posix + expire_time)
         return id
 
-    def __reschedule(self, id, index):
+    def __reschedule(self, id, index, due=None):
         task = self.__get_entry(id)
-        expire_time = self.__get_reschedule_expire_time(task, index)
+        expire_time = self.__get_reschedule_expire_time(task, index, due)
         if expire_time:
             log.debug("SchedulerService:__reschedule: rescheduling: - " + task.event_origin + " - Now: " + str(self.__now()) +
                       " - Expire: " + str(expire_time) + " - ID: " + id + " -Index:" + str(index))
-            spawn = gevent.spawn_later(expire_time, self._expire_callback, id, index)
-            self.__update_entry(id=id, index=index, spawn=spawn)
+            now_posix = self.__now_posix(self.__now())
+            self.timers.schedule((id, index), time.time() + expire_time, self._expire_callback, id, index, now_posix + expire_time)
 
             return True
         else:
@@ -121,20 +201,19 @@ class SchedulerService(BaseSchedulerService):
                       " - Expire: " + str(expire_time) + " - ID: " + id + " -Index:" + str(index))
         return False
 
-    def __create_entry(self, task, spawns, id):
-        self.schedule_entries[id] = {"task": task, "spawns": spawns}
+    def __create_entry(self, task, count, id, catch_up=CATCH_UP_ONCE):
+        self.schedule_entries[id] = {"task": task, "count": count, "catch_up": catch_up}
 
-    def __update_entry(self, id, index, spawn=None, interval=None):
-        if spawn is not None:
-            self.schedule_entries[id]["spawns"][index] = spawn
+    def __update_entry(self, id, index, interval=None):
         if interval is not None:
             self.schedule_entries[id]["task"].interval = interval
 
     def __get_entry_all(self, id):
         return self.schedule_entries[id]
 
-    def __get_spawns(self, id):
-        return self.schedule_entries[id]["spawns"]
+    def __cancel_timers(self, id):
+        for index in xrange(self.schedule_entries[id]["count"]):
+            self.timers.cancel((id, index))
 
     def __get_entry(self, id):
         return self.schedule_entries[id]["task"]
@@ -158,14 +237,42 @@ class SchedulerService(BaseSchedulerService):
                 if are_all_timers_expired:
                     log.debug("SchedulerService:__delete: entry deleted " + id + " -Index:" + str(index))
                     del self.schedule_entries[id]
-                    self.clients.resource_registry.delete(id)
+                    self.__expire(id)
             else:
                 log.debug("SchedulerService:__delete: entry deleted " + id + " -Index:" + str(index))
                 del self.schedule_entries[id]
-                self.clients.resource_registry.delete(id)
+                if force:
+                    self.clients.resource_registry.delete(id)
+                else:
+                    self.__expire(id)
             return True
         return False
 
+    def __expire(self, id):
+        # The resource is deleted with the next batch
+        self._expired.append(id)
+        if len(self._expired) >= self.EXPIRY_BATCH_SIZE:
+            self._flush_expired()
+        elif self.EXPIRY_FLUSH_KEY not in self.timers:
+            self.timers.schedule(self.EXPIRY_FLUSH_KEY, time.time() + self.EXPIRY_FLUSH_INTERVAL, self._flush_expired)
+
+    def _flush_expired(self):
+        '''
+        Deletes the resources of the expired timers, concurrently
+        '''
+        self.timers.cancel(self.EXPIRY_FLUSH_KEY)
+        expired, self._expired = self._expired, []
+        if not expired:
+            return
+        log.debug("SchedulerService:_flush_expired: deleting " + str(len(expired)) + " expired timers")
+        gevent.joinall([gevent.spawn(self.__delete_resource, id) for id in expired])
+
+    def __delete_resource(self, id):
+        try:
+            self.clients.resource_registry.delete(id)
+        except Exception:
+            log.exception("SchedulerService:__delete_resource: failed to delete expired timer " + str(id))
+
     def __is_timer_valid(self, task):
         # Validate event_origin is set
         if not task.event_origin:
@@ -176,6 +283,9 @@ class SchedulerService(BaseSchedulerService):
             if (task.end_time != -1 and (self.__now_posix(self.__now()) >= task.end_time)):
                 log.error("SchedulerService.__is_timer_valid: IntervalTimer is set to incorrect value")
                 return False
+            if not task.interval or task.interval <= 0:
+                log.error("SchedulerService.__is_timer_valid: IntervalTimer interval must be positive")
+                return False
         elif type(task) == TimeOfDayTimer:
             for time_of_day in task.times_of_day:
                 time_of_day['hour'] = int(time_of_day['hour'])
@@ -200,19 +310,24 @@ class SchedulerService(BaseSchedulerService):
         # to remove current active timer and restore them from Resource Regstiry
         if self.schedule_entries:
             for timer_id in self.schedule_entries:
-                spawns = self.__get_spawns(timer_id)
-                for spawn in spawns:
-                    spawn.kill()
+                self.__cancel_timers(timer_id)
                 log.debug("SchedulerService:on_system_restart: timer deleted  " + timer_id)
             self.schedule_entries.clear()
 
+        # Expired timers still waiting to be deleted must not be restored
+        self._flush_expired()
+
         # Restore the timer from Resource Registry
         scheduler_entries, _ = self.clients.resource_registry.find_resources(RT.SchedulerEntry, id_only=False)
         for scheduler_entry in scheduler_entries:
+            if not self.__get_expire_time(scheduler_entry.entry):
+                # Expired while the scheduler was down
+                self.__expire(scheduler_entry._id)
+                continue
             self.__schedule(scheduler_entry, scheduler_entry._id)
             log.debug("SchedulerService:on_system_restart: timer restored: " + scheduler_entry._id)
 
-    def create_timer(self, scheduler_entry=None):
+    def create_timer(self, scheduler_entry=None, catch_up=None):
         """
         Create a timer which will send TimerEvents as requested for a given schedule.
         The schedule request is expressed through a specific subtype of TimerSchedulerEntry.
@@ -223,14 +338,18 @@ class SchedulerService(BaseSchedulerService):
         Returns a timer_id which can be used to cancel the timer.
 
         @param timer__schedule    TimerSchedulerEntry
+        @param catch_up    str    'once', 'all' or 'skip', what to publish for fire times missed by a late timer
         @retval timer_id    str
         @throws BadRequest    if timer is misformed and can not be scheduled
         """
         ##scheduler_entry = scheduler_entry.entry
+        if catch_up and catch_up not in self.CATCH_UP_POLICIES:
+            log.error("SchedulerService.create_timer: unknown catch up policy: " + str(catch_up))
+            raise BadRequest
         status = self.__is_timer_valid(scheduler_entry.entry)
         if not status:
             raise BadRequest
-        id = self.__schedule(scheduler_entry)
+        id = self.__schedule(scheduler_entry, catch_up=catch_up)
         if not id:
             raise BadRequest
         return id
@@ -244,16 +363,14 @@ class SchedulerService(BaseSchedulerService):
         """
         #try:
         try:
-            spawns = self.__get_spawns(timer_id)
-            for spawn in spawns:
-                spawn.kill()
+            self.__cancel_timers(timer_id)
             log.debug("SchedulerService: cancel_timer: id: " + str(timer_id))
             self.__delete(id=timer_id, index=None, force=True)
         except:
             log.error("SchedulerService: cancel_timer: timer id doesn't exist: " + str(timer_id))
             raise BadRequest
 
-    def create_interval_timer(self, start_time="", interval=0, end_time="", event_origin="", event_subtype=""):
+    def create_interval_timer(self, start_time="", interval=0, end_time="", event_origin="", event_subtype="", catch_up=None):
         if (end_time != -1 and (self.__now_posix(self.__now()) >= end_time)) or not event_origin:
             log.error("SchedulerService.create_interval_timer: event_origin is not set")
             raise BadRequest
@@ -262,9 +379,9 @@ class SchedulerService(BaseSchedulerService):
         interval_timer = IonObject("IntervalTimer", {"start_time": start_time, "interval": interval, "end_time": end_time,
                                                      "event_origin": event_origin, "event_subtype": event_subtype})
         se = IonObject(RT.SchedulerEntry, {"entry": interval_timer})
-        return self.create_timer(se)
+        return self.create_timer(se, catch_up=catch_up)
 
-    def create_time_of_day_timer(self, times_of_day=None, expires='', event_origin='', event_subtype=''):
+    def create_time_of_day_timer(self, times_of_day=None, expires='', event_origin='', event_subtype='', catch_up=None):
         # Validate the timer
         if not event_origin:
             log.error("SchedulerService.create_time_of_day_timer: event_origin is set to invalid value")
@@ -283,4 +400,4 @@ class SchedulerService(BaseSchedulerService):
                                                          "event_origin": event_origin, "event_subtype": event_subtype})
 
         se = IonObject(RT.SchedulerEntry, {"entry": time_of_day_timer})
-        return self.create_timer(se)
+        return self.create_timer(se, catch_up=catch_up)
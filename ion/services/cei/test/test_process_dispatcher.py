@@ -149,6 +149,79 @@ class ProcessDispatcherServiceLocalTest(PyonTestCase):
         self.assertTrue(ok)
         self.mock_cc_terminate.assert_called_once_with("process-id")
 
+    def test_local_list_processes(self):
+        backend = self.pd_service.backend
+        backend.event_pub = Mock()
+
+        proc_def = DotDict()
+        proc_def['name'] = "someprocess"
+        proc_def['executable'] = {'module': 'my_module', 'class': 'class'}
+        self.mock_rr.read.return_value = proc_def
+
+        backend.spawn("proc1", "def1", None, {}, "proc1")
+        backend.spawn("proc2", "def2", None, {}, "proc2")
+        backend._add_process("proc3", {}, None, "def1")
+
+        self.assertEqual(len(self.pd_service.list_processes()), 3)
+        running = self.pd_service.list_processes(state=ProcessStateEnum.RUNNING)
+        self.assertEqual(set(p.process_id for p in running), set(["proc1", "proc2"]))
+        by_def = self.pd_service.list_processes(process_definition_id="def1")
+        self.assertEqual(set(p.process_id for p in by_def), set(["proc1", "proc3"]))
+        both = self.pd_service.list_processes(state=ProcessStateEnum.RUNNING,
+            process_definition_id="def1")
+        self.assertEqual([p.process_id for p in both], ["proc1"])
+        self.assertEqual(backend.count(ProcessStateEnum.RUNNING), 2)
+
+        self.pd_service.cancel_process("proc1")
+        self.assertEqual(backend.count(), 2)
+        self.assertEqual(backend.count(ProcessStateEnum.RUNNING), 1)
+        self.assertEqual(self.pd_service.list_processes(process_definition_id="def1")[0].process_id, "proc3")
+        with self.assertRaises(NotFound):
+            self.pd_service.read_process("proc1")
+
+    def test_schedule_processes(self):
+        backend = self.pd_service.backend
+        backend.event_pub = Mock()
+
+        proc_def = DotDict()
+        proc_def['name'] = "someprocess"
+        proc_def['executable'] = {'module': 'my_module', 'class': 'class'}
+        bad_def = DotDict()
+        bad_def['name'] = "badprocess"
+        bad_def['executable'] = {}
+        definitions = {"def1": proc_def, "bad": bad_def}
+        def read_definition(definition_id):
+            if definition_id not in definitions:
+                raise NotFound()
+            return definitions[definition_id]
+        self.mock_rr.read.side_effect = read_definition
+
+        requests = [dict(process_definition_id="def1", process_id="proc%d" % i,
+                         configuration={"i": i}) for i in range(20)]
+        requests.append(dict(process_definition_id="def1", process_id="proc0"))
+        requests.append(dict(process_definition_id="bad"))
+        requests.append(dict(process_definition_id="missing"))
+        requests.append(dict(process_definition_id="def1"))
+
+        results = self.pd_service.schedule_processes(requests, parallelism=4)
+
+        self.assertEqual(len(results), 24)
+        self.assertTrue(all(r['success'] for r in results[:20]))
+        self.assertEqual([r['process_id'] for r in results[:20]], ["proc%d" % i for i in range(20)])
+        self.assertFalse(results[20]['success'])
+        self.assertIn("more than once", results[20]['error'])
+        self.assertFalse(results[21]['success'])
+        self.assertFalse(results[22]['success'])
+        self.assertTrue(results[23]['success'])
+        self.assertTrue(results[23]['process_id'].startswith("someprocess"))
+
+        # each definition is read once to validate, then the local backend
+        # reads it again for each of the valid requests it spawns
+        self.assertEqual(self.mock_rr.read.call_count, 3 + 21)
+        self.assertEqual(self.mock_cc_spawn.call_count, 21)
+        self.assertEqual(backend.count(ProcessStateEnum.RUNNING), 21)
+        self.assertEqual(self.pd_service.read_process("proc5").process_configuration, {"i": 5})
+
 @attr('UNIT', group='cei')
 class ProcessDispatcherServiceDashiHandlerTest(PyonTestCase):
     """Tests the dashi frontend of the PD
@@ -1,14 +1,17 @@
 
-from ion.services.cei.process_dispatcher_service import ProcessStateGate
+from ion.services.cei.process_dispatcher_service import ProcessStateGate, ProcessStateGroupGate,\
+    ProcessStateRouter
 
 from nose.plugins.attrib import attr
 from gevent import queue, spawn_later
 from gevent.queue import Empty
+from mock import Mock, patch
 
 
 from pyon.net.endpoint import RPCClient
 from pyon.service.service import BaseService
 from pyon.util.containers import DotDict
+from pyon.core.exception import NotFound
 from pyon.util.unit_test import PyonTestCase
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.public import log
@@ -61,6 +64,78 @@ class TestClient(RPCClient):
 
 
 
+@attr('UNIT', group='cei')
+class ProcessStateGateUnitTest(PyonTestCase):
+
+    def setUp(self):
+        patcher = patch('ion.services.cei.process_dispatcher_service.EventSubscriber')
+        self.mock_subscriber_cls = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = ProcessStateRouter()
+        self.states = {}
+
+    def read_process(self, process_id):
+        if process_id not in self.states:
+            raise NotFound()
+        return DotDict(process_id=process_id, process_state=self.states[process_id])
+
+    def publish(self, process_id, state):
+        self.states[process_id] = state
+        self.router._route(DotDict(origin=process_id, state=state), {})
+
+    def test_router_shares_subscriber(self):
+        cb1, cb2 = Mock(), Mock()
+        self.router.register('p1', cb1)
+        self.router.register('p2', cb2)
+        self.assertEqual(self.mock_subscriber_cls.call_count, 1)
+        self.assertEqual(len(self.router), 2)
+
+        self.publish('p1', ProcessStateEnum.RUNNING)
+        self.assertEqual(cb1.call_count, 1)
+        self.assertFalse(cb2.called)
+
+        self.router.unregister('p1', cb1)
+        self.assertTrue(self.router.running)
+        self.router.unregister('p2', cb2)
+        self.assertFalse(self.router.running)
+        self.mock_subscriber_cls.return_value.stop.assert_called_once_with()
+
+    def test_gate(self):
+        gate = ProcessStateGate(self.read_process, 'p1', ProcessStateEnum.RUNNING, router=self.router)
+        spawn_later(0.01, self.publish, 'p1', ProcessStateEnum.RUNNING)
+        self.assertTrue(gate.await(5))
+        self.assertFalse(gate._get_first_chance())
+        self.assertFalse(self.router.running)
+
+    def test_group_all(self):
+        pids = ['p%d' % i for i in xrange(100)]
+        for pid in pids[:50]:
+            self.states[pid] = ProcessStateEnum.RUNNING
+        gate = ProcessStateGroupGate(self.read_process, pids, ProcessStateEnum.RUNNING, router=self.router)
+        def run_rest():
+            for pid in pids[50:]:
+                self.publish(pid, ProcessStateEnum.RUNNING)
+        spawn_later(0.01, run_rest)
+
+        self.assertTrue(gate.await_all(5))
+        self.assertEqual(gate.reached, set(pids))
+        self.assertEqual(self.mock_subscriber_cls.call_count, 1)
+        self.assertEqual(len(self.router), 0)
+
+    def test_group_any(self):
+        gate = ProcessStateGroupGate(self.read_process, ['p1', 'p2'],
+            {'p1': ProcessStateEnum.RUNNING, 'p2': ProcessStateEnum.TERMINATED}, router=self.router)
+        spawn_later(0.01, self.publish, 'p2', ProcessStateEnum.TERMINATED)
+        self.assertTrue(gate.await_any(5))
+        self.assertEqual(gate.pending, ['p1'])
+
+    def test_group_timeout(self):
+        self.states['p1'] = ProcessStateEnum.RUNNING
+        gate = ProcessStateGroupGate(self.read_process, ['p1', 'p2'], ProcessStateEnum.RUNNING, router=self.router)
+        self.assertFalse(gate.await_all(0.01))
+        self.assertEqual(gate.pending, ['p2'])
+
+
 @attr('INT', group='cei')
 class ProcessStateGateIntTest(IonIntegrationTestCase):
 
@@ -3,25 +3,121 @@
 
 from pyon.core.exception import BadRequest, NotFound
 from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
 from pyon.util.context import LocalContextMixin
 from pyon.event.event import EventSubscriber
 from pyon.core.bootstrap import CFG
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceProcessClient
 from interface.services.cei.ischeduler_service import SchedulerServiceProcessClient
+from interface.objects import IntervalTimer, SchedulerEntry
 from nose.plugins.attrib import attr
 from ion.services.cei.scheduler_service import SchedulerService
+from ion.services.cei.timer_queue import ARGS
 import gevent
 import datetime
 from datetime import timedelta
 import time
 import math
 import unittest
+from mock import Mock, patch
 
 class FakeProcess(LocalContextMixin):
     name = 'scheduler_test'
     id = 'scheduler_client'
     process_type = 'simple'
 
+@attr('UNIT', group='cei')
+class SchedulerServiceUnitTest(PyonTestCase):
+    def setUp(self):
+        self.scheduler = SchedulerService()
+        self.scheduler.clients = Mock()
+        self.scheduler.clients.resource_registry.create.return_value = ('timer_id', 'rev')
+        self.scheduler.on_init()
+        self.scheduler._SchedulerService__notify = Mock()
+
+    def now_posix(self):
+        return time.mktime(datetime.datetime.utcnow().timetuple())
+
+    def interval_timer(self, start_time, interval, catch_up=None, end_time=-1):
+        task = IntervalTimer(start_time=start_time, interval=interval, end_time=end_time, event_origin='origin', event_subtype='')
+        return self.scheduler.create_timer(SchedulerEntry(entry=task), catch_up=catch_up)
+
+    def test_next_fire_is_closed_form(self):
+        # A billion intervals since the start time, the next fire time is on the timer's grid
+        now = datetime.datetime(2012, 7, 12, 14, 30, 6)
+        self.scheduler._SchedulerService__now = Mock(return_value=now)
+        now_posix = time.mktime(now.timetuple())
+        timer_id = self.interval_timer(now_posix - 10**9 * 10 + 2.5, 10)
+
+        _, _, due = self.scheduler.timers._timers[(timer_id, 0)][ARGS] # Callback arguments: id, index, due
+        self.assertEquals(due, now_posix + 2.5)
+
+    def test_bad_interval(self):
+        with self.assertRaises(BadRequest):
+            self.interval_timer(self.now_posix(), 0)
+        with self.assertRaises(BadRequest):
+            self.interval_timer(self.now_posix(), 10, catch_up='sometimes')
+
+    def check_catch_up(self, catch_up, expected_events):
+        now = self.now_posix()
+        timer_id = self.interval_timer(now - 1000, 10, catch_up=catch_up)
+        self.scheduler._SchedulerService__notify.reset_mock()
+
+        # Fired 55 seconds late, five fire times were missed
+        self.scheduler._expire_callback(timer_id, 0, now - 55)
+
+        self.assertEquals(self.scheduler._SchedulerService__notify.call_count, expected_events)
+        # Rescheduled on the grid: 5 seconds from now
+        self.assertAlmostEqual(self.scheduler.timers.next_deadline() - time.time(), 5, delta=1)
+
+    def test_catch_up_once(self):
+        self.check_catch_up(None, 1)
+
+    def test_catch_up_all(self):
+        self.check_catch_up('all', 6)
+
+    def test_catch_up_skip(self):
+        self.check_catch_up('skip', 0)
+
+    def test_catch_up_by_origin(self):
+        config = {'process.scheduler.catch_up_by_origin': {'origin': 'all'}, 'process.scheduler.catch_up': 'skip'}
+        with patch('ion.services.cei.scheduler_service.CFG') as cfg:
+            cfg.get_safe.side_effect = lambda key, default=None: config.get(key, default)
+            self.check_catch_up(None, 6)
+            # An explicit policy wins over the configuration
+            self.check_catch_up('once', 1)
+
+    def test_publisher_is_reused(self):
+        notify = SchedulerService.__dict__['_SchedulerService__notify']
+        self.scheduler.event_publisher = Mock()
+        task = IntervalTimer(event_origin='origin')
+        notify(self.scheduler, task, 'timer_id', 0)
+        notify(self.scheduler, task, 'timer_id', 0)
+        self.assertEquals(self.scheduler.event_publisher.publish_event.call_count, 2)
+
+    def test_expired_timers_deleted_in_batches(self):
+        rr = self.scheduler.clients.resource_registry
+        now = self.now_posix()
+        rr.create.side_effect = [('timer_1', 'rev'), ('timer_2', 'rev'), ('timer_3', 'rev')]
+        for i in xrange(3):
+            self.interval_timer(now - 5, 10, end_time=now + 10)
+
+        # The last fire time before the end time
+        self.scheduler._expire_callback('timer_1', 0, now + 5)
+        self.assertNotIn('timer_1', self.scheduler.schedule_entries)
+        self.assertFalse(rr.delete.called)
+        self.assertIn(SchedulerService.EXPIRY_FLUSH_KEY, self.scheduler.timers)
+
+        self.scheduler.EXPIRY_BATCH_SIZE = 2
+        self.scheduler._expire_callback('timer_2', 0, now + 5)
+        self.assertEquals(sorted(c[0][0] for c in rr.delete.call_args_list), ['timer_1', 'timer_2'])
+        self.assertNotIn(SchedulerService.EXPIRY_FLUSH_KEY, self.scheduler.timers)
+
+        # Cancelling deletes right away
+        self.scheduler.cancel_timer('timer_3')
+        rr.delete.assert_called_with('timer_3')
+
+
 @attr('INT', group='cei')
 class TestSchedulerService(IonIntegrationTestCase):
 
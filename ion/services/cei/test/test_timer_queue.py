@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+'''
+@file ion/services/cei/test/test_timer_queue.py
+@description Unit tests and benchmark for the scheduler's timer queue
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.log import log
+from ion.services.cei.timer_queue import TimerQueue
+from nose.plugins.attrib import attr
+import gevent
+import random
+import time
+
+@attr('UNIT', group='cei')
+class TimerQueueUnitTest(PyonTestCase):
+    def setUp(self):
+        self.fired = []
+        self.now = 1000.0
+        self.timers = TimerQueue(time_func=lambda: self.now)
+        self.addCleanup(self.timers.stop)
+
+    def run_greenlets(self):
+        # Lets the dispatcher and the callback greenlets run, without waiting on the clock
+        for i in xrange(5):
+            gevent.sleep(0)
+
+    def callback(self, *args):
+        self.fired.append(args)
+
+    def test_fire_due(self):
+        self.timers.schedule('b', 20, self.callback, 'b')
+        self.timers.schedule('a', 10, self.callback, 'a')
+        self.timers.schedule('c', 30, self.callback, 'c')
+
+        self.assertEquals(self.timers.fire_due(now=5), 5)
+        self.assertEquals(self.timers.fire_due(now=25), 5)
+        gevent.sleep(0)
+        self.assertEquals(self.fired, [('a',), ('b',)])
+        self.assertEquals(len(self.timers), 1)
+        self.assertEquals(list(self.timers.jitter), [15, 5])
+
+    def test_cancel_and_replace(self):
+        self.timers.schedule('a', 10, self.callback, 'a')
+        self.timers.schedule('b', 20, self.callback, 'b')
+        self.timers.schedule('b', 30, self.callback, 'b2')
+        self.assertTrue(self.timers.cancel('a'))
+        self.assertFalse(self.timers.cancel('a'))
+
+        self.assertEquals(self.timers.next_deadline(), 30)
+        self.assertEquals(self.timers.fire_due(now=40), None)
+        gevent.sleep(0)
+        self.assertEquals(self.fired, [('b2',)])
+
+    def test_compaction(self):
+        self.timers.COMPACT_MIN = 10
+        for i in xrange(100):
+            self.timers.schedule(i, i, self.callback)
+        for i in xrange(60):
+            self.timers.cancel(i)
+        self.assertTrue(len(self.timers._heap) < 100)
+        self.assertEquals(self.timers.next_deadline(), 60)
+
+    def test_dispatcher(self):
+        self.timers.start()
+        self.timers.schedule('late', self.now + 100, self.callback, 'late')
+        self.run_greenlets()
+
+        # An earlier timer wakes the sleeping dispatcher
+        self.now += 10
+        self.timers.schedule('early', self.now - 5, self.callback, 'early')
+        self.run_greenlets()
+        self.assertEquals(self.fired, [('early',)])
+        self.assertEquals(list(self.timers.jitter), [5])
+
+        self.now += 100
+        self.assertEquals(self.timers.fire_due(), None)
+        self.run_greenlets()
+        self.assertEquals(self.fired, [('early',), ('late',)])
+
+    def test_benchmark(self):
+        random.seed(0)
+        count = 200000
+        start = time.time()
+        for i in xrange(count):
+            self.timers.schedule(i, self.now + 3600 + random.random() * 86400, self.callback)
+        scheduled = time.time() - start
+
+        start = time.time()
+        for i in xrange(0, count, 2):
+            self.timers.cancel(i)
+        cancelled = time.time() - start
+        log.info('Scheduled %s timers in %.2fs, cancelled half in %.2fs', count, scheduled, cancelled)
+        self.assertEquals(len(self.timers), count / 2)
+
+        # 2000 timers due within half a second, on top of the ones above, fired as the clock
+        # advances in 10ms steps are each at most one step late
+        for i in xrange(2000):
+            self.timers.schedule(('soon', i), self.now + 0.1 + random.random() * 0.4, self.callback)
+        for step in xrange(50):
+            self.now += 0.01
+            self.timers.fire_due()
+        self.run_greenlets()
+        self.assertEquals(len(self.fired), 2000)
+        self.assertTrue(max(self.timers.jitter) <= 0.01 + 1e-9, max(self.timers.jitter))
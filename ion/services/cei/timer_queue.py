@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+'''
+@file ion/services/cei/timer_queue.py
+@description Heap of timers driven by a single dispatcher greenlet
+'''
+
+from pyon.util.log import log
+
+import collections
+import heapq
+import itertools
+import time
+import gevent
+import gevent.event
+
+# Heap entry fields
+DEADLINE, SEQ, KEY, CALLBACK, ARGS, ACTIVE = range(6)
+
+
+class TimerQueue(object):
+    '''
+    Timers keyed by any hashable key, kept in a heap ordered by deadline (posix seconds).
+
+    One dispatcher greenlet sleeps until the earliest deadline, so the number of greenlets and
+    the memory per timer don't grow with the number of schedules. Scheduling is O(log N).
+    Cancelling marks the heap entry dead in O(1), and dead entries are dropped when they reach
+    the top of the heap or when they make up half of it. Every callback runs in its own
+    short-lived greenlet so a slow callback doesn't delay the other timers.
+
+    The lateness of each firing (seconds past its deadline) is kept in jitter.
+
+        timers = TimerQueue()
+        timers.start()
+        timers.schedule('key', time.time() + 10, callback, arg)
+        timers.cancel('key')
+    '''
+    COMPACT_MIN    = 1024 # Dead entries tolerated before considering a compaction
+    JITTER_SAMPLES = 1000
+
+    def __init__(self, time_func=time.time):
+        self.time        = time_func
+        self.jitter      = collections.deque(maxlen=self.JITTER_SAMPLES)
+        self._heap       = []
+        self._timers     = {} # key -> heap entry
+        self._seq        = itertools.count()
+        self._dead       = 0
+        self._wakeup     = gevent.event.Event()
+        self._dispatcher = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def start(self):
+        if self._dispatcher is None:
+            self._dispatcher = gevent.spawn(self._dispatch)
+
+    def stop(self):
+        if self._dispatcher is not None:
+            self._dispatcher.kill()
+            self._dispatcher = None
+
+    def schedule(self, key, deadline, callback, *args):
+        '''
+        Calls callback(*args) at deadline, replacing any timer with the same key
+        '''
+        self.cancel(key)
+        entry = [deadline, next(self._seq), key, callback, args, True]
+        self._timers[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            # The dispatcher is sleeping until a later deadline
+            self._wakeup.set()
+
+    def cancel(self, key):
+        '''
+        Cancels a timer, returns False if there was none for the key
+        '''
+        entry = self._timers.pop(key, None)
+        if entry is None:
+            return False
+        entry[ACTIVE] = False
+        self._dead += 1
+        if self._dead > self.COMPACT_MIN and self._dead * 2 > len(self._heap):
+            self._compact()
+        return True
+
+    def clear(self):
+        self._heap = []
+        self._timers.clear()
+        self._dead = 0
+
+    def next_deadline(self):
+        self._drop_dead()
+        if self._heap:
+            return self._heap[0][DEADLINE]
+        return None
+
+    def fire_due(self, now=None):
+        '''
+        Fires the timers whose deadline has passed.
+        Returns the seconds until the next deadline, None if there are no timers left.
+        '''
+        if now is None:
+            now = self.time()
+        while True:
+            self._drop_dead()
+            if not self._heap:
+                return None
+            entry = self._heap[0]
+            if entry[DEADLINE] > now:
+                return entry[DEADLINE] - now
+            heapq.heappop(self._heap)
+            del self._timers[entry[KEY]]
+            entry[ACTIVE] = False
+            self.jitter.append(now - entry[DEADLINE])
+            gevent.spawn(self._fire, entry[CALLBACK], entry[ARGS])
+
+    def _fire(self, callback, args):
+        try:
+            callback(*args)
+        except Exception:
+            log.exception('Timer callback failed')
+
+    def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            timeout = self.fire_due()
+            self._wakeup.wait(timeout)
+
+    def _drop_dead(self):
+        while self._heap and not self._heap[0][ACTIVE]:
+            heapq.heappop(self._heap)
+            self._dead -= 1
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if entry[ACTIVE]]
+        heapq.heapify(self._heap)
+        self._dead = 0
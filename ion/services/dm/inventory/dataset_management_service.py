@@ -14,6 +14,7 @@ from pyon.util.file_sys import FileSystem, FS
 from pyon.util.log import log
 
 from ion.services.dm.utility.granule_utils import SimplexCoverage, ParameterDictionary, GridDomain, ParameterContext
+from ion.services.dm.utility.coverage_pool import CoveragePool
 
 from interface.objects import ParameterContextResource, ParameterDictionaryResource
 from interface.objects import DataSet
@@ -88,6 +89,7 @@ class DatasetManagementService(BaseDatasetManagementService):
         for assoc in assocs:
             self.clients.resource_registry.delete_association(assoc)
         self.clients.resource_registry.delete(dataset_id)
+        CoveragePool.instance().close(dataset_id)
 
     def register_dataset(self, dataset_id=''):
         dataset_obj = self.read_dataset(dataset_id)
@@ -122,16 +124,16 @@ class DatasetManagementService(BaseDatasetManagementService):
 #--------
 
     def get_dataset_info(self,dataset_id=''):
-        coverage = self._get_coverage(dataset_id)
-        return coverage.info
+        with self._pooled_coverage(dataset_id) as coverage:
+            return coverage.info
 
     def get_dataset_parameters(self, dataset_id=''):
-        coverage = self._get_coverage(dataset_id)
-        return coverage.parameter_dictionary.dump()
+        with self._pooled_coverage(dataset_id) as coverage:
+            return coverage.parameter_dictionary.dump()
 
     def get_dataset_length(self, dataset_id=''):
-        coverage = self._get_coverage(dataset_id)
-        return coverage.num_timesteps
+        with self._pooled_coverage(dataset_id) as coverage:
+            return coverage.num_timesteps
 
 #--------
 
@@ -216,34 +218,34 @@ class DatasetManagementService(BaseDatasetManagementService):
     def dataset_bounds(self, dataset_id='', parameters=None):
         self.read_dataset(dataset_id) # Validates proper dataset
         parameters = parameters or None
-        coverage = self._get_coverage(dataset_id)
-        return coverage.get_data_bounds(parameters)
+        with self._pooled_coverage(dataset_id) as coverage:
+            return coverage.get_data_bounds(parameters)
 
     def dataset_bounds_by_axis(self, dataset_id='', axis=None):
         self.read_dataset(dataset_id) # Validates proper dataset
         axis = axis or None
-        coverage = self._get_coverage(dataset_id)
-        return coverage.get_data_bounds_by_axis(axis)
+        with self._pooled_coverage(dataset_id) as coverage:
+            return coverage.get_data_bounds_by_axis(axis)
 
     def dataset_extents(self, dataset_id='', parameters=None):
         self.read_dataset(dataset_id)
         parameters = parameters or None
-        coverage = self._get_coverage(dataset_id)
-        return coverage.get_data_extents(parameters)
+        with self._pooled_coverage(dataset_id) as coverage:
+            return coverage.get_data_extents(parameters)
 
     def dataset_extents_by_axis(self, dataset_id='', axis=None):
         self.read_dataset(dataset_id) 
         axis = axis or None
-        coverage = self._get_coverage(dataset_id)
-        return coverage.get_data_extents_by_axis(axis)
+        with self._pooled_coverage(dataset_id) as coverage:
+            return coverage.get_data_extents_by_axis(axis)
 
     def dataset_size(self,dataset_id='', parameters=None, slice_=None, in_bytes=False):
         self.read_dataset(dataset_id) 
         parameters = parameters or None
         slice_     = slice_ if isinstance(slice_, slice) else None
 
-        coverage = self._get_coverage(dataset_id)
-        return coverage.get_data_size(parameters, slice_, in_bytes)
+        with self._pooled_coverage(dataset_id) as coverage:
+            return coverage.get_data_size(parameters, slice_, in_bytes)
 
 #--------
 
@@ -318,6 +320,14 @@ class DatasetManagementService(BaseDatasetManagementService):
         coverage = SimplexCoverage(file_root, dataset_id)
         return coverage
 
+    @classmethod
+    def _pooled_coverage(cls, dataset_id, mode='r'):
+        '''
+        Context manager for a coverage from the process-wide pool, the coverage
+        must not be closed or used after the block exits.
+        '''
+        return CoveragePool.instance().acquire(dataset_id, mode)
+
     @classmethod
     def _get_coverage_path(cls, dataset_id):
         file_root = FileSystem.get_url(FS.CACHE,'datasets')
@@ -8,10 +8,10 @@
 
 from interface.objects import View, Catalog, ElasticSearchIndex
 from interface.services.dm.idiscovery_service import BaseDiscoveryService
-from pyon.util.containers import DotDict, get_safe
+from pyon.util.containers import DotDict, get_safe, create_unique_identifier
 from pyon.util.arg_check import validate_true, validate_is_instance
 from pyon.public import PRED, CFG, RT, log
-from pyon.core.exception import BadRequest
+from pyon.core.exception import BadRequest, NotFound
 from pyon.event.event import EventPublisher
 from pyon.core.bootstrap import get_obj_registry, get_sys_name
 from pyon.core.object import IonObjectDeserializer
@@ -24,8 +24,16 @@ import dateutil.parser
 import time
 import elasticpy as ep
 import heapq
+import gevent
+import gevent.local
+import collections
 
 SEARCH_BUFFER_SIZE=1024
+CURSOR_FETCH_SIZE=1000  # Kept under SEARCH_BUFFER_SIZE so paging doesn't raise buffer exceeded events
+CURSOR_PAGE_SIZE=100
+CURSOR_TTL=300          # Seconds an idle cursor is kept
+CURSOR_LIMIT=100
+READ_MULT_CHUNK=500     # Resources hydrated per read_mult call
 
 class DiscoveryService(BaseDiscoveryService):
 
@@ -33,6 +41,14 @@ class DiscoveryService(BaseDiscoveryService):
     class docstring
     """
 
+    def __init__(self, *args, **kwargs):
+        super(DiscoveryService, self).__init__(*args, **kwargs)
+        # State of the request being handled, one per greenlet so concurrent requests don't mix
+        self._request_local = gevent.local.local()
+
+        # Open result cursors by id
+        self._cursors = collections.OrderedDict()
+
     def on_start(self): # pragma no cover
         super(DiscoveryService,self).on_start()
 
@@ -494,25 +510,31 @@ class DiscoveryService(BaseDiscoveryService):
         '''
         Manage the different collections of indexes for queries, views, catalogs
         Expand the resource into it's components and call the callback for each subcategory
+
+        The results are the concatenation of each component's results, so an offset
+        applies to the merged results: every component is asked for its first
+        offset+limit hits and the merged list is sliced once.
         '''
         if isinstance(source, View):
-            catalogs = self.list_catalogs(source._id)
-            result_queue = list()
-            for catalog in catalogs:
-                result_queue.extend(cb(catalog, *args, **kwargs))
-            if kwargs.has_key('limit') and kwargs['limit']:
-                return result_queue[:kwargs['limit']]
-            return result_queue
-
-        if isinstance(source, Catalog):
-            indexes = self.clients.catalog_management.list_indexes(source._id, id_only=True)
-            result_queue = list()
-            for index in indexes:
-                result_queue.extend(cb(index, *args, **kwargs))
-            if kwargs.has_key('limit') and kwargs['limit']:
-                return result_queue[:kwargs['limit']]
-            return result_queue
-        return None
+            components = self.list_catalogs(source._id)
+        elif isinstance(source, Catalog):
+            components = self.clients.catalog_management.list_indexes(source._id, id_only=True)
+        else:
+            return None
+
+        offset = kwargs.get('offset') or 0
+        limit  = kwargs.get('limit') or 0
+        if 'offset' in kwargs:
+            kwargs['offset'] = 0
+        if limit:
+            kwargs['limit'] = offset + limit
+
+        result_queue = list()
+        for component in components:
+            result_queue.extend(cb(component, *args, **kwargs))
+        if limit:
+            return result_queue[offset:offset + limit]
+        return result_queue[offset:]
 
     def query_term(self, source_id='', field='', value='', fuzzy=False, order=None, limit=0, offset=0, id_only=False):
         '''
@@ -599,6 +621,9 @@ class DiscoveryService(BaseDiscoveryService):
         if limit:
             es.size(limit)
 
+        if offset:
+            es.from_offset(offset)
+
         if field == '*':
             field = '_all'
 
@@ -643,6 +668,9 @@ class DiscoveryService(BaseDiscoveryService):
         if limit:
             es.size(limit)
 
+        if offset:
+            es.from_offset(offset)
+
         if field == '*':
             field = '_all'
 
@@ -700,8 +728,16 @@ class DiscoveryService(BaseDiscoveryService):
         resource_ids = self.clients.index_management.list_collection_resources(collection_id, id_only=True)
         if id_only:
             return resource_ids
-        
-        resources = map(self.clients.resource_registry.read,resource_ids)
+
+        return self._read_resources(resource_ids)
+
+    def _read_resources(self, resource_ids):
+        '''
+        Hydrates resources with bulk read_mult calls of at most READ_MULT_CHUNK ids each
+        '''
+        resources = []
+        for i in xrange(0, len(resource_ids), READ_MULT_CHUNK):
+            resources.extend(self.clients.resource_registry.read_mult(resource_ids[i:i+READ_MULT_CHUNK]))
         return resources
 
     def query_geo_distance(self, source_id='', field='', origin=None, distance='', units='mi',order=None, limit=0, offset=0, id_only=False):
@@ -714,7 +750,7 @@ class DiscoveryService(BaseDiscoveryService):
         es = ep.ElasticSearch(host=self.elasticsearch_host, port=self.elasticsearch_port)
         source = self.clients.resource_registry.read(source_id)
 
-        iterate = self._multi(self.query_geo_distance, source=source, field=field, origin=origin, distance=distance) 
+        iterate = self._multi(self.query_geo_distance, source=source, field=field, origin=origin, distance=distance, units=units, order=order, limit=limit, offset=offset, id_only=id_only)
         if iterate is not None:
             return iterate
 
@@ -823,7 +859,18 @@ class DiscoveryService(BaseDiscoveryService):
             )
         
 
-    def request(self, query=None, id_only=True):
+    @property
+    def last_request_timings(self):
+        '''
+        Timing of each subquery in the last compound request handled by the calling greenlet
+        '''
+        return getattr(self._request_local, 'timings', [])
+
+    def request(self, query=None, id_only=None):
+        '''
+        Unless id_only is given, a single query (Tier-1) returns its hits
+        and a compound (Tier-2) request returns resource ids.
+        '''
         if not query:
             raise BadRequest('No request query provided')
         if not query.has_key('query'):
@@ -844,7 +891,10 @@ class DiscoveryService(BaseDiscoveryService):
         #================================================
 
         if not (query['or'] or query['and']): # Tier-1
-            return self.query_request(query.query)
+            return self.query_request(query.query, id_only=bool(id_only))
+
+        if id_only is None:
+            id_only = True
 
         #@todo: bulk requests against ES
         #@todo: filters
@@ -852,26 +902,28 @@ class DiscoveryService(BaseDiscoveryService):
         #================================================
         # Tier-2 Query
         #================================================
+        # Every subquery is dispatched at once, the request
+        # costs the slowest subquery rather than their sum
         
-        query_queue.append(self.query_request(query.query,limit=SEARCH_BUFFER_SIZE, id_only=True))
+        and_queries = [query.query] + list(query['and'])
+        or_queries  = list(query['or'])
+        results, timings = self._concurrent_requests(and_queries + or_queries, limit=SEARCH_BUFFER_SIZE)
+        self._request_local.timings = timings
+        log.debug('Discovery subquery timings: %s', timings)
         
         #==================
         # Intersection
         #==================
-        for q in query['and']:
-            query_queue.append(self.query_request(q, limit=SEARCH_BUFFER_SIZE, id_only=True))
-        while len(query_queue) > 1:
-            tmp = self.intersect(query_queue.pop(), query_queue.pop())
-            query_queue.append(tmp)
+        query_set = set(results[0])
+        for result in results[1:len(and_queries)]:
+            query_set.intersection_update(result)
         
         #==================
         # Union
         #==================
-        for q in query['or']:
-            query_queue.append(self.query_request(q, limit=SEARCH_BUFFER_SIZE, id_only=True))
-        while len(query_queue) > 1:
-            tmp = self.union(query_queue.pop(), query_queue.pop())
-            query_queue.append(tmp)
+        for result in results[len(and_queries):]:
+            query_set.update(result)
+        query_queue.append(list(query_set))
         
         if id_only:
             return query_queue[0]
@@ -879,9 +931,154 @@ class DiscoveryService(BaseDiscoveryService):
         objects = self.clients.resource_registry.read_mult(query_queue[0])
         return objects
 
+    def _concurrent_requests(self, queries, limit=0, exhaustive=False):
+        '''
+        Runs the (id only) query requests in parallel greenlets, exhaustive requests
+        page through every hit instead of stopping at limit.
+        Returns the results and the timing of each query in the same order as the queries
+        '''
+        def timed_request(q):
+            start = time.time()
+            if exhaustive:
+                result = self._query_all_ids(q)
+            else:
+                result = self.query_request(q, limit=limit, id_only=True)
+            return result, time.time() - start
 
+        greenlets = [gevent.spawn(timed_request, q) for q in queries]
+        gevent.joinall(greenlets)
+        results = []
+        timings = []
+        for q, g in zip(queries, greenlets):
+            if not g.successful():
+                raise g.exception
+            result, elapsed = g.value
+            results.append(result)
+            timings.append({'query':q, 'elapsed':elapsed, 'hits':len(result)})
+        return results, timings
 
 
+
+
+    #===================================================================
+    # Cursors
+    #===================================================================
+
+    def request_cursor(self, query=None, page_size=0, id_only=True):
+        '''
+        Opens a server-side cursor over the results of a request (same form as
+        the request operation) and returns the first page:
+            {'cursor_id':..., 'results':[...], 'more':True}
+        Further pages are read with next_page until 'more' is False.
+
+        A single query is paged from the index as the pages are read. A compound
+        (AND/OR) request pages through every hit of each subquery and keeps the
+        combined ids in the cursor, so no matches are dropped at the search buffer.
+
+        Cursors are held in the memory of the discovery process that opened them.
+        When several discovery workers share the service, next_page must reach the
+        same worker, any other raises NotFound for the cursor.
+        '''
+        if not (query and query.has_key('query') and query.has_key('and') and query.has_key('or')):
+            raise BadRequest('Improper query request: %s' % query)
+        self._expire_cursors()
+
+        cursor = DotDict(
+            page_size = page_size or CURSOR_PAGE_SIZE,
+            id_only   = id_only,
+            offset    = 0,
+            ids       = None,
+            query     = None,
+            touched   = time.time()
+        )
+        if query['or'] or query['and']:
+            and_queries = [query['query']] + list(query['and'])
+            or_queries  = list(query['or'])
+            results, timings = self._concurrent_requests(and_queries + or_queries, exhaustive=True)
+            self._request_local.timings = timings
+            query_set = set(results[0])
+            for result in results[1:len(and_queries)]:
+                query_set.intersection_update(result)
+            for result in results[len(and_queries):]:
+                query_set.update(result)
+            cursor.ids = sorted(query_set) # Stable order across pages
+        elif self._query_is_paged(query['query']):
+            cursor.query = query['query']
+        else:
+            cursor.ids = list(self.query_request(query['query'], id_only=True))
+
+        cursor_id = create_unique_identifier('cursor')
+        self._cursors[cursor_id] = cursor
+        return self.next_page(cursor_id)
+
+    def next_page(self, cursor_id=''):
+        '''
+        Returns the next page of a cursor opened with request_cursor
+        '''
+        cursor = self._cursors.get(cursor_id)
+        if cursor is None:
+            raise NotFound('Cursor %s does not exist or has expired' % cursor_id)
+        cursor.touched = time.time()
+
+        if cursor.ids is not None:
+            ids = cursor.ids[cursor.offset:cursor.offset + cursor.page_size]
+            more = cursor.offset + cursor.page_size < len(cursor.ids)
+        else:
+            ids = self._query_page(cursor.query, cursor.offset, cursor.page_size)
+            more = len(ids) == cursor.page_size
+        cursor.offset += len(ids)
+
+        if not more:
+            self.close_cursor(cursor_id)
+
+        if cursor.id_only or not ids:
+            results = ids
+        else:
+            results = self._read_resources(ids)
+        return {'cursor_id':cursor_id, 'results':results, 'more':more}
+
+    def close_cursor(self, cursor_id=''):
+        self._cursors.pop(cursor_id, None)
+        return True
+
+    def _expire_cursors(self):
+        now = time.time()
+        for cursor_id, cursor in self._cursors.items():
+            if now - cursor.touched > CURSOR_TTL:
+                del self._cursors[cursor_id]
+        while len(self._cursors) >= CURSOR_LIMIT:
+            self._cursors.popitem(0)
+
+    def _query_is_paged(self, query):
+        '''
+        Index searches support offsets, association and collection searches don't
+        '''
+        return (QueryLanguage.query_is_term_search(query) or
+                QueryLanguage.query_is_fuzzy_search(query) or
+                QueryLanguage.query_is_range_search(query) or
+                QueryLanguage.query_is_time_search(query) or
+                QueryLanguage.query_is_geo_distance_search(query) or
+                QueryLanguage.query_is_geo_bbox_search(query))
+
+    def _query_page(self, query, offset, limit):
+        page_query = dict(query)
+        page_query['offset'] = offset
+        page_query['limit']  = limit
+        return self.query_request(page_query, limit=limit, id_only=True)
+
+    def _query_all_ids(self, query):
+        '''
+        Every id matching a query, read in pages of CURSOR_FETCH_SIZE
+        '''
+        if not self._query_is_paged(query):
+            return self.query_request(query, id_only=True)
+        ids = []
+        while True:
+            page = self._query_page(query, len(ids), CURSOR_FETCH_SIZE)
+            ids.extend(page)
+            if len(page) < CURSOR_FETCH_SIZE:
+                return ids
+
     def raise_search_buffer_exceeded(self):
         self.ep.publish_event(origin='Discovery Service', description='Search buffer was exceeded, results may not contain all the possible results.')
 
@@ -30,6 +30,7 @@ from datetime import date, timedelta
 
 import elasticpy as ep
 import dateutil.parser
+import gevent
 import time
 import os
 import unittest
@@ -223,6 +224,21 @@ class DiscoveryUnitTest(PyonTestCase):
         retval = self.discovery.query_request(query)
         self.assertTrue(retval == 'test')
 
+    @patch('ion.services.dm.presentation.discovery_service.READ_MULT_CHUNK', 2)
+    def test_query_collection(self):
+        self.discovery.clients.index_management.list_collection_resources.return_value = ['a','b','c']
+        rr_read_mult = self.discovery.clients.resource_registry.read_mult
+        rr_read_mult.side_effect = lambda ids: ['res_%s' % i for i in ids]
+
+        retval = self.discovery.query_collection('collection_id', id_only=True)
+        self.assertEquals(retval, ['a','b','c'])
+        self.assertFalse(rr_read_mult.called)
+
+        retval = self.discovery.query_collection('collection_id')
+        self.assertEquals(retval, ['res_a','res_b','res_c'])
+        self.assertEquals(rr_read_mult.call_args_list, [((['a','b'],),{}), ((['c'],),{})])
+        self.assertFalse(self.rr_read.called)
+
     def test_bad_query(self):
         query = DotDict()
         query.unknown = 'yup'
@@ -299,7 +315,20 @@ class DiscoveryUnitTest(PyonTestCase):
         retval = self.discovery.request(query)
 
         self.assertTrue(retval=='test')
-        self.discovery.query_request.assert_called_once_with({})
+        self.discovery.query_request.assert_called_once_with({}, id_only=False)
+
+        self.discovery.query_request.reset_mock()
+        self.discovery.request(query, id_only=True)
+        self.discovery.query_request.assert_called_once_with({}, id_only=True)
+
+    def test_parse_tier1_returns_hits(self):
+        hits = [{'_id':'id1', '_source':{'name':'ctd'}}]
+        self.discovery.query_request = Mock(return_value=hits)
+
+        retval = self.discovery.parse("SEARCH 'name' IS 'ctd' FROM 'resources_index'")
+
+        self.assertEquals(retval, hits)
+        self.assertFalse(self.discovery.query_request.call_args[1]['id_only'])
 
     def test_tier2_request(self):
         result_list = [[0,1,2],[1,2],[0,1,2],[1,2,3,4]]
@@ -332,6 +361,82 @@ class DiscoveryUnitTest(PyonTestCase):
 
         self.assertTrue(retval == [0,1,2,3,4])
 
+    def test_tier2_request_concurrent(self):
+        in_flight = []
+        most_in_flight = [0]
+        def query_request(query, *args, **kwargs):
+            in_flight.append(query)
+            most_in_flight[0] = max(most_in_flight[0], len(in_flight))
+            gevent.sleep(0) # Yield as a search would, the other subqueries start meanwhile
+            in_flight.remove(query)
+            return query['result']
+
+        self.discovery.query_request = Mock()
+        self.discovery.query_request.side_effect = query_request
+
+        request = {'and':[{'result':[1,2,3]}], 'or':[{'result':[7]}], 'query':{'result':[0,1,2]}}
+        retval = self.discovery.request(request)
+        retval.sort()
+
+        self.assertEquals(retval, [1,2,7])
+        self.assertEquals(most_in_flight[0], 3, 'Subqueries were not run concurrently')
+
+        timings = self.discovery.last_request_timings
+        self.assertEquals([t['hits'] for t in timings], [3,3,1])
+        self.assertTrue(all(t['elapsed'] >= 0 for t in timings))
+
+    def test_request_timings_per_greenlet(self):
+        self.discovery.query_request = Mock(side_effect=lambda query, *args, **kwargs: query['result'])
+
+        def timed_request(request):
+            self.discovery.request(request)
+            gevent.sleep(0) # Let the other request run before reading the timings
+            return [t['hits'] for t in self.discovery.last_request_timings]
+
+        first  = gevent.spawn(timed_request, {'and':[{'result':[1,2]}], 'or':[], 'query':{'result':[1]}})
+        second = gevent.spawn(timed_request, {'and':[], 'or':[{'result':[5,6,7]}], 'query':{'result':[5]}})
+        gevent.joinall([first, second])
+
+        self.assertEquals(first.value, [1,2])
+        self.assertEquals(second.value, [1,3])
+        self.assertEquals(self.discovery.last_request_timings, [])
+
+    def test_cursor_tier1(self):
+        hits = range(25)
+        def query_request(query, limit=0, id_only=False):
+            return hits[query['offset']:query['offset'] + query['limit']]
+        self.discovery.query_request = Mock(side_effect=query_request)
+
+        request = {'and':[], 'or':[], 'query':{'index':'index_id', 'field':'name', 'value':'*'}}
+        page = self.discovery.request_cursor(request, page_size=10)
+        results = list(page['results'])
+        while page['more']:
+            page = self.discovery.next_page(page['cursor_id'])
+            results.extend(page['results'])
+
+        self.assertEquals(results, hits)
+        with self.assertRaises(NotFound):
+            self.discovery.next_page(page['cursor_id'])
+
+    def test_cursor_tier2_beyond_buffer(self):
+        # Both subqueries have more hits than the search buffer
+        left  = range(0, 3000)
+        right = range(1500, 4000)
+        def query_request(query, limit=0, id_only=False):
+            hits = left if query['field'] == 'left' else right
+            return hits[query['offset']:query['offset'] + query['limit']]
+        self.discovery.query_request = Mock(side_effect=query_request)
+
+        request = {'and':[{'index':'index_id', 'field':'right', 'value':'*'}], 'or':[], 'query':{'index':'index_id', 'field':'left', 'value':'*'}}
+        page = self.discovery.request_cursor(request, page_size=1000)
+        results = list(page['results'])
+        while page['more']:
+            page = self.discovery.next_page(page['cursor_id'])
+            results.extend(page['results'])
+
+        self.assertEquals(results, range(1500, 3000))
+        self.assertEquals(self.discovery._cursors, {})
+
     def test_bad_requests(self):
         #================================
         # Battery of broken requests
@@ -349,6 +454,52 @@ class DiscoveryUnitTest(PyonTestCase):
             with self.assertRaises(BadRequest):
                 self.discovery.request(req)
 
+    def test_catalog_paging(self):
+        indexes = {'index_a':range(0, 7), 'index_b':range(100, 105)}
+        def cb(index_id, offset=0, limit=0, id_only=True):
+            hits = indexes[index_id][offset:]
+            return hits[:limit] if limit else hits
+
+        c = Catalog()
+        setattr(c, '_id', 'c')
+        self.cms_list_indexes.return_value = ['index_a', 'index_b']
+
+        results = []
+        while True:
+            page = self.discovery._multi(cb, c, offset=len(results), limit=3, id_only=True)
+            results.extend(page)
+            if len(page) < 3:
+                break
+
+        self.assertEquals(results, range(0, 7) + range(100, 105))
+        self.assertEquals(self.discovery._multi(cb, c, offset=5), [5, 6] + range(100, 105))
+
+    @patch('ion.services.dm.presentation.discovery_service.CURSOR_FETCH_SIZE', 3)
+    @patch('ion.services.dm.presentation.discovery_service.ep.ElasticSearch')
+    def test_view_geo_distance_paging(self, mock_es):
+        catalogs = {'catalog_a':['a%s' % i for i in xrange(4)], 'catalog_b':['b%s' % i for i in xrange(3)]}
+        def query_geo_distance(source_id='', units='mi', order=None, limit=0, offset=0, id_only=False, **kwargs):
+            if source_id == 'view_id':
+                return DiscoveryService.query_geo_distance(self.discovery, source_id=source_id, units=units, order=order,
+                                                           limit=limit, offset=offset, id_only=id_only, **kwargs)
+            self.assertEquals(units, 'km')
+            self.assertTrue(id_only)
+            hits = catalogs[source_id][offset:]
+            return hits[:limit] if limit else hits
+        self.discovery.query_geo_distance = Mock(side_effect=query_geo_distance)
+        self.discovery.elasticsearch_host = ''
+        self.discovery.elasticsearch_port = ''
+        self.discovery.clients.index_management.find_indexes.return_value = 'view_id'
+
+        v = View()
+        setattr(v, '_id', 'view_id')
+        self.rr_read.return_value = v
+        self.discovery.list_catalogs = Mock(return_value=['catalog_a', 'catalog_b'])
+
+        query = {'index':'view', 'field':'location', 'lat':40.0, 'lon':-70.0, 'dist':10, 'units':'km'}
+        ids = self.discovery._query_all_ids(query)
+        self.assertEquals(ids, catalogs['catalog_a'] + catalogs['catalog_b'])
+
     @patch('ion.services.dm.presentation.discovery_service.ep.ElasticSearch')
     def test_view_request(self, mock_es):
         self.call_count = 0
@@ -12,6 +12,7 @@ from pyon.core.exception import BadRequest
 from pyon.util.unit_test import PyonTestCase
 from nose.plugins.attrib import attr
 from ion.services.dm.presentation.discovery_service import QueryLanguage
+from ion.services.dm.utility.query_language import QueryTemplate
 
 
 @attr('UNIT', group='dm')
@@ -182,3 +183,28 @@ class QueryLanguageUnitTest(PyonTestCase):
         retval = self.parser.parse(test_string)
         self.assertEquals(retval, {'and':[{'owner':'abc123'}], 'or':[], 'query':{'field':'description', 'fuzzy':'products', 'index':'index'}})
 
+
+    def test_parse_cache(self):
+        retval = self.parser.parse('SEARCH "model" IS "high" FROM "instrument.model"')
+        retval['query']['value'] = 'changed'
+
+        # Same query once normalized, served from the cache without the caller's change
+        retval = QueryLanguage().parse('search  "model" is "high"   from "instrument.model" ')
+        self.assertEquals(retval, {'and':[], 'or':[], 'query':{'field':'model', 'value':'high', 'index':'instrument.model'}})
+        self.assertIn(QueryLanguage.normalize('SEARCH "model" IS "high" FROM "instrument.model"'), QueryLanguage._parse_cache)
+
+        # Quoted text is not normalized
+        retval = self.parser.parse('SEARCH "model" IS "HIGH  " FROM "instrument.model"')
+        self.assertEquals(retval['query']['value'], 'HIGH  ')
+
+    def test_template(self):
+        template = QueryTemplate("SEARCH 'ts' VALUES FROM {start} TO {end} FROM 'events_index' and search 'origin' is '{origin}' from 'events_index' LIMIT {limit}")
+        self.assertEquals(template.names, set(['start', 'end', 'origin', 'limit']))
+
+        retval = template.bind(start=10, end=20, origin='instrument_1', limit=5)
+        expected = self.parser.parse("SEARCH 'ts' VALUES FROM 10 TO 20 FROM 'events_index' and search 'origin' is 'instrument_1' from 'events_index' LIMIT 5")
+        self.assertEquals(retval, expected)
+        self.assertIsInstance(retval['and'][0]['limit'], int)
+
+        with self.assertRaises(BadRequest):
+            template.bind(start=10)
@@ -29,6 +29,7 @@ from mock import Mock, mocksignature
 from interface.objects import NotificationRequest, TemporalBounds
 from ion.services.dm.inventory.index_management_service import IndexManagementService
 from ion.services.dm.presentation.user_notification_service import EmailEventProcessor
+from ion.services.dm.presentation.discovery_service import DiscoveryService
 from ion.processes.bootstrap.index_bootstrap import STD_INDEXES
 import os, time, uuid
 from gevent import event, queue
@@ -241,6 +242,128 @@ class UserNotificationTest(PyonTestCase):
         notification_request.temporal_bounds.end_datetime = self.user_notification.makeEpochTime(now())
         self.mock_rr_client.update.assert_called_once_with(notification_request)
 
+    def test_process_batch(self):
+        '''
+        Test that a batch reads the events once and sends each user a digest of their events
+        '''
+
+        def notification(origin, event_type):
+            return NotificationRequest(origin=origin, origin_type='', event_type=event_type, event_subtype='',
+                temporal_bounds=TemporalBounds(start_datetime='', end_datetime=''))
+
+        self.user_notification.event_processor.user_info = {
+            'user_1' : {'notifications' : [notification('instrument_1', ''), notification('', 'DetectionEvent')]},
+            'user_2' : {'notifications' : [notification('instrument_2', '')]},
+        }
+
+        events = dict((event_id, DeviceEvent(origin=origin, origin_type='', type_=type_, sub_type=''))
+            for event_id, origin, type_ in [('e1', 'instrument_1', 'DeviceEvent'),
+                                            ('e2', 'instrument_2', 'DetectionEvent'),
+                                            ('e3', 'instrument_3', 'DeviceEvent')])
+
+        self.user_notification.BATCH_PAGE_SIZE = 2
+        self.user_notification.discovery = Mock()
+        self.user_notification.discovery.request.side_effect = [['e1', 'e2'], ['e3']]
+        datastore = Mock()
+        datastore.read_mult.side_effect = lambda ids: [events[i] for i in ids]
+        self.user_notification.container.datastore_manager = Mock()
+        self.user_notification.container.datastore_manager.get_datastore.return_value = datastore
+        self.user_notification.format_and_send_email = Mock()
+
+        #-------------------------------------------------------------------------------------------------------------------
+        # execution
+        #-------------------------------------------------------------------------------------------------------------------
+
+        self.user_notification.process_batch(start_time=10, end_time=20)
+
+        #-------------------------------------------------------------------------------------------------------------------
+        # assertions
+        #-------------------------------------------------------------------------------------------------------------------
+
+        queries = [call[0][0] for call in self.user_notification.discovery.request.call_args_list]
+        self.assertEquals([(q['query']['range'], q['query']['limit'], q['query'].get('offset')) for q in queries],
+            [({'from':10, 'to':20}, 2, 0), ({'from':10, 'to':20}, 2, 2)])
+        self.assertEquals(datastore.read_mult.call_count, 2)
+
+        digests = dict((call[0][1], call[0][0]) for call in self.user_notification.format_and_send_email.call_args_list)
+        self.assertEquals(digests, {'user_1' : [events['e1'], events['e2']], 'user_2' : [events['e2']]})
+
+    def test_process_batch_discovery_ids(self):
+        '''
+        Test that a batch goes through the discovery Tier-1 request and reads the events by id
+        '''
+        discovery = DiscoveryService()
+        discovery.clients = self._create_service_mock('discovery')
+        discovery.clients.index_management.find_indexes.return_value = 'events_index_id'
+        def query_range(**kwargs):
+            if kwargs['id_only']:
+                return ['e1']
+            return [DeviceEvent(origin='instrument_1')]
+        discovery.query_range = Mock(side_effect=query_range)
+        self.user_notification.discovery = discovery
+
+        notification = NotificationRequest(origin='instrument_1', origin_type='', event_type='', event_subtype='',
+            temporal_bounds=TemporalBounds(start_datetime='', end_datetime=''))
+        self.user_notification.event_processor.user_info = {'user_1' : {'notifications' : [notification]}}
+        event = DeviceEvent(origin='instrument_1', origin_type='', type_='DeviceEvent', sub_type='')
+        datastore = Mock()
+        datastore.read_mult.return_value = [event]
+        self.user_notification.container.datastore_manager = Mock()
+        self.user_notification.container.datastore_manager.get_datastore.return_value = datastore
+        self.user_notification.format_and_send_email = Mock()
+
+        self.user_notification.process_batch(start_time=10, end_time=20)
+
+        self.assertTrue(discovery.query_range.call_args[1]['id_only'])
+        datastore.read_mult.assert_called_once_with(['e1'])
+        self.user_notification.format_and_send_email.assert_called_once_with([event], 'user_1')
+
+    def test_find_events(self):
+        '''
+        Test that find_events gets the ordering, the limit and the documents from the view
+        '''
+        datastore = Mock()
+        datastore.query_view.return_value = [{'id' : 'e1', 'doc' : 'event_1'}, {'id' : 'e2', 'doc' : 'event_2'}]
+        self.user_notification.container.datastore_manager = Mock()
+        self.user_notification.container.datastore_manager.get_datastore.return_value = datastore
+
+        events = self.user_notification.find_events(origin='instrument_1', limit=2, descending=True)
+        self.assertEquals(events, ['event_1', 'event_2'])
+        opts = datastore.query_view.call_args[1]['opts']
+        self.assertEquals((opts['limit'], opts['descending'], opts['include_docs']), (2, True, True))
+        self.assertFalse(datastore.read.called)
+
+        events = self.user_notification.find_events(origin='instrument_1', id_only=True)
+        self.assertEquals(events, ['e1', 'e2'])
+        opts = datastore.query_view.call_args[1]['opts']
+        self.assertNotIn('limit', opts)
+        self.assertFalse(opts['include_docs'])
+
+    def test_find_events_extended(self):
+        '''
+        Test that find_events_extended reads the events in bulk and orders them
+        '''
+        events = dict((event_id, DeviceEvent(_id=event_id, ts_created=ts)) for event_id, ts in [('e1', '30'), ('e2', '10'), ('e3', '20')])
+        self.user_notification.discovery = Mock()
+        self.user_notification.discovery.parse.return_value = ['e1', 'e2', 'e3']
+        datastore = Mock()
+        datastore.read_mult.side_effect = lambda ids: [events[i] for i in ids]
+        self.user_notification.container.datastore_manager = Mock()
+        self.user_notification.container.datastore_manager.get_datastore.return_value = datastore
+
+        retval = self.user_notification.find_events_extended(origin='instrument_1', limit=2, descending=True)
+        self.assertEquals(retval, [events['e1'], events['e3']])
+        datastore.read_mult.assert_called_once_with(['e1', 'e2', 'e3'])
+        self.assertFalse(datastore.read.called)
+
+        retval = self.user_notification.find_events_extended(origin='instrument_1', limit=2, id_only=True)
+        self.assertEquals(retval, ['e2', 'e3'])
+
+        datastore.read_mult.reset_mock()
+        retval = self.user_notification.find_events_extended(origin='instrument_1', id_only=True)
+        self.assertEquals(retval, ['e1', 'e2', 'e3'])
+        self.assertFalse(datastore.read_mult.called)
+
 @attr('INT', group='dm')
 class UserNotificationIntTest(IonIntegrationTestCase):
     def setUp(self):
@@ -485,17 +608,17 @@ class UserNotificationIntTest(IonIntegrationTestCase):
         self.assertEquals(proc1.event_processor.user_info['user_2']['user_contact'].email, 'user_2@gmail.com' )
         self.assertEquals(proc1.event_processor.user_info['user_2']['notifications'], [notification_request_2])
 
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin']['instrument_1'], ['user_1'])
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin']['instrument_2'], ['user_2'])
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin']['instrument_1'], set(['user_1']))
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin']['instrument_2'], set(['user_2']))
 
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_type']['ResourceLifecycleEvent'], ['user_1'])
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_type']['DetectionEvent'], ['user_2'])
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_type']['ResourceLifecycleEvent'], set(['user_1']))
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_type']['DetectionEvent'], set(['user_2']))
 
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_subtype']['subtype_1'], ['user_1'])
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_subtype']['subtype_2'], ['user_2'])
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_subtype']['subtype_1'], set(['user_1']))
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_subtype']['subtype_2'], set(['user_2']))
 
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin_type']['type_1'], ['user_1'])
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin_type']['type_2'], ['user_2'])
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin_type']['type_1'], set(['user_1']))
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin_type']['type_2'], set(['user_2']))
 
         log.debug("The event processor received the notification topics after a create_notification() for two users")
         log.debug("Verified that the event processor correctly updated its user info dictionaries")
@@ -510,17 +633,17 @@ class UserNotificationIntTest(IonIntegrationTestCase):
 
         self.assertEquals(proc1.event_processor.user_info['user_1']['notifications'], [notification_request_1, notification_request_2])
 
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin']['instrument_1'], ['user_1'])
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin']['instrument_2'], ['user_2', 'user_1'])
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin']['instrument_1'], set(['user_1']))
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin']['instrument_2'], set(['user_2', 'user_1']))
 
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_type']['ResourceLifecycleEvent'], ['user_1'])
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_type']['DetectionEvent'], ['user_2', 'user_1'])
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_type']['ResourceLifecycleEvent'], set(['user_1']))
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_type']['DetectionEvent'], set(['user_2', 'user_1']))
 
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_subtype']['subtype_1'], ['user_1'])
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_subtype']['subtype_2'], ['user_2', 'user_1'])
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_subtype']['subtype_1'], set(['user_1']))
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_subtype']['subtype_2'], set(['user_2', 'user_1']))
 
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin_type']['type_1'], ['user_1'])
-        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin_type']['type_2'], ['user_2', 'user_1'])
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin_type']['type_1'], set(['user_1']))
+        self.assertEquals(proc1.event_processor.reverse_user_info['event_origin_type']['type_2'], set(['user_2', 'user_1']))
 
         log.debug("The event processor received the notification topics after another create_notification() for the first user")
         log.debug("Verified that the event processor correctly updated its user info dictionaries")
@@ -654,10 +777,10 @@ class UserNotificationIntTest(IonIntegrationTestCase):
         self.assertEquals(reloaded_user_info['new_user']['notifications'], [notification_request_1] )
         self.assertEquals(reloaded_user_info['new_user']['user_contact'].email, 'new_user@gmail.com')
 
-        self.assertEquals(reloaded_reverse_user_info['event_origin']['instrument_1'], ['new_user'] )
-        self.assertEquals(reloaded_reverse_user_info['event_subtype']['subtype_1'], ['new_user'] )
-        self.assertEquals(reloaded_reverse_user_info['event_type']['ResourceLifecycleEvent'], ['new_user'] )
-        self.assertEquals(reloaded_reverse_user_info['event_origin_type']['type_1'], ['new_user'] )
+        self.assertEquals(reloaded_reverse_user_info['event_origin']['instrument_1'], set(['new_user']))
+        self.assertEquals(reloaded_reverse_user_info['event_subtype']['subtype_1'], set(['new_user']))
+        self.assertEquals(reloaded_reverse_user_info['event_type']['ResourceLifecycleEvent'], set(['new_user']))
+        self.assertEquals(reloaded_reverse_user_info['event_origin_type']['type_1'], set(['new_user']))
 
         log.debug("Verified that the notification worker correctly updated its user info dictionaries after a create_notification()")
 
@@ -678,17 +801,17 @@ class UserNotificationIntTest(IonIntegrationTestCase):
 
         self.assertEquals(reloaded_user_info['new_user']['notifications'], [notification_request_1, notification_request_2] )
 
-        self.assertEquals(reloaded_reverse_user_info['event_origin']['instrument_1'], ['new_user'] )
-        self.assertEquals(reloaded_reverse_user_info['event_origin']['instrument_2'], ['new_user'] )
+        self.assertEquals(reloaded_reverse_user_info['event_origin']['instrument_1'], set(['new_user']))
+        self.assertEquals(reloaded_reverse_user_info['event_origin']['instrument_2'], set(['new_user']))
 
-        self.assertEquals(reloaded_reverse_user_info['event_subtype']['subtype_1'], ['new_user'] )
-        self.assertEquals(reloaded_reverse_user_info['event_subtype']['subtype_2'], ['new_user'] )
+        self.assertEquals(reloaded_reverse_user_info['event_subtype']['subtype_1'], set(['new_user']))
+        self.assertEquals(reloaded_reverse_user_info['event_subtype']['subtype_2'], set(['new_user']))
 
-        self.assertEquals(reloaded_reverse_user_info['event_type']['ResourceLifecycleEvent'], ['new_user'] )
-        self.assertEquals(reloaded_reverse_user_info['event_type']['DetectionEvent'], ['new_user'] )
+        self.assertEquals(reloaded_reverse_user_info['event_type']['ResourceLifecycleEvent'], set(['new_user']))
+        self.assertEquals(reloaded_reverse_user_info['event_type']['DetectionEvent'], set(['new_user']))
 
-        self.assertEquals(reloaded_reverse_user_info['event_origin_type']['type_1'], ['new_user'] )
-        self.assertEquals(reloaded_reverse_user_info['event_origin_type']['type_2'], ['new_user'] )
+        self.assertEquals(reloaded_reverse_user_info['event_origin_type']['type_1'], set(['new_user']))
+        self.assertEquals(reloaded_reverse_user_info['event_origin_type']['type_2'], set(['new_user']))
 
         log.debug("Verified that the notification worker correctly updated its user info dictionaries after another create_notification()")
 
@@ -32,7 +32,8 @@ from ion.services.dm.presentation.sms_providers import sms_providers
 from interface.objects import ProcessDefinition, UserInfo, TemporalBounds
 from interface.services.dm.iuser_notification_service import BaseUserNotificationService
 from ion.services.dm.utility.uns_utility_methods import send_email, setting_up_smtp_client
-from ion.services.dm.utility.uns_utility_methods import calculate_reverse_user_info
+from ion.services.dm.utility.uns_utility_methods import calculate_reverse_user_info, SubscriptionIndex
+from ion.services.dm.utility.query_language import QueryTemplate
 
 
 """
@@ -278,6 +279,10 @@ class UserNotificationService(BaseUserNotificationService):
     """
     A service that provides users with an API for CRUD methods for notifications.
     """
+    BATCH_QUERY = "SEARCH 'ts_created' VALUES FROM {start_time} TO {end_time} FROM 'events_index' LIMIT {limit} SKIP {offset}"
+    BATCH_PAGE_SIZE = 1000 # Events read per query and bulk read during a batch
+
+    batch_query = None
 
     def __init__(self, *args, **kwargs):
         self._subscribers = []
@@ -492,7 +497,8 @@ class UserNotificationService(BaseUserNotificationService):
 
         self.event_publisher.publish_event( event_type= "ReloadUserInfoEvent",
             origin="UserNotificationService",
-            description= "A notification has been updated."
+            description= "A notification has been updated.",
+            notification_id = notification_id
         )
 
     def read_notification(self, notification_id=''):
@@ -572,7 +578,7 @@ class UserNotificationService(BaseUserNotificationService):
 
         self.event_processor.reverse_user_info = calculate_reverse_user_info(self.event_processor.user_info)
 
-    def find_events(self, origin='', type='', min_datetime=0, max_datetime=0, limit= -1, descending=False):
+    def find_events(self, origin='', type='', min_datetime=0, max_datetime=0, limit= -1, descending=False, id_only=False):
         """
         This method leverages couchdb view and simple filters. It does not use elastic search.
 
@@ -585,54 +591,45 @@ class UserNotificationService(BaseUserNotificationService):
         @param max_datetime   int  seconds
         @param limit          int         (integer limiting the number of results (0 means unlimited))
         @param descending     boolean     (if True, reverse order (of production time) is applied, e.g. most recent first)
+        @param id_only        boolean     (if True, the event ids are returned instead of the events)
         @retval event_list    []
         @throws NotFound    object with specified parameters does not exist
         @throws NotFound    object with specified parameters does not exist
         """
         datastore = self.container.datastore_manager.get_datastore('events')
 
+        # The view does the ordering and the limit, and returns the documents with the rows (or only the ids)
+        opts = dict(
+            start_key = [origin, type or 0, min_datetime or 0],
+            end_key   = [origin, type or {}, max_datetime or {}],
+            descending = descending,
+            include_docs = not id_only
+        )
 
-        # The reason for the if-else below is that couchdb query_view does not support passing in Null or -1 for limit
+        # The reason for the if below is that couchdb query_view does not support passing in Null or -1 for limit
         # If the opreator does not want to set a limit for the search results in find_events, and does not therefore
         # provide a limit, one has to just omit it from the opts dictionary and pass that into the query_view() method.
         # Passing a null or negative for the limit to query view through opts results in a ServerError so we cannot do that.
         if limit > -1:
-            opts = dict(
-                start_key = [origin, type or 0, min_datetime or 0],
-                end_key   = [origin, type or {}, max_datetime or {}],
-                descending = descending,
-                limit = limit,
-                include_docs = True
-            )
-
-        else:
-            opts = dict(
-                start_key = [origin, type or 0, min_datetime or 0],
-                end_key   = [origin, type or {}, max_datetime or {}],
-                descending = descending,
-                include_docs = True
-            )
+            opts['limit'] = limit
 
         results = datastore.query_view('event/by_origintype',opts=opts)
 
-        events = []
-        for res in results:
-            event_obj = res['doc']
-            events.append(event_obj)
+        if id_only:
+            events = [res['id'] for res in results]
+        else:
+            events = [res['doc'] for res in results]
 
         log.debug("(find_events) UNS found the following relevant events: %s" % events)
 
-        if -1 < limit < len(events):
-            list = []
-            for i in xrange(limit):
-                list.append(events[i])
-            return list
+        if limit > -1:
+            return events[:limit]
 
         return events
 
 
     #todo Uses Elastic Search. Later extend this to a larger search criteria
-    def find_events_extended(self, origin='', type='', min_time= 0, max_time=0, limit=-1, descending=False):
+    def find_events_extended(self, origin='', type='', min_time= 0, max_time=0, limit=-1, descending=False, id_only=False):
         """Uses Elastic Search. Returns a list of events that match the specified search criteria. Will throw a not NotFound exception
         if no events exist for the given parameters.
 
@@ -642,6 +639,7 @@ class UserNotificationService(BaseUserNotificationService):
         @param max_time   int seconds
         @param limit          int         (integer limiting the number of results (0 means unlimited))
         @param descending     boolean     (if True, reverse order (of production time) is applied, e.g. most recent first)
+        @param id_only        boolean     (if True, the event ids are returned instead of the events)
         @retval event_list    []
         @throws NotFound    object with specified parameters does not exist
         @throws NotFound    object with specified parameters does not exist
@@ -668,24 +666,32 @@ class UserNotificationService(BaseUserNotificationService):
         ret_vals = self.discovery.parse(search_string)
         log.debug("(find_events_extended) Discovery search returned the following event ids: %s" % ret_vals)
 
-        events = []
-        for event_id in ret_vals:
-            datastore = self.container.datastore_manager.get_datastore('events')
-            event_obj = datastore.read(event_id)
-            events.append(event_obj)
+        # Without a limit ids don't need ordering, so the events don't need to be read
+        if id_only and limit < 0:
+            return ret_vals
+
+        # The events are read with a single bulk read and ordered by production time
+        datastore = self.container.datastore_manager.get_datastore('events')
+        events = datastore.read_mult(ret_vals) if ret_vals else []
+        events = sorted(events, key=self._event_time, reverse=descending)
 
         log.debug("(find_events_extended) UNS found the following relevant events: %s" % events)
 
         if limit > -1:
-            list = []
-            for i in xrange(limit):
-                list.append(events[i])
-            return list
+            events = events[:limit]
 
-        #todo implement time ordering: ascending or descending
+        if id_only:
+            return [event._id for event in events]
 
         return events
 
+    @staticmethod
+    def _event_time(event):
+        try:
+            return float(event.ts_created)
+        except (TypeError, ValueError):
+            return 0
+
     def publish_event(self, event=None):
         '''
         Publish a general event at a certain time using the UNS
@@ -813,10 +819,10 @@ class UserNotificationService(BaseUserNotificationService):
 
     def process_batch(self, start_time = 0, end_time = 0):
         '''
-        This method is launched when an process_batch event is received. The user info dictionary maintained
-        by the User Notification Service is used to query the event repository for all events for a particular
-        user that have occurred in a provided time interval, and then an email is sent to the user containing
-        the digest of all the events.
+        This method is launched when an process_batch event is received. The events that have occurred in a
+        provided time interval are read from the event repository once and matched against the notifications in
+        the user info dictionary maintained by the User Notification Service, and then an email is sent to each
+        user containing the digest of the events they are interested in.
 
         @param start_time int
         @param end_time int
@@ -825,50 +831,54 @@ class UserNotificationService(BaseUserNotificationService):
         if end_time <= start_time:
             return
 
-        for user_name, value in self.event_processor.user_info.iteritems():
-
-            notifications = value['notifications']
-
-            events_for_message = []
-
-            search_time = "SEARCH 'ts_created' VALUES FROM %s TO %s FROM 'events_index'" % (start_time, end_time)
-
-            for notification in notifications:
-
-                # If the notification request has expired, then do not use it in the search
-                if notification.temporal_bounds.end_datetime:
-                    continue
+        #------------------------------------------------------------------------------------
+        # Every event in the window is read once and matched against all the subscriptions
+        #------------------------------------------------------------------------------------
 
-                if notification.origin:
-                    search_origin = 'search "origin" is "%s" from "events_index"' % notification.origin
-                else:
-                    search_origin = 'search "origin" is "*" from "events_index"'
+        subscriptions = SubscriptionIndex.from_user_info(self.event_processor.user_info)
+        if not len(subscriptions):
+            return
 
-                if notification.origin_type:
-                    search_origin_type= 'search "origin_type" is "%s" from "events_index"' % notification.origin_type
-                else:
-                    search_origin_type= 'search "origin_type" is "*" from "events_index"'
+        events_for_users = {}
+        for events in self._batch_events(start_time, end_time):
+            for event in events:
+                for user_name in subscriptions.match(event):
+                    events_for_users.setdefault(user_name, []).append(event)
 
-                if notification.event_type:
-                    search_event_type = 'search "type_" is "%s" from "events_index"' % notification.event_type
-                else:
-                    search_event_type = 'search "type_" is "*" from "events_index"'
+        for user_name, events_for_message in events_for_users.iteritems():
+            log.debug("Found following events of interest to user, %s: %s" % (user_name, events_for_message))
 
-                search_string = search_time + ' and ' + search_origin + ' and ' + search_origin_type + ' and ' + search_event_type
+            # send a notification email to each user using a _send_email() method
+            self.format_and_send_email(events_for_message, user_name)
 
-                # get the list of ids corresponding to the events
-                ret_vals = self.discovery.parse(search_string)
+    def _batch_events(self, start_time, end_time):
+        '''
+        Yields the events created between start_time and end_time, BATCH_PAGE_SIZE events at a time
 
-                for event_id in ret_vals:
-                    datastore = self.container.datastore_manager.get_datastore('events')
-                    event_obj = datastore.read(event_id)
-                    events_for_message.append(event_obj)
+        @param start_time int
+        @param end_time int
+        '''
+        # The query is parsed once and bound for every page
+        if self.batch_query is None:
+            self.batch_query = QueryTemplate(self.BATCH_QUERY)
 
-            log.debug("Found following events of interest to user, %s: %s" % (user_name, events_for_message))
+        datastore = self.container.datastore_manager.get_datastore('events')
 
-            # send a notification email to each user using a _send_email() method
-            if events_for_message:
-                self.format_and_send_email(events_for_message, user_name)
+        offset = 0
+        while True:
+            query = self.batch_query.bind(
+                start_time = start_time,
+                end_time   = end_time,
+                limit      = self.BATCH_PAGE_SIZE,
+                offset     = offset)
+
+            # get the list of ids corresponding to the events
+            event_ids = self.discovery.request(query, id_only=True)
+            if event_ids:
+                yield datastore.read_mult(event_ids)
+            if len(event_ids) < self.BATCH_PAGE_SIZE:
+                return
+            offset += len(event_ids)
 
     def format_and_send_email(self, events_for_message, user_name):
         '''
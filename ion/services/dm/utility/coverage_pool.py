@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/coverage_pool.py
+@date Sun Oct 18 2026
+@description Process-wide pool of open coverage handles
+'''
+
+from pyon.util.file_sys import FileSystem, FS
+from pyon.util.log import log
+
+from coverage_model.coverage import SimplexCoverage
+
+from contextlib import contextmanager
+from gevent.coros import RLock
+import collections
+import time
+
+
+class CoverageHandle(object):
+    '''
+    A pooled coverage and its bookkeeping
+    '''
+    def __init__(self, dataset_id, mode, coverage):
+        self.dataset_id = dataset_id
+        self.mode       = mode
+        self.coverage   = coverage
+        self.refs       = 0
+        self.opened     = time.time()
+        self.closing    = False
+
+
+class CoveragePool(object):
+    '''
+    LRU pool of open coverages keyed by dataset and mode ('r' read-only, 'w' read-write).
+
+    Handles are reference counted, a coverage is only closed once nothing holds it:
+    when it's evicted, when it's explicitly closed or when a read-only handle is
+    older than max_age. A handle that is closed or expired while in use is retired:
+    new callers get a freshly opened coverage and the retired one is closed when its
+    last reference is released.
+
+    The pool isn't told about writes made by other processes (ingestion), so a
+    read-only coverage may report num_timesteps up to max_age seconds old.
+
+        with CoveragePool.instance().acquire(dataset_id, mode='r') as coverage:
+            coverage.num_timesteps
+    '''
+    MAX_SIZE = 50
+    MAX_AGE  = 10.0 # Seconds a read-only handle is reused for
+
+    _instance = None
+
+    def __init__(self, max_size=MAX_SIZE, max_age=MAX_AGE):
+        self.max_size = max_size
+        self.max_age  = max_age
+        self._handles = collections.OrderedDict()
+        self._retired = {} # id(coverage) -> handle closed while still referenced
+        self._lock    = RLock()
+
+    @classmethod
+    def instance(cls):
+        '''
+        The process-wide pool
+        '''
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def open_coverage(cls, dataset_id, mode='r'):
+        # Opened like DatasetManagementService._get_coverage, the mode only
+        # decides how the pool manages the handle
+        file_root = FileSystem.get_url(FS.CACHE,'datasets')
+        return SimplexCoverage(file_root, dataset_id)
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __contains__(self, key):
+        return key in self._handles
+
+    @contextmanager
+    def acquire(self, dataset_id, mode='r'):
+        '''
+        Context manager yielding a pooled coverage, released on exit.
+        '''
+        coverage = self.get(dataset_id, mode)
+        try:
+            yield coverage
+        finally:
+            self.release(dataset_id, mode, coverage)
+
+    def get(self, dataset_id, mode='r'):
+        '''
+        Returns an open coverage for the dataset and takes a reference to it,
+        every call must be paired with a call to release.
+        '''
+        key = (dataset_id, mode)
+        with self._lock:
+            handle = self._handles.pop(key, None)
+            if handle is not None and self._expired(handle):
+                self._retire(handle)
+                handle = None
+            if handle is None:
+                handle = CoverageHandle(dataset_id, mode, self.open_coverage(dataset_id, mode))
+                self._evict()
+            handle.refs += 1
+            self._handles[key] = handle # Most recently used goes to the end
+            return handle.coverage
+
+    def release(self, dataset_id, mode='r', coverage=None):
+        '''
+        Drops a reference taken by get, coverage is the one get returned
+        (without it the dataset's current handle is released)
+        '''
+        key = (dataset_id, mode)
+        with self._lock:
+            handle = self._handles.get(key)
+            if coverage is not None and (handle is None or handle.coverage is not coverage):
+                handle = self._retired.get(id(coverage))
+            elif coverage is None and (handle is None or not handle.refs):
+                retired = [h for h in self._retired.itervalues() if (h.dataset_id, h.mode) == key]
+                handle = retired[0] if retired else handle
+            if handle is None:
+                return
+            handle.refs = max(handle.refs - 1, 0)
+            if handle.closing and not handle.refs:
+                self._retired.pop(id(handle.coverage), None)
+                self._close_handle(handle)
+
+    def close(self, dataset_id, mode=None):
+        '''
+        Closes the dataset's pooled coverages (for one mode or all of them), handles
+        still in use are closed when their last reference is released.
+        '''
+        with self._lock:
+            for key, handle in self._handles.items():
+                if key[0] != dataset_id or (mode is not None and key[1] != mode):
+                    continue
+                del self._handles[key]
+                self._retire(handle)
+
+    def close_all(self):
+        with self._lock:
+            for key, handle in self._handles.items():
+                del self._handles[key]
+                self._retire(handle)
+
+    def _expired(self, handle):
+        if handle.closing:
+            return True
+        if handle.mode != 'r':
+            return False
+        return (time.time() - handle.opened) > self.max_age
+
+    def _retire(self, handle):
+        '''
+        Closes a handle that is no longer pooled, or marks it to be closed on its last release
+        '''
+        if handle.refs:
+            handle.closing = True
+            self._retired[id(handle.coverage)] = handle
+        else:
+            self._close_handle(handle)
+
+    def _evict(self):
+        '''
+        Closes the least recently used idle handles until there's room for one more
+        '''
+        for key, handle in self._handles.items():
+            if len(self._handles) < self.max_size:
+                return
+            if not handle.refs:
+                del self._handles[key]
+                self._close_handle(handle)
+
+    def _close_handle(self, handle):
+        try:
+            handle.coverage.close(timeout=5)
+        except Exception:
+            log.exception('Failed to close coverage for dataset %s', handle.dataset_id)
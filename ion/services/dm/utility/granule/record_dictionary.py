@@ -24,6 +24,7 @@ from coverage_model.coverage import SimpleDomainSet
 
 import numpy as np
 import msgpack
+import collections
 
 class RecordDictionaryTool(object):
     """
@@ -48,19 +49,25 @@ class RecordDictionaryTool(object):
     _shp         = None
     _locator     = None
     _stream_def  = None
+    _dom         = None
+    _dom_shp     = None
+    _pdict_dump  = None
+
+    PDICT_CACHE_LIMIT = 100
+    _pdict_cache = collections.OrderedDict() # Parsed ParameterDictionaries keyed by content
 
     def __init__(self,param_dictionary=None, stream_definition_id='', locator=None):
         """
         """
         if type(param_dictionary) == dict:
-            self._pdict = ParameterDictionary.load(param_dictionary)
+            self._pdict = RecordDictionaryTool.pdict_from_dump(param_dictionary)
+            self._pdict_dump = param_dictionary
         
         elif isinstance(param_dictionary,ParameterDictionary):
             self._pdict = param_dictionary
         
         elif stream_definition_id:
-            pdict = RecordDictionaryTool.pdict_from_stream_def(stream_definition_id)
-            self._pdict = ParameterDictionary.load(pdict)
+            self._pdict = RecordDictionaryTool.parsed_pdict_from_stream_def(stream_definition_id)
             self._stream_def = stream_definition_id
         
         else:
@@ -77,14 +84,13 @@ class RecordDictionaryTool(object):
 
     @classmethod
     def load_from_granule(cls, g):
+        # The parameter dictionary is parsed once per stream definition (or content)
+        # and shared, see parsed_pdict_from_stream_def and pdict_from_dump
         if isinstance(g.param_dictionary, str):
             instance = cls(stream_definition_id=g.param_dictionary, locator=g.locator)
-            pdict = RecordDictionaryTool.pdict_from_stream_def(g.param_dictionary)
-            instance._pdict = ParameterDictionary.load(pdict)
         
         else:
             instance = cls(param_dictionary=g.param_dictionary, locator=g.locator)
-            instance._pdict = ParameterDictionary.load(g.param_dictionary)
         
        
         if g.domain:
@@ -111,7 +117,9 @@ class RecordDictionaryTool(object):
             else:
                 granule.record_dictionary[key] = None
         
-        granule.param_dictionary = self._stream_def or self._pdict.dump()
+        if not self._stream_def and self._pdict_dump is None:
+            self._pdict_dump = self._pdict.dump()
+        granule.param_dictionary = self._stream_def or self._pdict_dump
         granule.locator = self._locator
         granule.domain = self.domain.shape
         granule.data_producer_id=data_producer_id
@@ -129,8 +137,13 @@ class RecordDictionaryTool(object):
 
     @property
     def domain(self):
-        dom = SimpleDomainSet(self._shp)
-        return dom
+        '''
+        The domain for the current shape, rebuilt only when the shape changes
+        '''
+        if self._dom is None or self._dom_shp != self._shp:
+            self._dom = SimpleDomainSet(self._shp)
+            self._dom_shp = self._shp
+        return self._dom
 
     @property
     def temporal_parameter(self):
@@ -175,6 +188,17 @@ class RecordDictionaryTool(object):
         else:
             return None
 
+    def view(self, name):
+        '''
+        Get a read-only view of a parameter's values without copying them.
+        Prefer this over rdt[name] when indexing values in a loop, the view
+        must not be kept beyond the next assignment to the parameter.
+        '''
+        paramval = self._rd[name]
+        if paramval is None:
+            return None
+        return paramval.storage._storage
+
     def iteritems(self):
         """ D.iteritems() -> an iterator over the (key, value) items of D """
         for k,v in self._rd.iteritems():
@@ -259,7 +283,87 @@ class RecordDictionaryTool(object):
         byte_stream = msgpack.packb(flat, default=encode_ion)
         return len(byte_stream)
 
-    
+    def estimate_size(self):
+        '''
+        Estimates the size in bytes of the serialized granule without encoding
+        the record values. The envelope (granule fields, parameter dictionary
+        reference and array headers) is serialized with empty arrays and the
+        packed size of each array's contents is computed from its dtype and shape.
+        '''
+        granule = self.to_granule()
+        arrays = granule.record_dictionary
+        granule.record_dictionary = {}
+        content_size = 0
+        for key, arr in arrays.iteritems():
+            if not isinstance(arr, np.ndarray) or not arr.shape:
+                granule.record_dictionary[key] = arr
+                continue
+            granule.record_dictionary[key] = arr[:0]
+            # The emptied array is packed as an empty list with a zero length shape
+            content_size += self._packed_array_size(arr) - 1
+            content_size += self._packed_int_size(arr.shape[0]) - 1
+
+        serializer = IonObjectSerializer()
+        flat = serializer.serialize(granule)
+        byte_stream = msgpack.packb(flat, default=encode_ion)
+        return len(byte_stream) + content_size
+
+    @classmethod
+    def _packed_array_size(cls, arr):
+        '''
+        Packed size of arr.tolist()
+        '''
+        size = 0
+        count = 1
+        for dim in arr.shape: # Nested list headers
+            size += count * cls._packed_header_size(dim, 16)
+            count *= dim
+        if not count:
+            return size
+
+        kind = arr.dtype.kind
+        if kind == 'f': # Always packed as doubles
+            return size + 9 * count
+        if kind == 'b':
+            return size + count
+        if kind in 'iu':
+            v = arr.ravel()
+            if kind == 'u':
+                v = v.astype(np.uint64)
+                widths = np.where(v < 128, 1, np.where(v < 2**8, 2, np.where(v < 2**16, 3, np.where(v < 2**32, 5, 9))))
+            else:
+                v = v.astype(np.int64)
+                widths = np.where(v >= 0,
+                    np.where(v < 128, 1, np.where(v < 2**8, 2, np.where(v < 2**16, 3, np.where(v < 2**32, 5, 9)))),
+                    np.where(v >= -32, 1, np.where(v >= -2**7, 2, np.where(v >= -2**15, 3, np.where(v >= -2**31, 5, 9)))))
+            return size + int(widths.sum())
+        if kind == 'S':
+            lengths = np.char.str_len(arr).ravel()
+            headers = np.where(lengths < 32, 1, np.where(lengths < 2**16, 3, 5))
+            return size + int(lengths.sum()) + int(headers.sum())
+        # Objects and everything else are packed for real
+        return len(msgpack.packb(arr.tolist(), default=encode_ion))
+
+    @staticmethod
+    def _packed_header_size(length, fixed_limit):
+        if length < fixed_limit:
+            return 1
+        if length < 2**16:
+            return 3
+        return 5
+
+    @staticmethod
+    def _packed_int_size(value):
+        if value < 128:
+            return 1
+        if value < 2**8:
+            return 2
+        if value < 2**16:
+            return 3
+        if value < 2**32:
+            return 5
+        return 9
+
     @staticmethod
     @memoize_lru(maxsize=100)
     def pdict_from_stream_def(stream_def_id):
@@ -267,4 +371,46 @@ class RecordDictionaryTool(object):
         stream_def_obj = pubsub_cli.read_stream_definition(stream_def_id)
         return stream_def_obj.parameter_dictionary
 
+    @staticmethod
+    @memoize_lru(maxsize=100)
+    def parsed_pdict_from_stream_def(stream_def_id):
+        '''
+        The ParameterDictionary for a stream definition, parsed once and shared
+        by every RDT on that stream definition (it must not be modified).
+        '''
+        return RecordDictionaryTool.pdict_from_dump(RecordDictionaryTool.pdict_from_stream_def(stream_def_id))
+
+    @classmethod
+    def pdict_from_dump(cls, pdict_dump):
+        '''
+        Loads a dumped ParameterDictionary, the parsed dictionary is cached (LRU)
+        by content and shared, it must not be modified.
+        '''
+        try:
+            key = cls._freeze(pdict_dump)
+            hash(key)
+        except TypeError: # Content that can't be hashed isn't cached
+            return ParameterDictionary.load(pdict_dump)
+        try:
+            pdict = cls._pdict_cache.pop(key)
+        except KeyError:
+            pdict = ParameterDictionary.load(pdict_dump)
+            if len(cls._pdict_cache) >= cls.PDICT_CACHE_LIMIT:
+                cls._pdict_cache.popitem(0)
+        cls._pdict_cache[key] = pdict
+        return pdict
+
+    @classmethod
+    def _freeze(cls, obj):
+        '''
+        Hashable, order independent representation of a dumped structure
+        '''
+        if isinstance(obj, dict):
+            return frozenset((k, cls._freeze(v)) for k,v in obj.iteritems())
+        if isinstance(obj, (list, tuple)):
+            return tuple(cls._freeze(i) for i in obj)
+        if isinstance(obj, np.ndarray):
+            return (obj.dtype.str, obj.shape, obj.tostring())
+        return (type(obj), obj) # 1, 1.0 and True are distinct values here
+
 
@@ -8,6 +8,10 @@
 from pyparsing import ParseException, Regex, quotedString, CaselessLiteral, MatchFirst, removeQuotes, Optional
 from pyon.core.exception import BadRequest
 
+import collections
+import copy
+import re
+
 
 class QueryLanguage(object):
     '''
@@ -54,13 +58,32 @@ class QueryLanguage(object):
               <number>  ::= <integer> | <double>
               <double>  ::= 0-9 ('.' 0-9)
               <integer> ::= 0-9
-    '''
 
-    def __init__(self):
+    The grammar is compiled once per process and parsed queries are cached (LRU)
+    by their normalized text, see parse and QueryTemplate.
+    '''
+    CACHE_LIMIT = 1000
 
+    _compiled    = None                      # Instance owning the process-wide grammar
+    _parse_cache = collections.OrderedDict() # normalized query -> (json_query, tokens)
 
+    def __init__(self):
         self.json_query = {'query':{}, 'and': [], 'or': []}
         self.tokens = None
+
+    @classmethod
+    def _grammar(cls):
+        '''
+        The instance holding the compiled grammar, its parse actions fill its own frame.
+        Parsing doesn't yield so one grammar serves every greenlet.
+        '''
+        if cls._compiled is None:
+            compiled = cls()
+            compiled._build_grammar()
+            cls._compiled = compiled
+        return cls._compiled
+
+    def _build_grammar(self):
         #--------------------------------------------------------------------------------------
         # <integer> ::= 0-9
         # <double>  ::= 0-9 ('.' 0-9)
@@ -268,15 +291,39 @@ class QueryLanguage(object):
         '''
         Parses string s and returns a json_query object, self.tokens is set to the tokens
         '''
-        self.json_query = {'query':{}, 'and': [], 'or': []}
-        self.frame = {}
+        key = self.normalize(s)
         try:
-            self.tokens = self.sentence.parseString(s)
-        except ParseException as e:
-            raise BadRequest('%s' % e)
-
+            json_query, tokens = self._parse_cache.pop(key)
+        except KeyError:
+            grammar = self._grammar()
+            grammar.json_query = {'query':{}, 'and': [], 'or': []}
+            grammar.frame = {}
+            try:
+                tokens = grammar.sentence.parseString(s)
+            except ParseException as e:
+                raise BadRequest('%s' % e)
+            json_query = grammar.json_query
+            if len(self._parse_cache) >= self.CACHE_LIMIT:
+                self._parse_cache.popitem(0)
+        self._parse_cache[key] = (json_query, tokens)
+
+        self.tokens = tokens
+        self.json_query = copy.deepcopy(json_query) # Callers are free to modify their copy
         return self.json_query
 
+    _quoted = re.compile(r'("[^"]*"|\'[^\']*\')')
+
+    @classmethod
+    def normalize(cls, s):
+        '''
+        Cache key for a query: keywords are case insensitive and runs of whitespace
+        are insignificant outside of quoted strings
+        '''
+        parts = cls._quoted.split(s.strip())
+        for i in xrange(0, len(parts), 2): # Even parts are outside of quotes
+            parts[i] = re.sub(r'\s+', ' ', parts[i]).lower()
+        return ''.join(parts)
+
     #=========================================
     # Methods for checking the requests
     #=========================================
@@ -417,3 +464,66 @@ class QueryLanguage(object):
                     return False
         return cls.match(event, query)
 
+
+
+class QueryTemplate(object):
+    '''
+    A query with named {placeholders} that is parsed once and bound to values
+    without parsing again.  Placeholders inside quotes are bound as strings,
+    placeholders outside quotes (numbers) keep the type the grammar gives them.
+
+        template = QueryTemplate('SEARCH "origin" IS "{origin}" FROM "events_index" LIMIT {limit}')
+        template.bind(origin='instrument_1', limit=10)
+    '''
+    _placeholder = re.compile(r'\{([a-zA-Z_][a-zA-Z0-9_]*)\}')
+    _number_base = -987654321000 # Numeric placeholders are parsed as unique unlikely numbers
+
+    def __init__(self, s):
+        self.text = s
+        self.strings = {} # sentinel string -> name
+        self.numbers = {} # sentinel number -> name
+
+        parts = QueryLanguage._quoted.split(s)
+        for i in xrange(len(parts)):
+            if i % 2: # Quoted
+                parts[i] = self._placeholder.sub(self._string_sentinel, parts[i])
+            else:
+                parts[i] = self._placeholder.sub(self._number_sentinel, parts[i])
+        self.json_query = QueryLanguage().parse(''.join(parts))
+
+    @property
+    def names(self):
+        return set(self.strings.values()) | set(self.numbers.values())
+
+    def _string_sentinel(self, match):
+        sentinel = '__param_%s__' % match.group(1)
+        self.strings[sentinel] = match.group(1)
+        return sentinel
+
+    def _number_sentinel(self, match):
+        sentinel = self._number_base - len(self.numbers)
+        self.numbers[sentinel] = match.group(1)
+        return str(sentinel)
+
+    def bind(self, **values):
+        '''
+        Returns the parsed query with the placeholders replaced by values
+        '''
+        missing = self.names.difference(values)
+        if missing:
+            raise BadRequest('Unbound query parameters: %s' % ', '.join(sorted(missing)))
+        return self._bind(self.json_query, values)
+
+    def _bind(self, obj, values):
+        if isinstance(obj, dict):
+            return dict((self._bind(k, values), self._bind(v, values)) for k,v in obj.iteritems())
+        if isinstance(obj, list):
+            return [self._bind(i, values) for i in obj]
+        if isinstance(obj, basestring):
+            for sentinel, name in self.strings.iteritems():
+                if sentinel in obj:
+                    obj = obj.replace(sentinel, '%s' % values[name])
+            return obj
+        if isinstance(obj, (int, long, float)) and not isinstance(obj, bool) and obj in self.numbers:
+            return type(obj)(values[self.numbers[obj]])
+        return obj
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_coverage_pool.py
+@brief Tests for the coverage handle pool
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.services.dm.utility.coverage_pool import CoveragePool
+from mock import Mock
+from nose.plugins.attrib import attr
+
+@attr('UNIT',group='dm')
+class CoveragePoolUnitTest(PyonTestCase):
+    def setUp(self):
+        self.pool = CoveragePool(max_size=2, max_age=60)
+        self.pool.open_coverage = Mock(side_effect=lambda dataset_id, mode: Mock(name=dataset_id))
+
+    def test_reuse(self):
+        with self.pool.acquire('ds1') as cov1:
+            pass
+        with self.pool.acquire('ds1') as cov2:
+            pass
+        self.assertIs(cov1, cov2)
+        self.assertEquals(self.pool.open_coverage.call_count, 1)
+        self.assertFalse(cov1.close.called)
+
+    def test_modes_are_separate(self):
+        reader = self.pool.get('ds1', 'r')
+        writer = self.pool.get('ds1', 'w')
+        self.assertIsNot(reader, writer)
+        self.assertEquals(len(self.pool), 2)
+
+    def test_lru_eviction(self):
+        with self.pool.acquire('ds1') as cov1:
+            pass
+        with self.pool.acquire('ds2'):
+            pass
+        with self.pool.acquire('ds1'):
+            pass
+        with self.pool.acquire('ds3'):
+            pass
+        self.assertIn(('ds1','r'), self.pool)
+        self.assertNotIn(('ds2','r'), self.pool)
+        self.assertFalse(cov1.close.called)
+
+    def test_eviction_skips_referenced(self):
+        cov1 = self.pool.get('ds1')
+        cov2 = self.pool.get('ds2')
+        self.pool.get('ds3')
+        self.assertEquals(len(self.pool), 3)
+        self.assertFalse(cov1.close.called)
+        self.assertFalse(cov2.close.called)
+
+    def test_close_deferred_until_release(self):
+        cov = self.pool.get('ds1')
+        self.pool.close('ds1')
+        self.assertFalse(cov.close.called)
+        self.pool.release('ds1')
+        cov.close.assert_called_once_with(timeout=5)
+        self.assertNotIn(('ds1','r'), self.pool)
+
+    def test_read_handles_expire(self):
+        self.pool.max_age = -1
+        with self.pool.acquire('ds1') as cov1:
+            pass
+        with self.pool.acquire('ds1') as cov2:
+            pass
+        self.assertIsNot(cov1, cov2)
+        cov1.close.assert_called_once_with(timeout=5)
+
+    def test_closing_handle_not_reused(self):
+        cov1 = self.pool.get('ds1')
+        self.pool.close('ds1')
+        with self.pool.acquire('ds1') as cov2:
+            self.assertIsNot(cov1, cov2)
+        self.assertFalse(cov1.close.called)
+        self.pool.release('ds1', coverage=cov1)
+        cov1.close.assert_called_once_with(timeout=5)
+        self.assertFalse(cov2.close.called)
+
+    def test_referenced_read_handles_expire(self):
+        cov1 = self.pool.get('ds1')
+        self.pool.max_age = -1
+        with self.pool.acquire('ds1') as cov2:
+            self.assertIsNot(cov1, cov2)
+        self.pool.release('ds1', coverage=cov1)
+        cov1.close.assert_called_once_with(timeout=5)
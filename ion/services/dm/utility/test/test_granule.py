@@ -8,6 +8,7 @@
 
 from pyon.ion.stream import StandaloneStreamPublisher, StandaloneStreamSubscriber
 from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
 
 from ion.services.dm.inventory.dataset_management_service import DatasetManagementService
 from ion.services.dm.utility.granule import RecordDictionaryTool
@@ -15,11 +16,71 @@ from ion.services.dm.utility.granule import RecordDictionaryTool
 from interface.services.dm.ipubsub_management_service import PubsubManagementServiceClient
 from interface.services.dm.idataset_management_service import DatasetManagementServiceClient
 
+from coverage_model.parameter import ParameterDictionary, ParameterContext
+from coverage_model.parameter_types import QuantityType
+from coverage_model.basic_types import AxisTypeEnum
+
 from gevent.event import Event
 from nose.plugins.attrib import attr
 
 import numpy as np
 
+@attr('UNIT',group='dm')
+class RecordDictionaryUnitTest(PyonTestCase):
+    def setUp(self):
+        self.pdict = ParameterDictionary()
+        t_ctxt = ParameterContext('time', param_type=QuantityType(value_encoding=np.dtype('int64')))
+        t_ctxt.axis = AxisTypeEnum.TIME
+        self.pdict.add_context(t_ctxt)
+        self.pdict.add_context(ParameterContext('temp', param_type=QuantityType(value_encoding=np.dtype('float32'))))
+
+    def test_view(self):
+        rdt = RecordDictionaryTool(param_dictionary=self.pdict)
+        rdt['time'] = np.arange(10)
+
+        view = rdt.view('time')
+        np.testing.assert_array_equal(view, rdt['time'])
+        self.assertIs(view, rdt.view('time'))
+        self.assertFalse(view.flags.writeable)
+        self.assertIsNone(rdt.view('temp'))
+
+    def test_domain_cache(self):
+        rdt = RecordDictionaryTool(param_dictionary=self.pdict)
+        rdt['time'] = np.arange(10)
+        dom = rdt.domain
+        self.assertIs(dom, rdt.domain)
+
+        rdt._shp = (5,)
+        self.assertIsNot(dom, rdt.domain)
+        self.assertEquals(rdt.domain.shape, (5,))
+
+    def test_pdict_cache(self):
+        rdt = RecordDictionaryTool(param_dictionary=self.pdict)
+        rdt['time'] = np.arange(10)
+        granule = rdt.to_granule()
+
+        rdt1 = RecordDictionaryTool.load_from_granule(granule)
+        rdt2 = RecordDictionaryTool.load_from_granule(granule)
+        self.assertIs(rdt1._pdict, rdt2._pdict)
+        self.assertEquals(rdt1._pdict, self.pdict)
+        self.assertEquals(rdt1, rdt)
+
+        self.assertIs(rdt1.to_granule().param_dictionary, granule.param_dictionary)
+
+    def test_estimate_size(self):
+        rdt = RecordDictionaryTool(param_dictionary=self.pdict)
+        rdt['time'] = np.arange(-100, 70000, 7)
+        rdt['temp'] = np.random.randn(len(rdt)).astype('float32')
+
+        actual = rdt.size()
+        estimate = rdt.estimate_size()
+        self.assertTrue(abs(actual - estimate) <= 16, 'Estimated %s bytes, actual %s' % (estimate, actual))
+
+        rdt = RecordDictionaryTool(param_dictionary=self.pdict)
+        rdt['time'] = np.arange(3)
+        self.assertTrue(abs(rdt.size() - rdt.estimate_size()) <= 16)
+
+
 @attr('INT',group='dm')
 class RecordDictionaryIntegrationTest(IonIntegrationTestCase):
     xps = []
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_time_index.py
+@brief Tests for the sorted time index
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.services.dm.utility.time_index import TimeIndex
+from mock import Mock
+from nose.plugins.attrib import attr
+
+import numpy as np
+import os
+import shutil
+import tempfile
+
+@attr('UNIT',group='dm')
+class TimeIndexUnitTest(PyonTestCase):
+    def setUp(self):
+        self.times = np.array([0., 10., 20., 30.])
+        self.coverage = Mock()
+        self.coverage.temporal_parameter_name = 'time'
+        self.coverage.get_parameter_values.side_effect = lambda name, tdoa: self.times[tdoa]
+        type(self.coverage).num_timesteps = property(lambda cov: len(self.times))
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def find_nearest(self, val):
+        return np.abs(self.times - val).argmin()
+
+    def test_nearest(self):
+        index = TimeIndex()
+        index.update(self.coverage)
+        for val in [-5, 0, 4, 5, 6, 29, 31, 100]:
+            self.assertEquals(index.nearest(val), self.find_nearest(val))
+
+        idx = index.nearest(np.array([-5, 5, 14, 100]))
+        np.testing.assert_array_equal(idx, [0, 0, 1, 3])
+
+    def test_incremental_update(self):
+        index = TimeIndex()
+        index.update(self.coverage)
+        self.coverage.get_parameter_values.reset_mock()
+
+        self.times = np.concatenate([self.times, [5., 40.]]) # Out of order values are merged
+        index.update(self.coverage)
+        self.assertEquals(self.coverage.get_parameter_values.call_args[1]['tdoa'], slice(4, 6))
+
+        for val in [3, 6, 38]:
+            self.assertEquals(index.nearest(val), self.find_nearest(val))
+        np.testing.assert_array_equal(index.range(5, 20), [1, 2, 4])
+
+    def test_persistence(self):
+        path = os.path.join(self.tmpdir, 'ds_time_index.npz')
+        index = TimeIndex(path)
+        index.update(self.coverage)
+        self.assertTrue(os.path.exists(path))
+
+        self.coverage.get_parameter_values.reset_mock()
+        index = TimeIndex(path)
+        index.update(self.coverage)
+        self.assertFalse(self.coverage.get_parameter_values.called)
+        self.assertEquals(index.nearest(12), 1)
+
+    def test_lazy_save(self):
+        path = os.path.join(self.tmpdir, 'ds_time_index.npz')
+        index = TimeIndex(path)
+        index.update(self.coverage)
+        os.utime(path, (1000, 1000))
+
+        self.times = np.concatenate([self.times, [40., 50.]]) # Appended, not written until flushed
+        index.update(self.coverage)
+        self.assertTrue(index.dirty)
+        self.assertEquals(os.stat(path).st_mtime, 1000)
+        self.assertEquals(index.nearest(48), 5)
+
+        index.flush()
+        self.assertFalse(index.dirty)
+        self.assertEquals(len(TimeIndex(path)), 6)
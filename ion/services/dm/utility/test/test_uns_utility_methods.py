@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_uns_utility_methods.py
+@description Unit tests for the notification subscription index
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.log import log
+from ion.services.dm.utility.uns_utility_methods import SubscriptionIndex, calculate_reverse_user_info
+from ion.services.dm.utility.uns_utility_methods import add_to_reverse_user_info, remove_from_reverse_user_info
+from ion.services.dm.utility.uns_utility_methods import EmailDeliveryPool, fake_smtplib, setting_up_smtp_client
+from interface.objects import NotificationRequest, TemporalBounds, Event
+from nose.plugins.attrib import attr
+from mock import Mock, patch
+import gevent
+import gevent.event
+import random
+
+def notification(origin='', origin_type='', event_type='', event_subtype='', end_datetime=''):
+    return NotificationRequest(origin=origin, origin_type=origin_type, event_type=event_type,
+                               event_subtype=event_subtype,
+                               temporal_bounds=TemporalBounds(start_datetime='', end_datetime=end_datetime))
+
+def event(origin='', origin_type='', type_='', sub_type=''):
+    return Event(origin=origin, origin_type=origin_type, type_=type_, sub_type=sub_type, description='', ts_created='0')
+
+@attr('UNIT',group='dm')
+class SubscriptionIndexUnitTest(PyonTestCase):
+
+    def test_match(self):
+        user_info = {
+            'user_1' : {'notifications' : [notification('instrument_1', 'type_1', 'DeviceEvent', 'subtype_1')]},
+            'user_2' : {'notifications' : [notification(origin='instrument_1')]},
+            'user_3' : {'notifications' : [notification(event_type='DeviceEvent', event_subtype='*')]},
+            'user_4' : {'notifications' : [notification(origin='instrument_2', end_datetime='2012-01-01')]},
+        }
+        index = SubscriptionIndex.from_user_info(user_info)
+        self.assertEquals(len(index), 3) # The expired notification isn't indexed
+
+        users = index.match(event('instrument_1', 'type_1', 'DeviceEvent', 'subtype_1'))
+        self.assertEquals(sorted(users), ['user_1', 'user_2', 'user_3'])
+
+        users = index.match(event('instrument_1', 'type_1', 'ResourceEvent', 'subtype_1'))
+        self.assertEquals(users, ['user_2'])
+
+        users = index.match(event('instrument_2', 'type_2', 'DeviceEvent', ''))
+        self.assertEquals(users, ['user_3'])
+
+    def test_no_mixing_between_notifications(self):
+        # Attributes of different notifications of the same user don't combine
+        user_info = {'user_1' : {'notifications' : [notification('instrument_1', event_type='DeviceEvent'),
+                                                    notification('instrument_2', event_type='ResourceEvent')]}}
+        index = SubscriptionIndex.from_user_info(user_info)
+
+        self.assertEquals(index.match(event('instrument_1', type_='DeviceEvent')), ['user_1'])
+        self.assertEquals(index.match(event('instrument_1', type_='ResourceEvent')), [])
+
+    def test_add_remove(self):
+        index = SubscriptionIndex()
+        n = notification(origin='instrument_1')
+        index.add('user_1', n)
+        index.add('user_1', n)
+        index.remove('user_1', n)
+        self.assertEquals(index.match(event('instrument_1')), ['user_1'])
+
+        index.remove('user_1', n)
+        self.assertEquals(index.match(event('instrument_1')), [])
+        self.assertEquals(len(index), 0)
+        self.assertEquals(index._subscriptions, {})
+
+    def test_match_cost(self):
+        # Matching cost must not grow with the number of subscriptions: the dict lookups per event
+        # are bounded by the wildcard patterns in use, whatever the number of subscriptions
+        random.seed(0)
+        origins = ['instrument_%s' % i for i in xrange(5000)]
+        types = ['DeviceEvent', 'ResourceEvent', 'DetectionEvent', 'ResourceLifecycleEvent']
+        def pick(values):
+            # Roughly a third of the attributes are wildcards
+            return random.choice(values) if random.random() > 0.3 else ''
+
+        events = [event(random.choice(origins), 'PlatformDevice', random.choice(types), '') for i in xrange(20)]
+        for count in (1000, 30000):
+            notifications = {}
+            for i in xrange(count):
+                notifications['user_%s' % i] = notification(random.choice(origins), pick(['PlatformDevice', 'InstrumentDevice']), pick(types))
+            index = SubscriptionIndex.from_user_info(dict((user, {'notifications' : [n]}) for user, n in notifications.iteritems()))
+
+            lookups = [0]
+            subscriptions = index._subscriptions
+            class CountingDict(dict):
+                def __contains__(self, key):
+                    lookups[0] += 1
+                    return dict.__contains__(self, key)
+            index._subscriptions = CountingDict(subscriptions)
+
+            keys = [(user, SubscriptionIndex.key(n)) for user, n in notifications.iteritems()]
+            for e in events:
+                values = (e.origin, e.origin_type, e.type_, e.sub_type)
+                expected = [user for user, key in keys if all(k is None or k == v for k, v in zip(key, values))]
+                self.assertEquals(sorted(index.match(e)), sorted(expected))
+            log.info('Matched %s events against %s subscriptions with %s lookups', len(events), count, lookups[0])
+            self.assertTrue(lookups[0] <= 16 * len(events), lookups[0])
+
+
+@attr('UNIT',group='dm')
+class ReverseUserInfoUnitTest(PyonTestCase):
+
+    def test_calculate(self):
+        user_info = {
+            'user_1' : {'notifications' : [notification('instrument_1', 'type_1', 'DeviceEvent', ''),
+                                           notification('instrument_2', 'type_1', 'DeviceEvent', '')]},
+            'user_2' : {'notifications' : [notification('instrument_1', 'type_2', 'ResourceEvent', ''),
+                                           notification('instrument_3', end_datetime='2012-01-01')]},
+        }
+        reverse_user_info = calculate_reverse_user_info(user_info)
+
+        self.assertEquals(reverse_user_info['event_origin'], {'instrument_1' : set(['user_1', 'user_2']),
+                                                              'instrument_2' : set(['user_1'])})
+        self.assertEquals(reverse_user_info['event_origin_type'], {'type_1' : set(['user_1']),
+                                                                   'type_2' : set(['user_2'])})
+        self.assertEquals(reverse_user_info['event_type']['DeviceEvent'], set(['user_1']))
+        self.assertEquals(reverse_user_info['event_subtype'][''], set(['user_1', 'user_2']))
+
+        self.assertEquals(calculate_reverse_user_info({}), {})
+
+    def test_incremental_update(self):
+        old_notifications = [notification('instrument_1', event_type='DeviceEvent'),
+                             notification('instrument_2', event_type='DeviceEvent')]
+        new_notifications = [notification('instrument_2', event_type='ResourceEvent')]
+        user_info = {'user_1' : {'notifications' : old_notifications},
+                     'user_2' : {'notifications' : [notification('instrument_2', event_type='DeviceEvent')]}}
+        reverse_user_info = calculate_reverse_user_info(user_info)
+
+        remove_from_reverse_user_info(reverse_user_info, 'user_1', old_notifications)
+        add_to_reverse_user_info(reverse_user_info, 'user_1', new_notifications)
+        user_info['user_1']['notifications'] = new_notifications
+
+        self.assertEquals(reverse_user_info, calculate_reverse_user_info(user_info))
+        self.assertNotIn('instrument_1', reverse_user_info['event_origin'])
+
+
+@attr('UNIT',group='dm')
+class EmailDeliveryPoolUnitTest(PyonTestCase):
+    def setUp(self):
+        self.smtp_client = fake_smtplib.SMTP('localhost')
+        self.pool = EmailDeliveryPool(lambda: self.smtp_client, pool_size=2, max_queue=2, backoff=0)
+        self.addCleanup(self.pool.stop, timeout=0)
+
+    def deliver(self):
+        # Lets the pool drain its queue, yielding instead of waiting on the clock
+        self.pool.start()
+        for i in xrange(100):
+            if not (self.pool.depth or self.pool.stats()['busy']):
+                break
+            gevent.sleep(0)
+
+    def sent(self):
+        sent = []
+        while not self.smtp_client.sent_mail.empty():
+            sent.append(self.smtp_client.sent_mail.get())
+        return sent
+
+    def test_delivery_is_asynchronous(self):
+        self.pool.start()
+        stalled = gevent.event.Event()
+        send = self.smtp_client.sendmail
+        self.smtp_client.sendmail = Mock(side_effect=lambda *args: (stalled.wait(), send(*args)))
+
+        # A stalled SMTP server doesn't block the caller
+        self.assertTrue(self.pool.put(event('instrument_1'), 'user_1@example.com'))
+        gevent.sleep(0)
+        self.assertEquals(self.pool.stats()['busy'], 1)
+        self.assertEquals(self.sent(), [])
+
+        stalled.set()
+        self.deliver()
+        self.assertEquals(len(self.sent()), 1)
+
+    def test_coalescing(self):
+        for i in xrange(3):
+            self.pool.put(event('instrument_%s' % i), 'user_1@example.com')
+        self.pool.put(event('instrument_1'), 'user_2@example.com')
+        self.assertEquals(self.pool.depth, 2)
+
+        self.deliver()
+
+        sent = self.sent()
+        self.assertEquals(sorted(recipient for _, recipient, _ in sent), ['user_1@example.com', 'user_2@example.com'])
+        self.assertIn('3 ION events', [msg for _, recipient, msg in sent if recipient == 'user_1@example.com'][0])
+        self.assertEquals(self.pool.metrics['sent'], 4)
+        self.assertEquals(self.pool.metrics['coalesced'], 2)
+
+    def test_bounded_queue(self):
+        self.assertTrue(self.pool.put(event(), 'user_1@example.com'))
+        self.assertTrue(self.pool.put(event(), 'user_2@example.com'))
+        self.assertFalse(self.pool.put(event(), 'user_3@example.com'))
+        self.assertEquals(self.pool.metrics['dropped'], 1)
+
+    def test_retry(self):
+        failures = [IOError('connection refused')] * 2
+        send = self.smtp_client.sendmail
+        def sendmail(*args):
+            if failures:
+                raise failures.pop()
+            send(*args)
+        self.smtp_client.sendmail = sendmail
+
+        self.pool.put(event('instrument_1'), 'user_1@example.com')
+        self.deliver()
+
+        self.assertEquals(len(self.sent()), 1)
+        self.assertEquals(self.pool.metrics['retried'], 2)
+        self.assertEquals(self.pool.metrics['failed'], 0)
+
+    @patch('ion.services.dm.utility.uns_utility_methods.smtplib')
+    @patch('ion.services.dm.utility.uns_utility_methods.CFG')
+    def test_smtp_timeout(self, cfg, smtplib):
+        config = {'system.smtp': True, 'server.smtp.host': 'smtp.example.com', 'server.smtp.timeout': 5}
+        cfg.get_safe.side_effect = lambda key, default=None: config.get(key, default)
+
+        smtp_client = setting_up_smtp_client()
+        smtplib.SMTP.assert_called_once_with('smtp.example.com', timeout=5)
+        self.assertEquals(smtp_client, smtplib.SMTP.return_value)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/time_index.py
+@date Sun Oct 18 2026
+@description Sorted index over a coverage's temporal parameter
+'''
+
+from pyon.util.log import log
+
+import collections
+import numpy as np
+import os
+import time
+
+
+class TimeIndex(object):
+    '''
+    Sorted copy of a coverage's time values and the coverage index of each value.
+
+    Lookups are binary searches (O(log N) per time, vectorized for many times).
+    The index is brought up to date incrementally: only timesteps appended to the
+    coverage since the last update are read, and values arriving in order are
+    appended to buffers that grow by doubling, so an update costs the size of the
+    new data. When a path is given the index is persisted there (numpy .npz) so
+    it survives process restarts. The file is written when it doesn't exist yet
+    and then at most every SAVE_INTERVAL seconds; values newer than the file are
+    simply read again from the coverage after a restart.
+    '''
+    CACHE_LIMIT   = 100
+    SAVE_INTERVAL = 60.0 # Seconds between writes of an updated index
+
+    _indexes = collections.OrderedDict() # Process-wide indexes per dataset (LRU)
+
+    def __init__(self, path=None):
+        self.path   = path
+        self.dirty  = False
+        self._saved = 0
+        self._set(np.empty(0), np.empty(0, dtype='int64'))
+        if path and os.path.exists(path):
+            self.load()
+
+    @classmethod
+    def for_dataset(cls, dataset_id, path=None):
+        '''
+        The process-wide index for a dataset
+        '''
+        try:
+            index = cls._indexes.pop(dataset_id)
+        except KeyError:
+            index = cls(path)
+            if len(cls._indexes) >= cls.CACHE_LIMIT:
+                _, evicted = cls._indexes.popitem(0)
+                evicted.flush()
+        cls._indexes[dataset_id] = index
+        return index
+
+    @property
+    def values(self):
+        '''
+        Sorted time values
+        '''
+        return self._values[:self._count]
+
+    @property
+    def order(self):
+        '''
+        Coverage index of each sorted value
+        '''
+        return self._order[:self._count]
+
+    def __len__(self):
+        return self._count
+
+    def _set(self, values, order):
+        self._values = values
+        self._order  = order
+        self._count  = len(values)
+
+    def _append(self, values, order):
+        count = self._count + len(values)
+        if count > len(self._values) or self._values.dtype != values.dtype:
+            capacity = max(count, 2 * len(self._values), 1024)
+            grown_values = np.empty(capacity, dtype=np.result_type(self._values.dtype, values.dtype) if self._count else values.dtype)
+            grown_order  = np.empty(capacity, dtype='int64')
+            grown_values[:self._count] = self.values
+            grown_order[:self._count]  = self.order
+            self._values, self._order = grown_values, grown_order
+        self._values[self._count:count] = values
+        self._order[self._count:count]  = order
+        self._count = count
+
+    def load(self):
+        try:
+            npz = np.load(self.path)
+            self._set(npz['values'], npz['order'])
+            self._saved = time.time()
+        except Exception:
+            log.exception('Failed to load the time index at %s, it will be rebuilt', self.path)
+            self._set(np.empty(0), np.empty(0, dtype='int64'))
+
+    def save(self):
+        if not self.path:
+            return
+        # Written aside and renamed so readers never see a partial index
+        tmp_path = '%s.%s.tmp' % (self.path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, values=self.values, order=self.order)
+            os.rename(tmp_path, self.path)
+            self.dirty  = False
+            self._saved = time.time()
+        except (IOError, OSError):
+            log.exception('Failed to persist the time index at %s', self.path)
+
+    def flush(self):
+        '''
+        Writes the index if it changed since it was last written
+        '''
+        if self.dirty:
+            self.save()
+
+    def update(self, coverage):
+        '''
+        Adds the coverage's time values that aren't indexed yet
+        '''
+        count = coverage.num_timesteps
+        indexed = self._count
+        if count == indexed:
+            return
+        time_name = coverage.temporal_parameter_name
+        if count < indexed: # The coverage was replaced, start over
+            indexed = 0
+            self._set(np.empty(0), np.empty(0, dtype='int64'))
+        new_values = np.asanyarray(coverage.get_parameter_values(time_name, tdoa=slice(indexed, count))).ravel()
+        new_order  = np.arange(indexed, indexed + len(new_values), dtype='int64')
+
+        if len(new_values) > 1 and (np.diff(new_values) < 0).any():
+            sort = np.argsort(new_values, kind='mergesort')
+            new_values, new_order = new_values[sort], new_order[sort]
+
+        if not self._count or new_values[0] >= self.values[-1]:
+            # Monotonic data, the common case, is just appended
+            self._append(new_values, new_order)
+        else:
+            values = np.concatenate([self.values, new_values])
+            order  = np.concatenate([self.order, new_order])
+            sort = np.argsort(values, kind='mergesort')
+            self._set(values[sort], order[sort])
+
+        self.dirty = True
+        if self.path and (not os.path.exists(self.path) or time.time() - self._saved >= self.SAVE_INTERVAL):
+            self.save()
+
+    def nearest(self, times):
+        '''
+        Coverage index of the value closest to each time (a scalar time gives a scalar index).
+        Ties go to the smaller value, like an argmin over the absolute differences.
+        '''
+        if not len(self.values):
+            return None
+        scalar = np.isscalar(times)
+        times = np.atleast_1d(np.asanyarray(times))
+        right = np.searchsorted(self.values, times).clip(0, len(self.values) - 1)
+        left  = (right - 1).clip(0, len(self.values) - 1)
+        use_left = np.abs(times - self.values[left]) <= np.abs(self.values[right] - times)
+        idx = self.order[np.where(use_left, left, right)]
+        if scalar:
+            return int(idx[0])
+        return idx
+
+    def range(self, start=None, end=None):
+        '''
+        Coverage indices (sorted) of the values within [start, end]
+        '''
+        lo = 0 if start is None else np.searchsorted(self.values, start, side='left')
+        hi = len(self.values) if end is None else np.searchsorted(self.values, end, side='right')
+        return np.sort(self.order[lo:hi])
@@ -10,11 +10,14 @@ from pyon.event.event import EventPublisher
 from interface.objects import NotificationRequest, Event
 import smtplib
 import gevent
+import gevent.queue
 from gevent.timeout import Timeout
 import string
 from email.mime.text import MIMEText
 from gevent import Greenlet
+import collections
 import datetime
+import time
 
 class FakeScheduler(object):
 
@@ -61,7 +64,7 @@ class fake_smtplib(object):
         self.sent_mail = gevent.queue.Queue()
 
     @classmethod
-    def SMTP(cls,host):
+    def SMTP(cls,host,timeout=None):
         log.info("In fake_smtplib.SMTP method call. class: %s, host: %s" % (str(cls), str(host)))
         return cls(host)
 
@@ -82,15 +85,22 @@ def setting_up_smtp_client():
 
     ION_SMTP_SERVER = 'mail.oceanobservatories.org'
 
+    #------------------------------------------------------------------------------------
+    # seconds a connection or a send may block before it fails (and is retried)
+    #------------------------------------------------------------------------------------
+
+    SMTP_TIMEOUT = 30
+
     smtp_host = CFG.get_safe('server.smtp.host', ION_SMTP_SERVER)
     smtp_port = CFG.get_safe('server.smtp.port', 25)
     smtp_sender = CFG.get_safe('server.smtp.sender')
     smtp_password = CFG.get_safe('server.smtp.password')
+    smtp_timeout = CFG.get_safe('server.smtp.timeout', SMTP_TIMEOUT)
 
     if CFG.get_safe('system.smtp',False): #Default is False - use the fake_smtp
         log.debug('Using the real SMTP library to send email notifications!')
 
-        smtp_client = smtplib.SMTP(smtp_host)
+        smtp_client = smtplib.SMTP(smtp_host, timeout=smtp_timeout)
         smtp_client.ehlo()
         smtp_client.starttls()
         smtp_client.login(smtp_sender, smtp_password)
@@ -161,53 +171,248 @@ def send_email(message, msg_recipient, smtp_client):
 #    if CFG.get_safe('system.smtp',False):
 #        smtp_client.close()
 
-def check_user_notification_interest(event, reverse_user_info):
+def send_email_digest(messages, msg_recipient, smtp_client):
     '''
-    A method to check which user is interested in a notification or an event.
-    The input parameter event can be used interchangeably with notification in this method
-    Returns the list of users interested in the notification
-
-    @param event                Event
-    @param reverse_user_info    dict
+    Sends several events to a recipient in a single email
 
-    @retval user_names list
+    @param messages             list of Event
+    @param msg_recipient        str
+    @param smtp_client          fake or real smtp client object
     '''
 
-    user_list_1 = []
-    user_list_2 = []
-    user_list_3 = []
-    user_list_4 = []
-
-    if not isinstance(event, Event):
-        raise BadRequest("The input parameter should have been an Event.")
+    msg_body = ''
+    for count, message in enumerate(messages, 1):
+        msg_body += string.join(("Event %s: %s," % (count, message.type_),
+                                 "",
+                                 "Originator: %s," % message.origin,
+                                 "",
+                                 "Description: %s," % message.description,
+                                 "",
+                                 "Time stamp: %s," % message.ts_created,
+                                 "",
+                                 "------------------------",
+                                 ""),
+            "\r\n")
+
+    msg_body += string.join(("You received this notification from ION because you asked to be "\
+                             "notified about these events from these sources. ",
+                             "To modify or remove notifications about these events, "\
+                             "please access My Notifications Settings in the ION Web UI.",
+                             "Do not reply to this email.  This email address is not monitored "\
+                             "and the emails will not be read."),
+        "\r\n")
+    msg_subject = "(SysName: " + get_sys_name() + ") %s ION events" % len(messages)
 
-    if reverse_user_info.has_key('event_origin') and\
-       reverse_user_info.has_key('event_origin_type') and\
-       reverse_user_info.has_key('event_type') and\
-       reverse_user_info.has_key('event_subtype'):
-        pass
-    else:
-        raise BadRequest("Missing keys in reverse_user_info. Reverse_user_info not properly set up.")
+    msg = MIMEText(msg_body)
+    msg['Subject'] = msg_subject
+    msg['From'] = 'ION_notifications-do-not-reply@oceanobservatories.org'
+    msg['To'] = msg_recipient
 
+    smtp_sender = CFG.get_safe('server.smtp.sender')
 
-    if not event or not reverse_user_info:
-        raise BadRequest("Missing input parameters for method, check_user_notification_interest().")
+    smtp_client.sendmail(smtp_sender, msg_recipient, msg.as_string())
 
-    if reverse_user_info['event_origin'].has_key(event.origin):
-        user_list_1 = reverse_user_info['event_origin'][event.origin]
+class EmailDeliveryPool(object):
+    '''
+    Outbound email queue drained by a pool of greenlets, so a slow SMTP server doesn't hold up
+    the caller (the notification worker's event callback).
 
-    if reverse_user_info['event_origin_type'].has_key(event.origin_type):
-        user_list_2 = reverse_user_info['event_origin_type'][event.origin_type]
+    The queue is bounded by the number of recipients waiting for delivery: events for a recipient
+    that is already queued are coalesced and sent together in one email. A failed delivery is
+    retried with exponential backoff on a new SMTP connection before the events are dropped.
+    Each greenlet gets its own SMTP client from smtp_factory.
 
-    if reverse_user_info['event_type'].has_key(event.type_):
-        user_list_3 = reverse_user_info['event_type'][event.type_]
+        pool = EmailDeliveryPool(setting_up_smtp_client)
+        pool.start()
+        pool.put(event, 'user@example.com')
+    '''
+    POOL_SIZE         = 4
+    MAX_QUEUE         = 1000  # Recipients waiting for delivery
+    MAX_PER_RECIPIENT = 100   # Events coalesced into one email
+    MAX_RETRIES       = 3
+    BACKOFF           = 1.0   # Seconds before the first retry, doubled on every retry
+
+    def __init__(self, smtp_factory, pool_size=POOL_SIZE, max_queue=MAX_QUEUE, max_retries=MAX_RETRIES, backoff=BACKOFF):
+        self.smtp_factory = smtp_factory
+        self.pool_size    = pool_size
+        self.max_retries  = max_retries
+        self.backoff      = backoff
+        self._queue       = gevent.queue.Queue(maxsize=max_queue)
+        self._pending     = {} # recipient -> events waiting for delivery
+        self._greenlets   = []
+        self._busy        = 0
+        self.metrics      = collections.Counter()
+
+    @property
+    def depth(self):
+        '''
+        Number of recipients waiting for delivery
+        '''
+        return self._queue.qsize()
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats.update(depth=self.depth, pending_events=sum(len(v) for v in self._pending.itervalues()), busy=self._busy)
+        return stats
+
+    def start(self):
+        for i in xrange(self.pool_size):
+            self._greenlets.append(gevent.spawn(self._deliver_loop))
+
+    def stop(self, timeout=5):
+        '''
+        Waits up to timeout seconds for the queued emails to be delivered, then stops the pool
+        '''
+        deadline = time.time() + timeout
+        while self._greenlets and (self.depth or self._busy) and time.time() < deadline:
+            gevent.sleep(0.1)
+        gevent.killall(self._greenlets)
+        self._greenlets = []
+        if self._pending:
+            log.warning("Email delivery stopped with %s recipients still waiting", len(self._pending))
+
+    def put(self, message, msg_recipient):
+        '''
+        Queues an event for delivery to a recipient, returns False if it was dropped
+        '''
+        pending = self._pending.get(msg_recipient)
+        if pending is not None:
+            if len(pending) >= self.MAX_PER_RECIPIENT:
+                self.metrics['dropped'] += 1
+                return False
+            pending.append(message)
+            self.metrics['coalesced'] += 1
+            return True
+
+        try:
+            self._queue.put_nowait(msg_recipient)
+        except gevent.queue.Full:
+            log.warning("Email delivery queue is full (%s recipients), dropping an event for %s", self.depth, msg_recipient)
+            self.metrics['dropped'] += 1
+            return False
+        self._pending[msg_recipient] = [message]
+        self.metrics['queued'] += 1
+        return True
+
+    def _deliver_loop(self):
+        smtp_client = None
+        while True:
+            msg_recipient = self._queue.get()
+            messages = self._pending.pop(msg_recipient, [])
+            if not messages:
+                continue
+            self._busy += 1
+            try:
+                smtp_client = self._deliver(smtp_client, messages, msg_recipient)
+            finally:
+                self._busy -= 1
+
+    def _deliver(self, smtp_client, messages, msg_recipient):
+        '''
+        Sends the events to the recipient, returns the SMTP client to use next
+        '''
+        for attempt in xrange(self.max_retries + 1):
+            try:
+                if smtp_client is None:
+                    smtp_client = self.smtp_factory()
+                if len(messages) == 1:
+                    send_email(messages[0], msg_recipient, smtp_client)
+                else:
+                    send_email_digest(messages, msg_recipient, smtp_client)
+                self.metrics['sent'] += len(messages)
+                return smtp_client
+            except Exception:
+                smtp_client = None # Reconnect on the next attempt
+                if attempt == self.max_retries:
+                    log.exception("Failed to deliver %s events to %s", len(messages), msg_recipient)
+                    self.metrics['failed'] += len(messages)
+                    return None
+                self.metrics['retried'] += 1
+                gevent.sleep(self.backoff * 2 ** attempt)
+
+class SubscriptionIndex(object):
+    '''
+    Compiled index of the users' notification subscriptions, used by the notification workers.
+
+    Each active NotificationRequest is a subscription on (origin, origin_type, event_type, event_subtype),
+    an empty or '*' attribute is a wildcard that matches any value. Subscriptions are hashed on the
+    whole tuple, with wildcards stored as None, so an event is resolved with one dict lookup per
+    combination of wildcarded attributes in use (at most 16) whatever the number of subscriptions.
+    Unlike intersecting the reverse user info maps, attributes of different notifications of a
+    user are never mixed together.
+    '''
+    WILDCARDS = (None, '', '*')
 
-    if reverse_user_info['event_subtype'].has_key(event.sub_type):
-        user_list_4 = reverse_user_info['event_subtype'][event.sub_type]
+    def __init__(self):
+        self._subscriptions = {}                  # subscription key -> Counter of user names
+        self._masks = collections.Counter()       # wildcard pattern -> number of subscriptions using it
 
-    users = list( set.intersection(set(user_list_1), set(user_list_2), set(user_list_3), set(user_list_4)))
+    @classmethod
+    def from_user_info(cls, user_info=None):
+        '''
+        Builds the index from the user_info dictionary used by the UNS and the notification workers
+        '''
+        index = cls()
+        for user_name, value in (user_info or {}).iteritems():
+            for notification in value['notifications'] or []:
+                index.add(user_name, notification)
+        return index
 
-    return users
+    @classmethod
+    def key(cls, notification):
+        return tuple(None if v in cls.WILDCARDS else v for v in (notification.origin,
+                                                                  notification.origin_type,
+                                                                  notification.event_type,
+                                                                  notification.event_subtype))
+
+    @staticmethod
+    def is_active(notification):
+        # Expired notifications are not kept, the same as in the reverse user info
+        return isinstance(notification, NotificationRequest) and not notification.temporal_bounds.end_datetime
+
+    def __len__(self):
+        return sum(self._masks.itervalues())
+
+    def add(self, user_name, notification):
+        if not self.is_active(notification):
+            return
+        key = self.key(notification)
+        self._subscriptions.setdefault(key, collections.Counter())[user_name] += 1
+        self._masks[tuple(v is None for v in key)] += 1
+
+    def remove(self, user_name, notification):
+        if not self.is_active(notification):
+            return
+        key = self.key(notification)
+        users = self._subscriptions.get(key)
+        if not users or not users[user_name]:
+            return
+        users[user_name] -= 1
+        if not users[user_name]:
+            del users[user_name]
+        if not users:
+            del self._subscriptions[key]
+        mask = tuple(v is None for v in key)
+        self._masks[mask] -= 1
+        if not self._masks[mask]:
+            del self._masks[mask]
+
+    def match(self, event):
+        '''
+        Returns the list of users interested in the event
+        '''
+        values = (event.origin, event.origin_type, event.type_, event.sub_type)
+        users = set()
+        for mask in self._masks:
+            key = tuple(None if wildcard else value for wildcard, value in zip(mask, values))
+            if key in self._subscriptions:
+                users.update(self._subscriptions[key])
+        return list(users)
+
+REVERSE_USER_INFO_KEYS = (('event_type', 'event_type'),
+                          ('event_subtype', 'event_subtype'),
+                          ('event_origin', 'origin'),
+                          ('event_origin_type', 'origin_type'))
 
 def calculate_reverse_user_info(user_info=None):
     '''
@@ -218,17 +423,17 @@ def calculate_reverse_user_info(user_info=None):
 
     The reverse_user_info dictionary has the following form:
 
-    reverse_user_info = {'event_type' : { <event_type_1> : ['user_1', 'user_2'..],
-                                             <event_type_2> : ['user_3'],... },
+    reverse_user_info = {'event_type' : { <event_type_1> : set(['user_1', 'user_2'..]),
+                                             <event_type_2> : set(['user_3']),... },
 
-                        'event_subtype' : { <event_subtype_1> : ['user_1', 'user_2'..],
-                                               <event_subtype_2> : ['user_3'],... },
+                        'event_subtype' : { <event_subtype_1> : set(['user_1', 'user_2'..]),
+                                               <event_subtype_2> : set(['user_3']),... },
 
-                        'event_origin' : { <event_origin_1> : ['user_1', 'user_2'..],
-                                              <event_origin_2> : ['user_3'],... },
+                        'event_origin' : { <event_origin_1> : set(['user_1', 'user_2'..]),
+                                              <event_origin_2> : set(['user_3']),... },
 
-                        'event_origin_type' : { <event_origin_type_1> : ['user_1', 'user_2'..],
-                                                   <event_origin_type_2> : ['user_3'],... },
+                        'event_origin_type' : { <event_origin_type_1> : set(['user_1', 'user_2'..]),
+                                                   <event_origin_type_2> : set(['user_3']),... },
     '''
 
     if not user_info:
@@ -236,59 +441,50 @@ def calculate_reverse_user_info(user_info=None):
 
     reverse_user_info = {}
 
-    dict_1 = {}
-    dict_2 = {}
-    dict_3 = {}
-    dict_4 = {}
-
     for user_name, value in user_info.iteritems():
+        add_to_reverse_user_info(reverse_user_info, user_name, value['notifications'])
 
-        notifications = value['notifications']
-
-        if notifications:
-
-            for notification in notifications:
-
-                # If the notification has expired, do not keep it in the reverse user info that the notification
-                # workers use
-                if notification.temporal_bounds.end_datetime:
-                    continue
-
-                if not isinstance(notification, NotificationRequest):
-                    continue
-
-                if dict_1.has_key(notification.event_type) and notification.event_type:
-                    dict_1[notification.event_type].append(user_name)
-                    # to remove duplicate user names
-                    dict_1[notification.event_type] = list(set(dict_1[notification.event_type]))
-                else:
-                    dict_1[notification.event_type] = [user_name]
-
-                if dict_2.has_key(notification.event_subtype) and notification.event_subtype:
-                    dict_2[notification.event_subtype].append(user_name)
-                    # to remove duplicate user names
-                    dict_2[notification.event_subtype] = list(set(dict_2[notification.event_subtype]))
-                else:
-                    dict_2[notification.event_subtype] = [user_name]
-
-                if dict_3.has_key(notification.origin) and notification.origin:
-                    dict_3[notification.origin].append(user_name)
-                    # to remove duplicate user names
-                    dict_3[notification.origin] = list(set(dict_3[notification.origin]))
-                else:
-                    dict_3[notification.origin] = [user_name]
+    return reverse_user_info
 
-                if dict_4.has_key(notification.origin_type) and notification.origin_type:
-                    dict_4[notification.origin_type].append(user_name)
-                    # to remove duplicate user names
-                    dict_4[notification.origin_type] = list(set(dict_4[notification.origin_type]))
-                else:
-                    dict_4[notification.origin_type] = [user_name]
+def _active_notifications(notifications):
+    for notification in notifications or []:
+        # If the notification has expired, do not keep it in the reverse user info that the notification
+        # workers use
+        if not isinstance(notification, NotificationRequest):
+            continue
+        if notification.temporal_bounds.end_datetime:
+            continue
+        yield notification
+
+def add_to_reverse_user_info(reverse_user_info, user_name, notifications):
+    '''
+    Adds a user's notifications to the reverse user info in place
 
-                reverse_user_info['event_type'] = dict_1
-                reverse_user_info['event_subtype'] = dict_2
-                reverse_user_info['event_origin'] = dict_3
-                reverse_user_info['event_origin_type'] = dict_4
+    @param reverse_user_info    dict
+    @param user_name            str
+    @param notifications        list
+    '''
+    for notification in _active_notifications(notifications):
+        for key, attr in REVERSE_USER_INFO_KEYS:
+            reverse_user_info.setdefault(key, {}).setdefault(getattr(notification, attr), set()).add(user_name)
 
-    return reverse_user_info
+def remove_from_reverse_user_info(reverse_user_info, user_name, notifications):
+    '''
+    Removes a user from the reverse user info entries of the given notifications, in place.
+    Pass all of the user's notifications: a user is dropped from an entry even if another of
+    their notifications shares it.
 
+    @param reverse_user_info    dict
+    @param user_name            str
+    @param notifications        list
+    '''
+    for notification in _active_notifications(notifications):
+        for key, attr in REVERSE_USER_INFO_KEYS:
+            entries = reverse_user_info.get(key, {})
+            value = getattr(notification, attr)
+            users = entries.get(value)
+            if users is None:
+                continue
+            users.discard(user_name)
+            if not users:
+                del entries[value]